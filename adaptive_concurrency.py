@@ -0,0 +1,175 @@
+import collections
+import contextlib
+import threading
+import time
+
+import call_metrics
+
+# Adaptive limits on the chat calls in flight, one per endpoint and stage.
+#
+# Each limit follows AIMD (additive increase, multiplicative decrease), like TCP congestion control:
+# every call that filled the limit when it started and comes back at a normal latency raises the limit by
+# 1/limit, so it grows by about one per round of calls. Calls made while the limit is not reached say
+# nothing about whether more would be served as fast, so they never raise it. A call that times out or is refused with a 503/429 cuts it by decrease_factor, and
+# so does a sustained rise in latency. Single calls are never judged on their own, because LLM latency
+# varies a lot with the length of the answer; the limiter compares a smoothed latency (EWMA) with the
+# lowest smoothed latency of the recent past. Temperature and selection calls are limited separately because
+# their latencies differ. The limits and every change to them are reported as metrics.
+
+# Limits start here and stay between min_limit and max_limit
+initial_limit = 4
+min_limit = 1
+max_limit = 64
+# Latency has risen when the smoothed latency exceeds latency_tolerance times the baseline latency
+latency_tolerance = 2.0
+decrease_factor = 0.5
+# Weight of each call in the smoothed latency, so a rise has to last about 1/latency_smoothing calls
+latency_smoothing = 0.05
+# Calls averaged before the smoothed latency is used, at the start and again after every decrease
+warmup_calls = 20
+# The baseline latency is the lowest smoothed latency of the last baseline_window seconds, so it follows a
+# server that has become permanently slower once the window has passed
+baseline_window = 30.0
+# Decisions kept for stats()
+decision_log_size = 100
+
+# Function to decide whether an error means the server is overloaded: a timeout or a 503/429 response
+def is_overload(error):
+    if isinstance(error, TimeoutError):
+        return True
+    if getattr(error, 'status_code', None) in (429, 503):
+        return True
+    return type(error).__name__ in ('TimeoutException', 'ReadTimeout', 'ConnectTimeout', 'PoolTimeout', 'WriteTimeout')
+
+# AIMD limit on the calls in flight for one endpoint and stage
+class AimdLimiter:
+    def __init__(self, name, initial=None, minimum=None, maximum=None):
+        self.name = name
+        self.min_limit = min_limit if minimum is None else minimum
+        self.max_limit = max_limit if maximum is None else maximum
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit if initial is None else initial)))
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.smoothed = None
+        self.baseline = None
+        # Calls in the smoothed latency since the start or the last decrease
+        self._samples = 0
+        # (time, smoothed latency) with rising latencies, so the first is the lowest in the window
+        self._window = collections.deque()
+        self.calls = 0
+        self.increases = 0
+        self.decreases = 0
+        self.decisions = collections.deque(maxlen=decision_log_size)
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    # Function to wait until a call may start under the current limit, inside the while_waiting context
+    # manager when it has to wait; returns whether the call fills the limit, to be passed on to release
+    def acquire(self, while_waiting=None):
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                with while_waiting or contextlib.nullcontext():
+                    while self.in_flight >= int(self.limit):
+                        self._condition.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return self.in_flight >= int(self.limit)
+
+    # Function to finish a call, adjusting the limit from its latency and whether the server was overloaded;
+    # at_limit is what acquire returned, and only calls that filled the limit may raise it
+    def release(self, latency, overloaded=False, at_limit=False):
+        with self._condition:
+            self.in_flight -= 1
+            self.calls += 1
+            now = time.monotonic()
+            settled = False
+            if not overloaded:
+                # A plain average until warmup_calls calls are in, so one fast or slow call does not set the level
+                self._samples += 1
+                weight = max(latency_smoothing, 1 / self._samples)
+                self.smoothed = latency if self.smoothed is None else self.smoothed + weight * (latency - self.smoothed)
+                settled = self._samples >= warmup_calls
+            if overloaded:
+                reason = 'overload'
+            elif settled and self.baseline is not None and self.smoothed > self.baseline * latency_tolerance:
+                reason = 'latency'
+            else:
+                reason = None
+            if settled:
+                self._update_baseline(now, self.smoothed)
+
+            previous_limit = int(self.limit)
+            if reason is not None:
+                # Back off at most once per baseline round trip, so calls that were already in flight
+                # during the same slowdown do not cut the limit again
+                if now - self._last_decrease >= (self.baseline or latency):
+                    self.limit = max(self.min_limit, self.limit * decrease_factor)
+                    self._last_decrease = now
+                    self.decreases += 1
+                    self._record(reason, previous_limit, latency)
+                    # The latencies measured at the old limit say nothing about the new one
+                    self._samples = 0
+            elif at_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if int(self.limit) > previous_limit:
+                    self.increases += 1
+                    self._record('increase', previous_limit, latency)
+            self._condition.notify_all()
+
+    def _update_baseline(self, now, latency):
+        while self._window and self._window[-1][1] >= latency:
+            self._window.pop()
+        self._window.append((now, latency))
+        while self._window[0][0] < now - baseline_window:
+            self._window.popleft()
+        self.baseline = self._window[0][1]
+
+    def _record(self, reason, previous_limit, latency):
+        decision = {
+            'time': time.time(),
+            'limiter': self.name,
+            'decision': reason,
+            'previous_limit': previous_limit,
+            'limit': int(self.limit),
+            'latency': round(latency, 6),
+            'smoothed_latency': round(self.smoothed, 6) if self.smoothed is not None else None,
+            'baseline': round(self.baseline, 6) if self.baseline is not None else None,
+            'in_flight': self.in_flight,
+        }
+        self.decisions.append(decision)
+        call_metrics.record_event('concurrency', decision)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limiter': self.name,
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'calls': self.calls,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'smoothed_latency': round(self.smoothed, 6) if self.smoothed is not None else None,
+                'baseline_latency': round(self.baseline, 6) if self.baseline is not None else None,
+                'recent_decisions': list(self.decisions)[-5:],
+            }
+
+# The limiters of every endpoint and stage, created on first use
+class AdaptiveConcurrency:
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    # Function to return the limiter of an endpoint and stage
+    def limiter(self, host, stage):
+        key = f"{host}/{stage}"
+        with self._lock:
+            if key not in self._limiters:
+                self._limiters[key] = AimdLimiter(key)
+            return self._limiters[key]
+
+    # Function to report the current limit and recent decisions of every limiter
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return [limiter.stats() for limiter in limiters]
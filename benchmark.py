@@ -0,0 +1,517 @@
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import current_results
+import final_results
+import hybrid_results
+import ollama_client
+import text_processing
+from rule_engine import RuleEngine
+from parallel_runner import imap_ordered
+from prompts import (BATCH_TEMPERATURE_SYSTEM_PROMPT, EXTRACTION_SYSTEM_PROMPT, SELECTION_SYSTEM_PROMPT,
+                     TEMPERATURE_SYSTEM_PROMPT)
+
+# Offline throughput benchmark for the pipelines.
+#
+# FakeOllama stands in for ollama.chat and replays the findings committed in final_results.csv and
+# current_results.csv, with configurable latency and failure injection, so throughput can be
+# measured without a live model. With --endpoints N the calls are spread over N fake endpoints,
+# and with --stub-servers each of them is served over HTTP and reached through ollama.Client.
+#
+# Usage: python benchmark.py [--latency 0.05] [--failure-rate 0.0] [--repeat 5] [--workers 1,4]
+#        python benchmark.py --serve 3 [--port 11500]   (only run stub Ollama servers)
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+final_results_csv = os.path.join(package_dir, 'final_results.csv')
+current_results_csv = os.path.join(package_dir, 'current_results.csv')
+input_fieldnames = ['report_output_folder', 'body_part_file_name', 'full_path', 'report_content']
+
+# Error raised by FakeOllama for injected failures; its status code makes ollama_client retry it
+class FakeServerError(Exception):
+    def __init__(self, error, status_code=503):
+        super().__init__(error)
+        self.error = error
+        self.status_code = status_code
+
+# Function to normalise report text so prompts can be matched back to the committed reports
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+# Function to split committed findings into their statements
+def split_statements(findings):
+    return [statement.strip() for statement in findings.split(';') if statement.strip(' .')]
+
+# Function to count the words two pieces of text share
+def token_overlap(text1, text2):
+    return len(set(re.findall(r'[a-z0-9]+', text1.lower())) & set(re.findall(r'[a-z0-9]+', text2.lower())))
+
+# Deterministic in-process stand-in for ollama.chat
+class FakeOllama:
+    def __init__(self, latency=0.05, jitter=0.0, failure_rate=0.0, disagreement_rate=0.2, seed=0,
+                 final_csv_path=final_results_csv, current_csv_path=current_results_csv, loaded_models=(),
+                 malformed_batch_rate=0.0, capacity=None, reject_above=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.disagreement_rate = disagreement_rate
+        self.malformed_batch_rate = malformed_batch_rate
+        # Calls served at full speed at once; beyond that every call slows down in proportion, like a GPU
+        # sharing its time, and beyond reject_above calls are refused with a 503. latency can also be
+        # changed while a run is going, to inject a slowdown.
+        self.capacity = capacity
+        self.reject_above = reject_above
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.call_latencies = []
+        self.loaded_models = set(loaded_models)
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self.report_findings = self._load_findings(final_csv_path, 'Key Findings')
+        self.sentence_findings = self._load_findings(current_csv_path, 'Findings')
+        self.extract_statements = self._attribute_statements(self.report_findings)
+
+    @staticmethod
+    def _load_findings(csv_path, column):
+        findings = {}
+        with open(csv_path, 'r', encoding='utf-8') as infile:
+            for row in csv.DictReader(infile):
+                findings[normalize_text(row['report_content'])] = row.get(column, '')
+        return findings
+
+    # Function to attribute every committed single-pass statement to the report sentence it shares the most
+    # words with, so a report with some sentences removed can still be answered
+    @staticmethod
+    def _attribute_statements(report_findings):
+        statements_by_sentence = {}
+        for report_content, findings in report_findings.items():
+            sentences = text_processing.split_sentences(report_content)
+            for statement in split_statements(findings):
+                overlaps = [token_overlap(statement, sentence) for sentence in sentences]
+                if overlaps and max(overlaps):
+                    sentence = normalize_text(sentences[overlaps.index(max(overlaps))])
+                    statements_by_sentence.setdefault(sentence, []).append(statement)
+        return statements_by_sentence
+
+    # Function to answer the single-pass extraction of a report; a report the pipeline has shortened (the rule
+    # fast path removes the sentences it answers) gets the committed statements of the sentences left
+    def extract_findings(self, report_content):
+        findings = self.report_findings.get(normalize_text(report_content))
+        if findings is not None:
+            return findings
+        statements = [statement for sentence in text_processing.split_sentences(report_content)
+                      for statement in self.extract_statements.get(normalize_text(sentence), [])]
+        return '; '.join(dict.fromkeys(statements))
+
+    # Function to draw a deterministic random number generator for this request and attempt
+    def _request_random(self, model, messages):
+        request_hash = hashlib.sha256(json.dumps([model, messages], sort_keys=True).encode('utf-8')).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(request_hash, 0)
+            self._attempts[request_hash] = attempt + 1
+        return random.Random(f"{self.seed}:{request_hash}:{attempt}")
+
+    def chat(self, model, messages, **kwargs):
+        request_random = self._request_random(model, messages)
+        delay = max(0.0, self.latency + request_random.uniform(-self.jitter, self.jitter))
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            in_flight = self.in_flight
+        try:
+            if self.reject_above is not None and in_flight > self.reject_above:
+                with self._lock:
+                    self.failures += 1
+                raise FakeServerError("Server overloaded")
+            if self.capacity:
+                delay *= max(1.0, in_flight / self.capacity)
+            time.sleep(delay)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        with self._lock:
+            self.calls += 1
+            self.call_latencies.append(delay)
+            if request_random.random() < self.failure_rate:
+                self.failures += 1
+                raise FakeServerError("Injected failure")
+            self.loaded_models.add(model)
+
+        content = self.respond(model, messages, request_random)
+        prompt_tokens = sum(len(message['content']) for message in messages) // 4
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+        if kwargs.get('stream'):
+            return self.stream_chunks(model, content, prompt_tokens, delay)
+        return {
+            'model': model,
+            'message': {'role': 'assistant', 'content': content},
+            'done': True,
+            'prompt_eval_count': prompt_tokens,
+            'eval_count': len(content) // 4,
+            'prompt_eval_duration': int(delay * 0.5e9),
+            'eval_duration': int(delay * 0.5e9),
+            'total_duration': int(delay * 1e9),
+        }
+
+    # Function to list the loaded models like ollama.ps()
+    def ps(self):
+        with self._lock:
+            return {'models': [{'name': model, 'model': model} for model in sorted(self.loaded_models)]}
+
+    # Function to stream a response in roughly token-sized chunks, ending with the counters like Ollama does
+    def stream_chunks(self, model, content, prompt_tokens, delay):
+        for start in range(0, len(content), 4):
+            yield {'model': model, 'message': {'role': 'assistant', 'content': content[start:start + 4]}, 'done': False}
+        yield {
+            'model': model,
+            'message': {'role': 'assistant', 'content': ''},
+            'done': True,
+            'done_reason': 'stop',
+            'prompt_eval_count': prompt_tokens,
+            'eval_count': (len(content) + 3) // 4,
+            'prompt_eval_duration': int(delay * 0.5e9),
+            'eval_duration': int(delay * 0.5e9),
+            'total_duration': int(delay * 1e9),
+        }
+
+    # Function to build the replayed response for a request, based on which stage's prompt it carries
+    def respond(self, model, messages, request_random):
+        system_prompt = messages[0]['content'] if messages[0]['role'] == 'system' else ''
+        user_prompt = messages[-1]['content']
+
+        if system_prompt == SELECTION_SYSTEM_PROMPT:
+            return "1"
+
+        if system_prompt == EXTRACTION_SYSTEM_PROMPT:
+            report_content = user_prompt.split(':', 1)[-1].strip().strip('"')
+            return json.dumps({"Findings": self.extract_findings(report_content)})
+
+        if system_prompt == TEMPERATURE_SYSTEM_PROMPT:
+            context, _, instruction = user_prompt.partition('\n\n---\n\n')
+            sentence = instruction.strip().splitlines()[-1].strip('"')
+            return json.dumps({"Findings": self.sentence_response(model, context.split(':', 1)[-1], sentence, request_random)})
+
+        if system_prompt == BATCH_TEMPERATURE_SYSTEM_PROMPT:
+            context, _, instruction = user_prompt.partition('\n\n---\n\n')
+            report_content = context.split(':', 1)[-1]
+            sentences = [line.split(':', 1)[1].strip().strip('"') for line in instruction.strip().splitlines()
+                         if line.startswith('Sentence ')]
+            entries = [{"Sentence": number, "Findings": self.sentence_response(model, report_content, sentence, request_random)}
+                       for number, sentence in enumerate(sentences, start=1)]
+            # Injected malformed answers drop the last sentence, so the pipeline has to ask about it alone
+            if request_random.random() < self.malformed_batch_rate:
+                entries = entries[:-1]
+            return json.dumps({"Sentences": entries})
+
+        return json.dumps({"Findings": ""})
+
+    # Function to build the replayed findings of one sentence for a temperature model
+    def sentence_response(self, model, report_content, sentence, request_random):
+        statements = split_statements(self.sentence_findings.get(normalize_text(report_content), ''))
+        if not statements:
+            return f"There is {sentence}"
+        ranked = sorted(statements, key=lambda statement: -token_overlap(statement, sentence))
+        # Models above temperature 0 occasionally add a second statement, so the selection stage has work to do
+        if model != 'temp_0.0:latest' and len(ranked) > 1 and request_random.random() < self.disagreement_rate:
+            return f"{ranked[0]}; {ranked[1]}"
+        return ranked[0]
+
+# Local HTTP server speaking the parts of the Ollama API the pipelines use (/api/chat, /api/ps,
+# /api/tags), answered by a FakeOllama, so ollama.Client can be pointed at several stub endpoints
+class FakeOllamaServer:
+    def __init__(self, fake=None, host='127.0.0.1', port=0):
+        self.fake = fake or FakeOllama()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.host = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def _make_handler(self):
+        fake = self.fake
+
+        class FakeOllamaHandler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps the connection open between requests, like Ollama does
+            protocol_version = 'HTTP/1.1'
+            # Stream chunks are tiny writes, which Nagle's algorithm would hold back
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    # Clients drop idle kept-alive connections when they shut down
+                    pass
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, chunks):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for chunk in chunks:
+                        data = (json.dumps(chunk) + '\n').encode('utf-8')
+                        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+                        self.wfile.flush()
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading early, which cancels the generation
+                    self.close_connection = True
+
+            def do_GET(self):
+                if self.path in ('/api/ps', '/api/tags'):
+                    self._send_json(200, fake.ps())
+                elif self.path == '/':
+                    self._send_json(200, {'status': 'Ollama is running'})
+                else:
+                    self._send_json(404, {'error': 'Not found'})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path != '/api/chat':
+                    self._send_json(404, {'error': 'Not found'})
+                    return
+                # Ollama streams unless the request says otherwise
+                stream = request.get('stream', True)
+                try:
+                    response = fake.chat(request['model'], request['messages'], stream=stream)
+                except FakeServerError as e:
+                    self._send_json(e.status_code, {'error': e.error})
+                    return
+                if stream:
+                    self._send_stream(response)
+                else:
+                    self._send_json(200, response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return FakeOllamaHandler
+
+    # Function to serve requests on a background thread
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Function to write a benchmark input CSV from the committed results, repeating the reports
+def write_benchmark_input(path, repeat=1):
+    with open(current_results_csv, 'r', encoding='utf-8') as infile:
+        rows = list(csv.DictReader(infile))
+    with open(path, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=input_fieldnames)
+        writer.writeheader()
+        for copy in range(repeat):
+            for row in rows:
+                row = {name: row[name] for name in input_fieldnames}
+                # Keep the checkpoint keys unique across copies
+                row['full_path'] = f"{copy}/{row['full_path']}"
+                writer.writerow(row)
+    return len(rows) * repeat
+
+# Function to compute a percentile of a list of numbers
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+# Function to run one benchmark configuration and summarise its throughput. fakes is one FakeOllama
+# or a list of them, one per endpoint; stub_servers serves each over HTTP instead of calling it in-process.
+def run_configuration(pipeline, input_path, workers, fakes, concurrency=None, stub_servers=False, adaptive_concurrency=False):
+    fakes = fakes if isinstance(fakes, (list, tuple)) else [fakes]
+    module = {'final': final_results, 'current': current_results, 'hybrid': hybrid_results}[pipeline]
+    report_latencies = []
+    latency_lock = threading.Lock()
+    original_extract_findings = module.extract_findings
+
+    # Time every report by wrapping the module's extract_findings
+    def timed_extract_findings(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original_extract_findings(*args, **kwargs)
+        finally:
+            with latency_lock:
+                report_latencies.append(time.perf_counter() - started)
+
+    servers = [FakeOllamaServer(fake).start() for fake in fakes] if stub_servers else []
+    if servers:
+        ollama_client.configure(hosts=[server.host for server in servers], adaptive_limits=adaptive_concurrency)
+    else:
+        ollama_client.configure(backend=list(fakes), adaptive_limits=adaptive_concurrency)
+    original_semaphore = current_results.chat_semaphore
+    original_adaptive_concurrency = current_results.adaptive_concurrency
+    # With adaptive limits the ensemble has no fixed cap, unless the configuration sets one
+    current_results.apply_config({'adaptive_concurrency': adaptive_concurrency})
+    if concurrency:
+        current_results.chat_semaphore = threading.BoundedSemaphore(concurrency)
+    module.extract_findings = timed_extract_findings
+    hybrid_results.escalation = hybrid_results.EscalationStats()
+    calls_before = [fake.calls for fake in fakes]
+    prompt_tokens_before = sum(fake.prompt_tokens for fake in fakes)
+    with tempfile.TemporaryDirectory() as output_dir:
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if pipeline == 'final':
+                    final_results.error_csv_path = os.path.join(output_dir, 'error.csv')
+                    final_results.process_csv_file(input_path, os.path.join(output_dir, 'output.csv'), workers=workers)
+                else:
+                    with open(input_path, 'r', encoding='utf-8') as infile:
+                        rows = list(csv.DictReader(infile))
+                    for _ in imap_ordered(lambda row: module.extract_findings(row['report_content'], row['body_part_file_name']),
+                                          rows, workers):
+                        pass
+        finally:
+            elapsed = time.perf_counter() - started
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            concurrency_limits = {limiter['limiter']: limiter['limit'] for limiter in ollama_client.concurrency_stats() or []}
+            escalation = hybrid_results.escalation.stats() if pipeline == 'hybrid' else None
+            module.extract_findings = original_extract_findings
+            current_results.apply_config({'adaptive_concurrency': original_adaptive_concurrency})
+            current_results.chat_semaphore = original_semaphore
+            ollama_client.configure()
+            for server in servers:
+                server.stop()
+
+    reports = len(report_latencies)
+    endpoint_calls = [fake.calls - before for fake, before in zip(fakes, calls_before)]
+    prompt_tokens = sum(fake.prompt_tokens for fake in fakes) - prompt_tokens_before
+    return {
+        'pipeline': pipeline,
+        'workers': workers,
+        'concurrency': concurrency,
+        'endpoints': len(fakes),
+        'reports': reports,
+        'seconds': round(elapsed, 3),
+        'reports_per_sec': round(reports / elapsed, 3) if elapsed else 0.0,
+        'calls_per_report': round(sum(endpoint_calls) / reports, 2) if reports else 0.0,
+        'endpoint_calls': endpoint_calls,
+        'prompt_tokens_per_report': round(prompt_tokens / reports) if reports else 0,
+        'report_latency_p50': round(percentile(report_latencies, 0.5), 4),
+        'report_latency_p95': round(percentile(report_latencies, 0.95), 4),
+        'peak_memory_mb': round(peak_memory / (1024 * 1024), 2),
+        'peak_in_flight': max(fake.peak_in_flight for fake in fakes),
+        'concurrency_limits': concurrency_limits,
+        'escalation_rate': escalation['escalation_rate'] if escalation else None,
+    }
+
+# Function to run the serial and concurrent configurations for each pipeline
+def run_benchmark(pipelines=('final', 'current'), worker_counts=(1, 4), repeat=1, latency=0.05, jitter=0.0,
+                  failure_rate=0.0, seed=0, endpoints=1, stub_servers=False, batch_sentences=False, rule_fast_path=False,
+                  capacity=None, adaptive_concurrency=False):
+    results = []
+    original_batch_sentences = current_results.batch_sentences
+    current_results.batch_sentences = batch_sentences
+    with tempfile.TemporaryDirectory() as input_dir:
+        input_path = os.path.join(input_dir, 'valid_reports.csv')
+        write_benchmark_input(input_path, repeat)
+        for pipeline in pipelines:
+            for workers in worker_counts:
+                fakes = [FakeOllama(latency=latency, jitter=jitter, failure_rate=failure_rate, seed=seed, capacity=capacity)
+                         for _ in range(endpoints)]
+                # The serial configuration also runs the ensemble one call at a time
+                concurrency = 1 if workers == 1 else None
+                # Every configuration counts its own rule hits
+                for module in (final_results, current_results):
+                    module.fast_path = RuleEngine() if rule_fast_path else None
+                result = run_configuration(pipeline, input_path, workers, fakes, concurrency, stub_servers,
+                                           adaptive_concurrency)
+                result['injected_failures'] = sum(fake.failures for fake in fakes)
+                results.append(result)
+    current_results.batch_sentences = original_batch_sentences
+    final_results.fast_path = current_results.fast_path = None
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark against a fake Ollama backend")
+    parser.add_argument('--pipelines', default='final,current', help="comma separated: final, current, hybrid")
+    parser.add_argument('--workers', default='1,4', help="comma separated worker counts to compare")
+    parser.add_argument('--repeat', type=int, default=1, help="number of copies of the committed reports to process")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per fake chat call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="uniform +/- jitter on the latency, in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of calls that fail with a 503")
+    parser.add_argument('--retry-delay', type=float, default=0.01, help="base retry delay used during the benchmark")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--endpoints', type=int, default=1, help="number of fake endpoints to spread the calls over")
+    parser.add_argument('--stub-servers', action='store_true',
+                        help="serve every fake endpoint over HTTP and reach it through ollama.Client")
+    parser.add_argument('--batch-sentences', action='store_true',
+                        help="ask the temperature models about all sentences of a report in one call (current pipeline)")
+    parser.add_argument('--rule-fast-path', action='store_true', help="answer formulaic sentences by rule")
+    parser.add_argument('--capacity', type=int, default=None,
+                        help="calls a fake endpoint serves at full speed; more slow every call down in proportion")
+    parser.add_argument('--adaptive-concurrency', action='store_true',
+                        help="adjust the calls in flight per endpoint and stage to the observed latency")
+    parser.add_argument('--serve', type=int, default=0, metavar='N', help="only run N stub Ollama servers until interrupted")
+    parser.add_argument('--port', type=int, default=11500, help="first port used by --serve")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    if args.serve:
+        servers = [FakeOllamaServer(FakeOllama(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                                               seed=args.seed, capacity=args.capacity), port=args.port + index).start()
+                   for index in range(args.serve)]
+        print("Stub Ollama servers: " + ' '.join(server.host for server in servers))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        for server in servers:
+            server.stop()
+        raise SystemExit(0)
+
+    ollama_client.retry_base_delay = args.retry_delay
+    results = run_benchmark(
+        pipelines=[pipeline.strip() for pipeline in args.pipelines.split(',')],
+        worker_counts=[int(workers) for workers in args.workers.split(',')],
+        repeat=args.repeat,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+        endpoints=args.endpoints,
+        stub_servers=args.stub_servers,
+        batch_sentences=args.batch_sentences,
+        rule_fast_path=args.rule_fast_path,
+        capacity=args.capacity,
+        adaptive_concurrency=args.adaptive_concurrency,
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        columns = ['pipeline', 'workers', 'reports', 'seconds', 'reports_per_sec', 'calls_per_report',
+                   'prompt_tokens_per_report', 'report_latency_p50', 'report_latency_p95', 'peak_memory_mb', 'peak_in_flight',
+                   'injected_failures', 'escalation_rate']
+        print(' '.join(f"{column:>18}" for column in columns))
+        for result in results:
+            print(' '.join(f"{str(result[column]):>18}" for column in columns))
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+
+# Per-call instrumentation of the chat requests. Every call is written as a JSON line (when a
+# metrics file is configured) and aggregated per stage and per model for the end-of-run summary.
+
+# Upper bounds, in seconds, of the wall time histogram buckets
+HISTOGRAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+# Token and duration fields Ollama returns with every chat response
+RESPONSE_FIELDS = ('prompt_eval_count', 'eval_count', 'prompt_eval_duration', 'eval_duration',
+                   'load_duration', 'total_duration')
+
+_lock = threading.Lock()
+_metrics_file = None
+_aggregates = {}
+
+# Function to start a new run, optionally writing every call to a JSON lines file
+def configure(metrics_path=None):
+    global _metrics_file
+    with _lock:
+        if _metrics_file is not None:
+            _metrics_file.close()
+        _metrics_file = open(metrics_path, 'a', encoding='utf-8') if metrics_path else None
+        _aggregates.clear()
+
+# Function to read a field from an ollama response (dict or response object), None when missing
+def response_field(response, name):
+    try:
+        return response[name]
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+def _new_aggregate():
+    return {
+        'calls': 0,
+        'errors': 0,
+        'cached': 0,
+        'wall_times': [],
+        'histogram': [0] * len(HISTOGRAM_BUCKETS),
+        **{name: 0 for name in RESPONSE_FIELDS},
+    }
+
+# Function to record one chat call
+def record(model, stage, wall_time, response=None, error=None, cached=False, attempt=1, host=None):
+    entry = {
+        'time': time.time(),
+        'model': model,
+        'stage': stage,
+        'host': host,
+        'attempt': attempt,
+        'wall_time': round(wall_time, 6),
+        'cached': cached,
+        'error': str(error) if error is not None else None,
+    }
+    if response is not None and not cached:
+        for name in RESPONSE_FIELDS:
+            entry[name] = response_field(response, name)
+
+    with _lock:
+        if _metrics_file is not None:
+            _metrics_file.write(json.dumps(entry) + '\n')
+            _metrics_file.flush()
+        for key in (('stage', stage), ('model', model)):
+            aggregate = _aggregates.setdefault(key, _new_aggregate())
+            aggregate['calls'] += 1
+            aggregate['errors'] += error is not None
+            aggregate['cached'] += cached
+            aggregate['wall_times'].append(wall_time)
+            bucket = next(index for index, bound in enumerate(HISTOGRAM_BUCKETS) if wall_time <= bound)
+            aggregate['histogram'][bucket] += 1
+            for name in RESPONSE_FIELDS:
+                aggregate[name] += entry.get(name) or 0
+
+# Function to write an event other than a call (e.g. a concurrency limit change) to the metrics file
+def record_event(event, fields):
+    with _lock:
+        if _metrics_file is not None:
+            _metrics_file.write(json.dumps({'time': time.time(), 'event': event, **fields}) + '\n')
+            _metrics_file.flush()
+
+# Function to compute a percentile of a list of numbers
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+# Function to summarise the recorded calls per stage and per model
+def summary():
+    result = {'stage': {}, 'model': {}}
+    with _lock:
+        for (kind, name), aggregate in _aggregates.items():
+            wall_times = aggregate['wall_times']
+            prompt_seconds = aggregate['prompt_eval_duration'] / 1e9
+            eval_seconds = aggregate['eval_duration'] / 1e9
+            result[kind][name] = {
+                'calls': aggregate['calls'],
+                'errors': aggregate['errors'],
+                'cached': aggregate['cached'],
+                'wall_time_total': round(sum(wall_times), 3),
+                'wall_time_p50': round(percentile(wall_times, 0.5), 4),
+                'wall_time_p95': round(percentile(wall_times, 0.95), 4),
+                'histogram': {f"<={bound}s": count for bound, count in zip(HISTOGRAM_BUCKETS, aggregate['histogram'])},
+                'prompt_tokens': aggregate['prompt_eval_count'],
+                'output_tokens': aggregate['eval_count'],
+                'prompt_eval_seconds': round(prompt_seconds, 3),
+                'eval_seconds': round(eval_seconds, 3),
+                'load_seconds': round(aggregate['load_duration'] / 1e9, 3),
+                'prompt_tokens_per_sec': round(aggregate['prompt_eval_count'] / prompt_seconds, 1) if prompt_seconds else None,
+                'output_tokens_per_sec': round(aggregate['eval_count'] / eval_seconds, 1) if eval_seconds else None,
+            }
+    return result
+
+# Function to print the end-of-run summary
+def print_summary():
+    run_summary = summary()
+    for kind in ('stage', 'model'):
+        for name, stats in sorted(run_summary[kind].items()):
+            print(f"{kind} {name}: {stats['calls']} calls, {stats['errors']} errors, {stats['cached']} cached, "
+                  f"wall p50 {stats['wall_time_p50']}s p95 {stats['wall_time_p95']}s total {stats['wall_time_total']}s, "
+                  f"prefill {stats['prompt_eval_seconds']}s ({stats['prompt_tokens_per_sec']} tok/s), "
+                  f"decode {stats['eval_seconds']}s ({stats['output_tokens_per_sec']} tok/s), load {stats['load_seconds']}s")
+            histogram = ', '.join(f"{bucket}: {count}" for bucket, count in stats['histogram'].items() if count)
+            print(f"    wall time histogram: {histogram}")
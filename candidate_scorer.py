@@ -0,0 +1,116 @@
+import json
+import re
+import sys
+
+# Rule-based scorer for the temperature model candidates. It encodes the criteria of the
+# select_best_output prompt so the LLM judge only needs to be consulted for close calls.
+
+SPECULATIVE_WORDS = ('possible', 'possibly', 'suggest', 'suggests', 'suggestive', 'may', 'might', 'could',
+                     'probably', 'probable', 'likely', 'query', 'questionable', 'cannot be excluded')
+SEVERITY_WORDS = ('mild', 'mildly', 'minimal', 'minor', 'acute', 'conspicuous', 'small', 'slight', 'slightly',
+                  'moderate', 'severe', 'subtle')
+# Words of the statement template that say nothing about the source sentence
+TEMPLATE_WORDS = {'there', 'is', 'are', 'no', 'normal', 'located', 'at', 'a', 'an', 'the', 'of'}
+
+speculative_pattern = re.compile(r'\b(' + '|'.join(re.escape(word) for word in SPECULATIVE_WORDS) + r')\b', re.IGNORECASE)
+severity_pattern = re.compile(r'\b(' + '|'.join(SEVERITY_WORDS) + r')\b', re.IGNORECASE)
+conjunction_pattern = re.compile(r'\b(and|with|or)\b', re.IGNORECASE)
+statement_split_pattern = re.compile(r';\s*')
+token_pattern = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+# Function to split a candidate's findings into its individual statements
+def split_statements(findings):
+    if isinstance(findings, list):
+        findings = '; '.join(str(finding) for finding in findings)
+    return [statement.strip() for statement in statement_split_pattern.split(findings or '') if statement.strip(' .')]
+
+# Function to extract the content words of a piece of text
+def content_tokens(text):
+    return {token for token in token_pattern.findall(text.lower()) if token not in TEMPLATE_WORDS}
+
+# Function to score a single candidate's findings against the source sentence (higher is better)
+def score_candidate(findings, sentence):
+    statements = split_statements(findings)
+    if not statements:
+        return -10.0
+
+    score = 0.0
+    for statement in statements:
+        lowered = statement.lower()
+        # Every statement must follow the "There is ..." format
+        score += 1.0 if lowered.startswith('there is') else -2.0
+        # Prefer "located at" over a bare "at"
+        if 'located at' in lowered:
+            score += 0.5
+        elif re.search(r'\bat\b', lowered):
+            score -= 0.25
+        if 'unspecified' in lowered:
+            score -= 1.0
+        # One finding per statement: penalise joined findings, speculation and severity adjectives
+        score -= 0.75 * len(conjunction_pattern.findall(statement))
+        score -= 3.0 * len(speculative_pattern.findall(statement))
+        score -= 0.5 * len(severity_pattern.findall(statement))
+    score /= len(statements)
+
+    # Reward splitting findings into separate statements
+    score += 0.25 * min(len(statements) - 1, 4)
+
+    # Reward covering the source sentence and penalise words that are not in it
+    sentence_tokens = content_tokens(sentence) - set(SEVERITY_WORDS)
+    candidate_tokens = content_tokens(' '.join(statements))
+    if sentence_tokens and candidate_tokens:
+        recall = len(sentence_tokens & candidate_tokens) / len(sentence_tokens)
+        precision = len(sentence_tokens & candidate_tokens) / len(candidate_tokens)
+        score += 2.0 * recall + 1.0 * precision
+    return score
+
+# Function to score every candidate, returning (score, index) pairs from best to worst
+def rank_candidates(outputs, sentence):
+    scores = [(score_candidate(output.get("Findings", ""), sentence), index) for index, output in enumerate(outputs)]
+    # Ties go to the earlier candidate (lower temperature) so the ranking is deterministic
+    return sorted(scores, key=lambda item: (-item[0], item[1]))
+
+# Function to pick the best candidate index, or None when the top two scores are within the margin
+def select_by_rules(outputs, sentence, margin=0.0):
+    ranking = rank_candidates(outputs, sentence)
+    if not ranking:
+        return None
+    if len(ranking) > 1 and ranking[0][0] - ranking[1][0] < margin:
+        return None
+    return ranking[0][1]
+
+# Function to measure agreement with the LLM judge on a JSON lines log of its selections
+def evaluate_agreement(log_path, margins=(0.0, 0.25, 0.5, 1.0)):
+    samples = []
+    with open(log_path, 'r', encoding='utf-8') as log_file:
+        for line in log_file:
+            if line.strip():
+                samples.append(json.loads(line))
+    samples = [sample for sample in samples if sample.get('selected_number')]
+
+    results = {'samples': len(samples)}
+    if not samples:
+        return results
+    agreed = sum(1 for sample in samples
+                 if select_by_rules(sample['outputs'], sample['sentence']) == sample['selected_number'] - 1)
+    results['agreement'] = agreed / len(samples)
+    # For each margin: how often the rules decide alone, and how often they agree with the LLM when they do
+    for margin in margins:
+        decided = 0
+        decided_agreed = 0
+        for sample in samples:
+            choice = select_by_rules(sample['outputs'], sample['sentence'], margin)
+            if choice is not None:
+                decided += 1
+                decided_agreed += choice == sample['selected_number'] - 1
+        results[f'margin_{margin}'] = {
+            'decided_by_rules': decided / len(samples),
+            'agreement_when_decided': decided_agreed / decided if decided else None,
+        }
+    return results
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python candidate_scorer.py <selection_log.jsonl>")
+        sys.exit(1)
+    print(json.dumps(evaluate_agreement(sys.argv[1]), indent=2))
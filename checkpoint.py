@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+# Function to build the key a CSV row is journaled under
+def row_key(row):
+    return row.get('full_path') or row.get('body_part_file_name', 'Unknown')
+
+# The journal is synced to disk after this many rows or seconds, whichever comes first, and when it is
+# closed. Every entry is flushed as it is written, so a crash of the process loses nothing; a crash of the
+# machine can lose the entries since the last sync, and the rows they record are simply processed again.
+sync_every_rows = 100
+sync_interval = 5.0
+
+# Append-only journal of the rows written by process_csv_file, used to resume interrupted runs.
+# Every entry records the output and error file sizes after the row was written, so on resume
+# both files can be truncated back to the last journaled row before appending to them again.
+class CheckpointJournal:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = {}
+        self.details = {}
+        self.output_offset = None
+        self.error_offset = None
+        if resume and os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self):
+        valid_bytes = 0
+        with open(self.path, 'rb') as journal_file:
+            for line in journal_file:
+                # A crash can leave the last line half written; ignore it and everything after it
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                if entry.get('key') is not None:
+                    self.completed[entry['key']] = entry['status']
+                    if entry.get('details') is not None:
+                        self.details[entry['key']] = entry['details']
+                self.output_offset = entry['output_offset']
+                self.error_offset = entry['error_offset']
+        os.truncate(self.path, valid_bytes)
+
+    # Function to restore the output files to the last journaled row; returns True when resuming
+    def restore_outputs(self, output_path, error_path):
+        if self.output_offset is None or not os.path.exists(output_path) or not os.path.exists(error_path):
+            # Nothing to resume from, so start the journal over
+            self.completed = {}
+            self.details = {}
+            self._file.seek(0)
+            self._file.truncate()
+            return False
+        os.truncate(output_path, self.output_offset)
+        os.truncate(error_path, self.error_offset)
+        print(f"Resuming from {self.path}: {len(self.completed)} rows already processed")
+        return True
+
+    # Function to record a finished row ('done' or 'error') with the current output sizes; details
+    # is kept with the row and handed back on resume, e.g. its incremental manifest entry
+    def record(self, key, status, outfile, errorfile, details=None):
+        outfile.flush()
+        errorfile.flush()
+        entry = {'key': key, 'status': status, 'output_offset': outfile.tell(), 'error_offset': errorfile.tell()}
+        if details is not None:
+            entry['details'] = details
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= sync_every_rows or time.monotonic() - self._last_sync >= sync_interval:
+            self.sync()
+
+    # Function to sync the journal entries written so far to disk
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+        self._file.close()
+
+# Stand-in for CheckpointJournal when the outputs cannot be resumed, e.g. Parquet or Arrow files,
+# which are written a row group at a time rather than flushed after every row
+class NullJournal:
+    def __init__(self):
+        self.completed = {}
+        self.details = {}
+
+    def restore_outputs(self, output_path, error_path):
+        return False
+
+    def record(self, key, status, outfile, errorfile, details=None):
+        pass
+
+    def close(self):
+        pass
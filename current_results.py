@@ -1,10 +1,28 @@
-import ollama
-import csv
+import argparse
+import contextlib
 import json
 import re
-from difflib import SequenceMatcher
-
-print("Script started...")
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+import adaptive_concurrency as aimd
+import call_metrics
+import incremental
+import ollama_client
+import prompts
+import table_io
+import text_processing
+from candidate_scorer import select_by_rules
+from checkpoint import CheckpointJournal, NullJournal, row_key
+from findings_json import (BATCH_FINDINGS_SCHEMA, FINDINGS_SCHEMA, extract_batch_findings, extract_json_from_response,
+                           json_object_complete)
+from parallel_runner import imap_ordered
+from prompts import batch_temperature_messages, selection_messages, temperature_messages
+from rule_engine import RULES, RuleEngine
+from semantic_cache import SemanticCache
 
 # Specify the paths and models
 input_csv_path = '/Users/lachyshinnick/Downloads/valid_reports.csv'  # Replace with your input CSV file path
@@ -24,22 +42,146 @@ temp_models = [
 # Base model for selection
 selection_model = 'llama3.1:latest'
 
-def is_similar(statement1, statement2, threshold=0.99):
-    return SequenceMatcher(None, statement1, statement2).ratio() > threshold
+# Serve the temperature models from this one base model, passing the temperature read from each tag
+# ('temp_0.4:latest' -> 0.4) in the request options, so only one model has to stay loaded; None uses the
+# separate temp_* models
+temperature_base_model = None
+temperature_tag_pattern = re.compile(r'temp_(\d+(?:\.\d+)?)')
+
+# Number of reports processed in parallel, and the Ollama endpoints they are spread across
+num_workers = 1
+ollama_hosts = None  # e.g. ['http://gpu-1:11434', 'http://gpu-2:11434']; None uses the default host
+
+# On-disk cache of model responses; cache_mode is 'use', 'refresh' (re-query and overwrite) or 'bypass'
+cache_path = None  # e.g. 'response_cache.sqlite'; None disables the cache
+cache_mode = 'use'
+cache_max_mb = 1024
+
+# How long Ollama keeps models loaded between calls, and the pinned context size shared by every call
+ollama_keep_alive = '30m'
+ollama_num_ctx = 8192
+
+# Adjust the chat calls in flight to each endpoint and stage to the latency observed (AIMD), backing off on
+# slow responses, timeouts and 503s
+adaptive_concurrency = False
+
+# JSON lines file with the model, stage, wall time and token counts of every chat call (None, the default,
+# only keeps the end-of-run summary)
+metrics_path = None  # e.g. 'call_metrics.jsonl'
+
+# Resume an interrupted run from its checkpoint journal, appending to the existing output files (CSV only)
+resume_run = False
+
+# Output layout: 'full' (every input column), 'keys' (key columns and Findings only) or 'split' (one row
+# per finding). The input and output may also be Parquet or Arrow files, picked by file extension.
+output_mode = 'full'
+
+# Maximum number of ollama.chat calls in flight at once (1 = fully sequential); with adaptive_concurrency
+# the adaptive limits of each endpoint take its place
+max_concurrent_requests = 6
+# Maximum number of sentences of a report processed at the same time
+max_concurrent_sentences = 4
+
+# Adaptive ensemble: query the temperature models in this order and stop once agreement_k
+# normalised candidates agree, using the agreed candidate without a selection call. The order only
+# reorders temp_models (models not in temp_models are skipped, unlisted ones go last); None keeps the
+# order of temp_models
+adaptive_ensemble = False
+adaptive_temperature_order = None
+agreement_k = 2
+
+# Batched prompting: ask each temperature model for the findings of up to max_batch_sentences sentences
+# of a report in one call instead of one call per sentence, so the report and instructions are sent once
+# per model; sentences missing from a malformed answer are asked about one at a time
+batch_sentences = False
+max_batch_sentences = 8
+
+# Selection engine: 'llm' always asks selection_model, 'rules' uses the local candidate scorer and
+# 'hybrid' uses the scorer, asking the LLM only when the top two scores are within selection_margin
+selection_engine = 'llm'
+selection_margin = 0.5
+# JSON lines log of the LLM judge's choices, used to measure the scorer's agreement (None disables it)
+selection_log_path = None
+selection_log_lock = threading.Lock()
+# An option number followed by a non-digit, so "1" is not mistaken for the start of "12"
+option_number_pattern = re.compile(r'\b([1-9])(?=\D)')
+
+# Model-affinity scheduling: run every pending sentence of the input through one temperature model, then
+# the next, then the selection stage for all of them, instead of switching models for every sentence;
+# each sentence gets the same candidates, so the findings stay the same
+schedule_by_model = False
+
+# Run the ensemble once per unique sentence across the whole input CSV instead of once per occurrence; a
+# repeated sentence then gets the findings produced with the first report it appears in as context
+dedup_sentences = False
+# Rows whose unique sentences are run together before the rows are written and journaled, so a resumed run
+# only repeats the chunk that was interrupted; sentences of earlier chunks are reused, not run again
+dedup_chunk_rows = 500
+# Also key the deduplication on the report content, for sentences whose findings depend on context
+dedup_include_context = False
+# Also drop findings of a report that are near duplicates of an earlier one (Jaccard similarity of their
+# character shingles at or above this value); None only drops exact duplicates
+findings_near_duplicate_threshold = None
+
+# Reuse the finding of an earlier sentence whose character n-gram TF-IDF similarity reaches this threshold
+# instead of running the ensemble (None disables it); the pairs can be kept in a file across runs, and
+# every reuse is logged for audit
+semantic_cache_threshold = None
+semantic_cache_path = None
+semantic_audit_path = None
+
+# Answer formulaic sentences ("no X", "X is normal", "X is unremarkable", ...) with rule_engine instead of
+# the ensemble
+rule_fast_path = False
+
+# Incremental run: carry the findings of reports whose content and pipeline configuration are unchanged
+# forward from the manifest of previous_output_path (None uses the output path itself), and only process
+# new or changed reports
+incremental_run = False
+previous_output_path = None
+
+# Settings above that run() and the command line can override
+SETTINGS = (
+    'input_csv_path', 'output_csv_path', 'error_csv_path', 'temp_models', 'selection_model', 'temperature_base_model',
+    'num_workers', 'ollama_hosts', 'cache_path', 'cache_mode', 'cache_max_mb', 'ollama_keep_alive', 'ollama_num_ctx',
+    'adaptive_concurrency', 'metrics_path',
+    'resume_run', 'max_concurrent_requests', 'max_concurrent_sentences', 'adaptive_ensemble',
+    'adaptive_temperature_order', 'agreement_k', 'batch_sentences', 'max_batch_sentences', 'selection_engine',
+    'selection_margin', 'selection_log_path',
+    'schedule_by_model', 'dedup_sentences', 'dedup_chunk_rows', 'dedup_include_context', 'findings_near_duplicate_threshold', 'output_mode',
+    'semantic_cache_threshold', 'semantic_cache_path', 'semantic_audit_path', 'rule_fast_path', 'incremental_run',
+    'previous_output_path',
+)
+
+# Stages the ensemble's chat calls are recorded under in the metrics
+TEMPERATURE_STAGE = 'temperature'
+BATCH_TEMPERATURE_STAGE = 'temperature_batch'
+SELECTION_STAGE = 'select'
+ENSEMBLE_STAGES = (TEMPERATURE_STAGE, BATCH_TEMPERATURE_STAGE, SELECTION_STAGE)
+
+# Function to build the shared limit on in-flight ollama.chat calls across all sentences and temperature
+# models; with adaptive_concurrency there is none, so the adaptive limits are the ones that bind
+def make_chat_semaphore():
+    if adaptive_concurrency:
+        return contextlib.nullcontext()
+    return threading.BoundedSemaphore(max_concurrent_requests)
+
+chat_semaphore = make_chat_semaphore()
+
+# Function to return the threads that send one stage's calls for many sentences at once; with
+# adaptive_concurrency there are enough for the highest adaptive limit
+def request_workers():
+    return aimd.max_limit if adaptive_concurrency else max_concurrent_requests
+
+# SemanticCache built by run() when semantic_cache_threshold is set
+semantic_cache = None
+# RuleEngine built by run() when rule_fast_path is set
+fast_path = None
+# incremental.Manifest built by process_csv_file() when incremental_run is set
+manifest = None
 
-# Function to extract JSON from model response
-def extract_json_from_response(response_text):
-    try:
-        # Extract the first JSON object found
-        json_matches = re.findall(r'({.*?})', response_text, re.DOTALL)
-        if json_matches:
-            json_str = json_matches[-1].replace("'", '"')  # Replace single quotes with double quotes
-            return json.loads(json_str)
-        else:
-            return {"Error": "Invalid JSON"}
-    except (ValueError, json.JSONDecodeError) as e:
-        print(f"JSON decoding error: {e}")
-        return {"Error": "Invalid JSON"}
+def is_similar(statement1, statement2, threshold=0.99):
+    return text_processing.jaccard(text_processing.shingles(statement1), text_processing.shingles(statement2)) > threshold
 
 # Function to clean and consolidate findings
 def clean_findings(findings):
@@ -49,340 +191,175 @@ def clean_findings(findings):
         cleaned_findings = findings
 
     # Remove unwanted symbols
-    cleaned_findings = re.sub(r"[\[\]']", "", cleaned_findings)
+    cleaned_findings = text_processing.UNWANTED_SYMBOLS.sub("", cleaned_findings)
     # Remove random full stops (but not the ones at the end of sentences)
-    cleaned_findings = re.sub(r'\.(?!\s|$)', '', cleaned_findings)
+    cleaned_findings = text_processing.STRAY_FULL_STOP.sub('', cleaned_findings)
 
     # Split the findings into individual statements
-    statements = re.split(r';\s*', cleaned_findings)
-    updated_statements = []
-    seen_statements = set()
-    for statement in statements:
-        # Replace "There are" with "There is" at the beginning of the statement
-        updated_statement = re.sub(r'^There are', 'There is', statement.strip())
-        # Avoid duplicates
-        if updated_statement.lower() not in seen_statements:
-            seen_statements.add(updated_statement.lower())
-            updated_statements.append(updated_statement)
+    statements = text_processing.STATEMENT_SEPARATOR.split(cleaned_findings)
+    # Replace "There are" with "There is" at the beginning of the statement
+    updated_statements = [text_processing.THERE_ARE.sub('There is', statement.strip()) for statement in statements]
+    # Avoid duplicates
+    updated_statements = text_processing.dedup_findings(updated_statements)
 
     # Rejoin the statements
     final_findings = '; '.join(updated_statements)
     return final_findings
 
+# Function to return the model and options of a request to a temperature model, which is the base model
+# with the tag's temperature when temperature_base_model is set
+def temperature_request(model_name):
+    match = temperature_tag_pattern.search(model_name) if temperature_base_model else None
+    if match is None:
+        return model_name, {}
+    return temperature_base_model, {'temperature': float(match.group(1))}
+
+# Function to prompt a single temperature model, returning its JSON output or None
+def prompt_temp_model(model_name, messages, sentence):
+    model, options = temperature_request(model_name)
+    try:
+        with chat_semaphore:
+            response = ollama_client.chat(model=model, messages=messages, format=FINDINGS_SCHEMA, options=options,
+                                          stage=TEMPERATURE_STAGE, stop_when=json_object_complete)
+        raw_content = response['message']['content'].strip()
+        print(f"Model {model_name} response: {raw_content}")
+        # Extract JSON
+        structured_data = extract_json_from_response(raw_content)
+        if "Error" not in structured_data:
+            findings = structured_data.get("Findings", "")
+            if findings:
+                # Collect the full JSON output
+                return structured_data
+        else:
+            print(f"Error: Invalid JSON from model {model_name} for sentence: {sentence}")
+    except Exception as e:
+        print(f"Exception while prompting model {model_name}: {e}")
+    return None
+
 # Function to prompt all temperature models with a sentence
 def prompt_temp_models(report_content, sentence):
-    outputs = []
-    for model_name in temp_models:
-        prompt = f"""
-<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-
-You are a helpful assistant trained to extract key medical findings from radiology reports.
-
-**Instructions**:
-
-- **Output Format**: Provide findings in JSON format with the key "Findings". The value should be a string containing one or more statements.
-        - **Statement Format**:
-        - For **positive findings**:
-            - If the location is mentioned: "There is <diagnosis> located at <location>."
-            - If the location is not mentioned: "There is <diagnosis>."
-        - For **negative findings** (only if explicitly mentioned in the report):
-            - If the location is mentioned: "There is no <diagnosis> located at <location>."
-            - If the location is not mentioned: "There is <diagnosis>."
-            - For **normal findings**:
-            - If explicitly mentioned in the report, include them as: "There is normal <structure>."
-            - If the term "unremarkable" is used to describe a body part, interpret this as "There is no abnormality at <body part>."
-        - **General Rules**:
-        - **Do not hallucinate**: Only include information explicitly mentioned in the report. Do not make any assumptions or create findings that are not directly stated.
-        - **One finding per sentence**: Do not combine findings into a single sentence using conjunctions like "and" or "with". Each statement should describe one finding at one location.
-        - **If a sentence in the report says "There is <condition-1> and <condition-2> at <location>", split it into two separate findings like: "There is <condition-1> at <location>; There is <condition-2> at <location>".**
-        - **Do not use conjunctions like "and" or "with" to connect multiple findings**. Instead, separate each finding into its own sentence.
-        - **Use nouns instead of adverbs** to describe locations. For example, replace "subdiaphragmatically" with "at sub-diaphragm".
-        - **Remove adjectives describing severity or visibility** unless they are clinically significant. For example, remove words like "mild" or "conspicuous" unless explicitly required for diagnosis.
-        - **Include** all findings mentioned in the report, both abnormal and normal.
-        - **Do not** include speculative or uncertain findings. Exclude any statements containing words like "possible", "suggests", "may indicate", "could", "probably", etc.
-        - **Do not** include redundant or repetitive statements.
-        - **Do not** include any references to previous X-rays or imaging results. Focus solely on the current medical findings and diagnosis in the report.
-        - **Ensure** that each statement starts with "There is", "There is no", or "There is normal" as per the format.
-        - **Only include** findings that strictly adhere to the required format and information given in the report.
-        - **Use exact medical terminology from the report without substitutions or synonyms**
-        - **Do not include possible findings, and do not include severity of the degree of findings. Remove words such as "mild", "acute", "minimal", and other descriptors that indicate the extent of the condition.
-
-
-**Examples**:
-
-**Example 1**:
-
-Sentence:
-"There is a greenstick fracture of the distal radius."
-
-Findings:
-{{
-"Findings": "There is a greenstick fracture located at distal radius;"
-}}
-
-**Example 1 note**: The finding is expressed concisely, beginning with “There is” to follow the standard format. The phrase “located at distal radius” clarifies the specific location of the fracture, providing a clear and structured description.
-
-**Example 2**:
-
-Sentence:
-"there is a conspicuous gas-filled and dilated bowel loop located at the left mid-abdomen."
-
-Findings:
-{{
-    "Findings": "There is a gas-filled bowel loop located at the left mid-abdomen; There is a dilated bowel loop located at the left mid-abdomen."
-}}
-
-**Example 2 note**: The adjective "conspicuous" is removed as it is unnecessary. The phrase "gas-filled and dilated bowel loop" is split into two sentences to ensure only one finding per sentence. The word "and" is avoided, and the sentence structure is simplified. The word "mildly" is removed as we are not concerned with the degree of the diagnosis.
-
-**Example 3**:
-
-Sentence:
-"the lungs are clear, heart size is normal and no pleural effusion."
-
-Findings:
-{{
-"Findings": "There is clear lungs; There is normal heart size; There is no pleural effusion;"
-}}
-
-**Example 3 note**: The sentence is split into three distinct findings, each starting with “There is” or “There is no,” ensuring clarity and adherence to the preferred format. This avoids using “and” and provides a clear, standardized description of each observation.
-
-**Example 4**:
-
-Sentence:
-"There is minimal displacement of the fracture at the right humerus."
-
-Findings:
-{{
-"Findings": "There is displacement of fracture located at right humerus;"
-}}
-
-**Example 4 note**: The descriptor “minimal” is removed as we are not concerned with the degree of the diagnosis, only its presence. The finding is expressed as “There is displacement of fracture,” and the location “right humerus” is included to provide clarity.
-
-**Example 5**:
-
-Sentence:
-"The humeral head is enlocated."
-
-Findings:
-{{
-"Findings": "There is an enlocated humeral head;"
-}}
-
-**Example 5 note**: The term “enlocated” indicates normal positioning and should be expressed as “There is an enlocated humeral head.."
-
-**Example 6**:
-
-Report Content:
-"there is central bronchial wall thickening and a mild peribronchial interstitial opacity located at upper lower zones."
-
-Findings:
-{{
-"Findings": "There is central bronchial wall thickening located at upper lower zones; There is a peribronchial interstitial opacity located at upper lower zones."
-}}
-
-**Example 3 note**: The adjective "mild" is removed as it does not contribute to the essential finding. The findings are separated into two sentences, with each describing one distinct condition. The conjunction "and" is removed to prevent the combination of findings into one sentence.
-
-**Example 7**:
-
-Sentence:
-"This could reflect localized ileus."
-
-Findings:
-{{
-"Findings": ""
-}}
-
-**Example 7 note**: This does not include any findings, because the findings are not definite."
-
-**Report Content** (only for context):
-{report_content}
+    messages = temperature_messages(report_content, sentence)
+    # Query the temperature models in parallel; map keeps the results in temp_models order
+    with ThreadPoolExecutor(max_workers=len(temp_models)) as executor:
+        results = list(executor.map(lambda model_name: prompt_temp_model(model_name, messages, sentence), temp_models))
+    outputs = [structured_data for structured_data in results if structured_data is not None]
+    return outputs
 
----
+# Function to prompt a temperature model with several sentences of a report at once, returning one output
+# (or None) per sentence; sentences the answer does not cover are prompted on their own instead
+def prompt_temp_model_batch(model_name, report_content, sentences):
+    if len(sentences) == 1:
+        return [prompt_temp_model(model_name, temperature_messages(report_content, sentences[0]), sentences[0])]
 
-Focus solely on summarising this sentence as per the instructions above. Ensure each findings starts with "there is", even if it does not make perfect grammatical sense to do so.
-"{sentence}"
+    batch_findings = {}
+    model, options = temperature_request(model_name)
+    try:
+        # The output cap grows with the number of sentences answered
+        num_predict = ollama_client.stage_num_predict[TEMPERATURE_STAGE] * len(sentences)
+        with chat_semaphore:
+            response = ollama_client.chat(model=model, messages=batch_temperature_messages(report_content, sentences),
+                                          format=BATCH_FINDINGS_SCHEMA, stage=BATCH_TEMPERATURE_STAGE,
+                                          stop_when=json_object_complete, options={**options, 'num_predict': num_predict})
+        raw_content = response['message']['content'].strip()
+        print(f"Model {model_name} batched response: {raw_content}")
+        batch_findings = extract_batch_findings(raw_content, len(sentences))
+    except Exception as e:
+        print(f"Exception while prompting model {model_name} with {len(sentences)} sentences: {e}")
 
-<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-"""
+    outputs = []
+    for number, sentence in enumerate(sentences, start=1):
+        if number in batch_findings:
+            findings = batch_findings[number]
+            outputs.append({"Findings": findings} if findings else None)
+        else:
+            print(f"Error: No findings from model {model_name} in the batch for sentence: {sentence}; prompting it alone")
+            outputs.append(prompt_temp_model(model_name, temperature_messages(report_content, sentence), sentence))
+    return outputs
 
-        try:
-            response = ollama.chat(model=model_name, messages=[
-                {'role': 'user', 'content': prompt}
-            ])
-            raw_content = response['message']['content'].strip()
-            print(f"Model {model_name} response: {raw_content}")
-            # Extract JSON
-            structured_data = extract_json_from_response(raw_content)
-            if "Error" not in structured_data:
-                findings = structured_data.get("Findings", "")
-                if findings:
-                    # Collect the full JSON output
-                    outputs.append(structured_data)
-            else:
-                print(f"Error: Invalid JSON from model {model_name} for sentence: {sentence}")
-        except Exception as e:
-            print(f"Exception while prompting model {model_name}: {e}")
+# Function to prompt the temperature models with several sentences of a report in batched calls, returning
+# the candidate outputs of every sentence; with k, the models after the first k are only asked about the
+# sentences whose candidates do not agree yet, like prompt_temp_models_adaptive
+def prompt_temp_models_batched(report_content, sentences, model_order=None, k=None):
+    model_order = model_order or temp_models
+    outputs = [[] for _ in sentences]
+    first_models = model_order[:k] if k else model_order
+    with ThreadPoolExecutor(max_workers=len(first_models)) as executor:
+        results = list(executor.map(lambda model_name: prompt_temp_model_batch(model_name, report_content, sentences),
+                                    first_models))
+    for model_outputs in results:
+        for sentence_outputs, structured_data in zip(outputs, model_outputs):
+            if structured_data is not None:
+                sentence_outputs.append(structured_data)
+
+    for model_name in (model_order[k:] if k else []):
+        pending = [index for index, sentence_outputs in enumerate(outputs)
+                   if not sentence_outputs or agreed_output(sentence_outputs, k) is None]
+        if not pending:
+            break
+        model_outputs = prompt_temp_model_batch(model_name, report_content, [sentences[index] for index in pending])
+        for index, structured_data in zip(pending, model_outputs):
+            if structured_data is not None:
+                outputs[index].append(structured_data)
+    return outputs
 
+# Function to normalise a candidate so that equivalent outputs compare equal
+def candidate_key(structured_data):
+    return clean_findings(structured_data.get("Findings", "")).lower()
+
+# Function to return the agreed findings when k candidates normalise to the same text (or there is only one
+# distinct candidate among at least k, or two without k); a single candidate is never an agreement
+def agreed_output(outputs, k=None):
+    counts = Counter(candidate_key(structured_data) for structured_data in outputs)
+    if len(counts) == 1 and len(outputs) >= max(k or 2, 2):
+        return outputs[0].get("Findings", "")
+    if k is not None:
+        for structured_data in outputs:
+            if counts[candidate_key(structured_data)] >= k:
+                return structured_data.get("Findings", "")
+    return None
+
+# Function to return the temperature models in the order the adaptive ensemble queries them
+def temperature_order():
+    if adaptive_temperature_order is None:
+        return list(temp_models)
+    ordered = [model_name for model_name in adaptive_temperature_order if model_name in temp_models]
+    return ordered + [model_name for model_name in temp_models if model_name not in ordered]
+
+# Function to prompt the temperature models in adaptive order, stopping once agreement_k candidates agree
+def prompt_temp_models_adaptive(report_content, sentence, model_order=None, k=None):
+    model_order = model_order or temperature_order()
+    k = k or agreement_k
+    messages = temperature_messages(report_content, sentence)
+    outputs = []
+    # The first k models are needed for any agreement, so query them together, then one at a time
+    with ThreadPoolExecutor(max_workers=k) as executor:
+        results = list(executor.map(lambda model_name: prompt_temp_model(model_name, messages, sentence), model_order[:k]))
+    outputs.extend(structured_data for structured_data in results if structured_data is not None)
+    for model_name in model_order[k:]:
+        if outputs and agreed_output(outputs, k) is not None:
+            break
+        structured_data = prompt_temp_model(model_name, messages, sentence)
+        if structured_data is not None:
+            outputs.append(structured_data)
     return outputs
 
+# Function for streamed selection: True once a complete option number has been generated
+def option_number_complete(text):
+    return option_number_pattern.search(text) is not None
+
 # Function to let the LM select the best output for a single sentence
 def select_best_output(outputs, selection_model, sentence):
     if not outputs:
         return ""
 
-    # Create a prompt for the LM to select the most accurate and complete medical findings
-    selection_prompt = "<|begin_of_text|><|start_header_id|>system<|end_header_id|>.\n\n"
-
-    # Enhanced instructions for selecting the best option, including the original sentence
-    selection_prompt += f"""
-You are an expert assistant trained to select the most accurate and properly formatted medical findings from the options provided below.
-
-**Instructions**:
-
-- **Original Sentence**:
-  "{sentence}"
-
-- **Criteria for Selection**:
-  1. **Adherence to Statement Formats**:
-      - **Positive Findings**:
-          - Must start with "There is <diagnosis> located at <location>." if location is mentioned.
-          - Must start with "There is <diagnosis>." if location is not mentioned.
-      - **Negative Findings**:
-          - Must start with "There is no <diagnosis> located at <location>." if location is mentioned.
-          - Must start with "There is no <diagnosis>." if location is not mentioned.
-  2. **Information Completeness and Relevance**:
-      - Select the finding that includes all relevant findings from the original sentence without omissions.
-      - Select the finding such that no additional or irrelevant findings should be added.
-      - The information you select should add some knowledge.
-  3. **Clarity and Precision**:
-      - The selected statement should be clear, precise, and free from ambiguity.
-      - The selected statement should be split up as much as possible, so that each sentence has its own point.
-  4. **No Speculative or Redundant Information**:
-      - Exclude any findings that are speculative or uncertain. Specifically, do not include findings containing words such as ‘probably,’ ‘probable,’ ‘suggests,’ ‘possible,’ ‘may indicate,’ or any similar terms that imply uncertainty.
-      - Avoid redundant or repetitive statements.
-      - If none of the statements align with the criteria, output the number 9
-  5. **Alignment with Original Language**:
-      - Select the statement that best adheres to the original language in the original statement only if it aligns with the above statements.
-      
-
-- **Response Requirement**:
-  Respond with only the number of the selected option (e.g., '1', '2', etc.) and nothing else.
-
-**examples**:
-
-**Example 1**:
-
-**Original Sentence**:
-"There is a greenstick fracture of the distal radius."
-
-**Options**:
-Option 1: {{"Findings": "There is a greenstick fracture located at distal radius;"}}
-Option 2: {{"Findings": "There is a fracture at distal radius."}}
-
-**Best Option**:
-1
-
-**Explanation**:
-Option 1 provides a more detailed and precise finding by specifying the type of fracture ("greenstick") and its exact location ("distal radius"). This aligns with the criteria of clarity and completeness.
-
----
-
-**Example 2**:
-
-**Original Sentence**:
-"there is a conspicuous gas-filled and dilated bowel loop located at the left mid-abdomen."
-
-**Options**:
-Option 1: {{"Findings": "There is a gas-filled bowel loop located at the left mid-abdomen; There is a dilated bowel loop located at the left mid-abdomen."}}
-Option 2: {{"Findings": "There is a conspicuous gas-filled and dilated bowel loop located at the left mid-abdomen."}}
-
-**Best Option**:
-1
-
-**Explanation**:
-Option 1 splits the findings into two separate statements, enhancing clarity by addressing each condition individually. It also removes the unnecessary adjective "conspicuous," adhering to the general rules.
-
----
-
-**Example 3**:
-
-**Original Sentence**:
-"no acute bony or soft tissue anomaly."
-
-**Options**:
-Option 1: {{"Findings": "There is no acute bony or soft tissue anomaly."}}
-Option 2: {{"Findings": "There is no acute bony anomaly; There is no acute soft tissue anomaly;"}}
-
-**Best Option**:
-2
-
-**Explanation**:
-Option 2 splits the negative findings into two separate statements, ensuring each finding is clear and follows the one finding per statement rule.
-
----
-
-**Example 4**:
-
-**Original Sentence**:
-"a small gas locule persists here."
-
-**Options**:
-Option 1: {{"Findings": "There is a gas locule located at the right lateral chest wall;"}}
-Option 2: {{"Findings": "There is a small gas locule located at unspecified location;"}}
-
-**Best Option**:
-1
-
-**Explanation**:
-Option 1 provides a specific location for the gas locule, making the finding more informative and actionable compared to the vague "unspecified location."
-
----
-
-**Example 5**:
-
-**Original Sentence**:
-"there is associated mild right lower lobe collapse."
-
-**Options**:
-Option 1: {{"Findings": "There is a collapse located at right lower lobe;"}}
-Option 2: {{"Findings": "There is right lower lobe collapse; There is mild right lower lobe collapse;"}}
-
-**Best Option**:
-1
-
-**Explanation**:
-Option 1 accurately captures the finding without redundancy. Option 2 repeats the same condition by stating both “right lower lobe collapse” and “mild right lower lobe collapse,” which does not add any additional meaningful information. Removing the adjective “mild” ensures that the finding remains clear and concise.
-
----
-
-**New Task**:
-
-**Original Sentence**:
-"{sentence}"
-
-**Options**:
-"""
-
-    # Append the options with proper JSON formatting
-    for idx, output_dict in enumerate(outputs, start=1):
-        # Ensure that each option is a JSON-formatted string
-        escaped_output = json.dumps(output_dict)
-        selection_prompt += f"Option {idx}: {escaped_output}\n"
-
-    # Append the response requirement again to reinforce it after options
-    selection_prompt += """
-**Response Requirement**:
-Respond with the number of the selected option (e.g., '1', '2', etc.) followed by a detailed explanation of why you chose this option, referencing both the original sentence and the choice.
-Ensure you are picking finings that follow the criteria, and choose the sentences that split up the findings into singular sentences.
-Prefer outputs that have "located at" over outputs that have "at".
-<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-"""
+    # Format each option as a JSON string for the selection prompt
+    options = "\n".join(f"Option {idx}: {json.dumps(output_dict)}" for idx, output_dict in enumerate(outputs, start=1))
 
     try:
         # Send the selection prompt to the language model
-        response = ollama.chat(model=selection_model, messages=[
-            {'role': 'user', 'content': selection_prompt}
-        ])
+        with chat_semaphore:
+            response = ollama_client.chat(model=selection_model, messages=selection_messages(sentence, options),
+                                          stage=SELECTION_STAGE, stop_when=option_number_complete)
         best_output = response['message']['content'].strip()
         print(f"Selected best output (raw response): {best_output}")
 
@@ -390,6 +367,7 @@ Prefer outputs that have "located at" over outputs that have "at".
         match = re.search(r'\b([1-6])\b', best_output)
         if match:
             selected_number = int(match.group(1))
+            log_selection(sentence, outputs, selected_number)
             if 1 <= selected_number <= len(outputs):
                 selected_finding_dict = outputs[selected_number - 1]
                 selected_finding = selected_finding_dict.get("Findings", "")
@@ -405,41 +383,248 @@ Prefer outputs that have "located at" over outputs that have "at".
         print(f"Exception while selecting the best output: {e}")
         return ""
 
-# Main function to extract findings for an entire report
-def extract_findings(report_content, file_name):
-    # Split the report into sentences based on periods
-    sentences = [s.strip() for s in re.split(r'\.\s*', report_content.strip()) if s.strip()]
-    all_findings = []
-
-    for sentence in sentences:
-        print(f"\nProcessing sentence: {sentence}")
-        # Get outputs from all temperature models
+# Function to append the LLM judge's choice to the selection log, giving a labelled sample for the rule scorer
+def log_selection(sentence, outputs, selected_number):
+    if not selection_log_path:
+        return
+    entry = {'sentence': sentence, 'outputs': outputs, 'selected_number': selected_number}
+    with selection_log_lock:
+        with open(selection_log_path, 'a', encoding='utf-8') as log_file:
+            log_file.write(json.dumps(entry) + '\n')
+
+# Function to pick the best candidate with the configured selection engine
+def choose_best_output(outputs, sentence):
+    if selection_engine in ('rules', 'hybrid'):
+        margin = selection_margin if selection_engine == 'hybrid' else 0.0
+        selected_index = select_by_rules(outputs, sentence, margin)
+        if selected_index is not None:
+            selected_finding = outputs[selected_index].get("Findings", "")
+            print(f"Rule scorer selected option {selected_index + 1}: {selected_finding}")
+            return selected_finding
+    return select_best_output(outputs, selection_model, sentence)
+
+# Function to return the findings of a similar earlier sentence from the semantic cache, or None
+def reused_finding(report_content, sentence):
+    if semantic_cache is None:
+        return None
+    reused = semantic_cache.lookup(sentence, report_content)
+    if reused is None:
+        return None
+    print(f"Reusing findings of a similar sentence ({reused[2]:.2f}: {reused[1]}): {reused[0]}")
+    return reused[0]
+
+# Function to run the temperature ensemble and selection for a single sentence
+def process_sentence(report_content, sentence):
+    print(f"\nProcessing sentence: {sentence}")
+    reused = reused_finding(report_content, sentence)
+    if reused is not None:
+        return reused
+
+    # Get outputs from the temperature models
+    if adaptive_ensemble:
+        temp_outputs = prompt_temp_models_adaptive(report_content, sentence)
+    else:
         temp_outputs = prompt_temp_models(report_content, sentence)
-        if not temp_outputs:
-            print(f"No outputs from temperature models for sentence: {sentence}")
+    return select_sentence_finding(sentence, temp_outputs)
+
+# Function to run the temperature ensemble for several sentences of one report with batched calls, then
+# select the findings of each sentence from its own candidates
+def process_sentences_batched(report_content, sentences):
+    findings = [None] * len(sentences)
+    pending = []
+    for index, sentence in enumerate(sentences):
+        print(f"\nProcessing sentence: {sentence}")
+        findings[index] = reused_finding(report_content, sentence)
+        if findings[index] is None:
+            pending.append(index)
+
+    candidates = []
+    for start in range(0, len(pending), max_batch_sentences):
+        batch = [sentences[index] for index in pending[start:start + max_batch_sentences]]
+        if adaptive_ensemble:
+            candidates.extend(prompt_temp_models_batched(report_content, batch, temperature_order(), agreement_k))
+        else:
+            candidates.extend(prompt_temp_models_batched(report_content, batch))
+
+    # Selection stays per sentence, judged on the candidates the batched calls produced for it
+    with ThreadPoolExecutor(max_workers=max_concurrent_sentences) as executor:
+        selected = list(executor.map(select_sentence_finding, [sentences[index] for index in pending], candidates))
+    for index, finding in zip(pending, selected):
+        findings[index] = finding
+    return findings
+
+# Function to prompt one temperature model about many (report_content, sentence) items, returning one
+# output (or None) per item; batched mode asks about the items of each report together
+def prompt_temp_model_items(model_name, items):
+    if not batch_sentences:
+        with ThreadPoolExecutor(max_workers=request_workers()) as executor:
+            return list(executor.map(
+                lambda item: prompt_temp_model(model_name, temperature_messages(*item), item[1]), items))
+
+    indexes_by_report = {}
+    for index, (report_content, _) in enumerate(items):
+        indexes_by_report.setdefault(report_content, []).append(index)
+    batches = [(report_content, indexes[start:start + max_batch_sentences])
+               for report_content, indexes in indexes_by_report.items()
+               for start in range(0, len(indexes), max_batch_sentences)]
+    outputs = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=request_workers()) as executor:
+        results = executor.map(lambda batch: prompt_temp_model_batch(
+            model_name, batch[0], [items[index][1] for index in batch[1]]), batches)
+        for (_, indexes), batch_outputs in zip(batches, results):
+            for index, structured_data in zip(indexes, batch_outputs):
+                outputs[index] = structured_data
+    return outputs
+
+# Function to run the ensemble for many (report_content, sentence) items one temperature model at a time,
+# then select the findings of all of them, so each model is loaded once instead of once per sentence;
+# every sentence gets the candidates process_sentence would give it, in the same order
+def process_sentences_by_model(items):
+    findings = [None] * len(items)
+    pending = []
+    for index, (report_content, sentence) in enumerate(items):
+        findings[index] = reused_finding(report_content, sentence)
+        if findings[index] is None:
+            pending.append(index)
+
+    outputs = {index: [] for index in pending}
+    model_order = temperature_order() if adaptive_ensemble else temp_models
+    for position, model_name in enumerate(model_order):
+        active = pending
+        if adaptive_ensemble and position >= agreement_k:
+            # Like prompt_temp_models_adaptive, the later models only see sentences that do not agree yet
+            active = [index for index in pending if not outputs[index] or agreed_output(outputs[index], agreement_k) is None]
+            if not active:
+                break
+        print(f"\nRunning {len(active)} sentences through {model_name}")
+        for index, structured_data in zip(active, prompt_temp_model_items(model_name, [items[index] for index in active])):
+            if structured_data is not None:
+                outputs[index].append(structured_data)
+
+    # The selection stage runs for all sentences once the temperature models are done
+    print(f"\nSelecting findings for {len(pending)} sentences")
+    with ThreadPoolExecutor(max_workers=request_workers()) as executor:
+        selected = list(executor.map(lambda index: select_sentence_finding(items[index][1], outputs[index]), pending))
+    for index, finding in zip(pending, selected):
+        findings[index] = finding
+    return findings
+
+# Function to pick, clean and cache the findings of a sentence from its temperature model outputs
+def select_sentence_finding(sentence, temp_outputs):
+    if not temp_outputs:
+        print(f"No outputs from temperature models for sentence: {sentence}")
+        return ""
+
+    # Skip the selection call when the candidates agree
+    best_output = agreed_output(temp_outputs, agreement_k if adaptive_ensemble else None)
+    if best_output is not None:
+        print(f"Candidates agree, skipping selection: {best_output}")
+    else:
+        # Use the selection engine to pick the best output, providing the original sentence
+        best_output = choose_best_output(temp_outputs, sentence)
+    if best_output:
+        # Clean the selected output
+        cleaned_output = clean_findings(best_output)
+        if cleaned_output:
+            print(f"Added findings: {cleaned_output}")
+            if semantic_cache is not None:
+                semantic_cache.add(sentence, cleaned_output)
+            return cleaned_output
+        print(f"No valid findings in the best output for sentence: {sentence}")
+    else:
+        print(f"No best output selected for sentence: {sentence}")
+    return ""
+
+# Function to split a report into sentences, keeping decimals and abbreviations inside their sentence
+def split_sentences(report_content):
+    return text_processing.split_sentences(report_content)
+
+# Function to normalise a sentence so that trivially different copies share a deduplication key
+def normalize_sentence(sentence):
+    return text_processing.normalize_text(sentence)
+
+# Function to build the deduplication key for a sentence, optionally including its report
+def sentence_key(report_content, sentence, include_context=False):
+    if include_context:
+        return normalize_sentence(report_content), normalize_sentence(sentence)
+    return normalize_sentence(sentence)
+
+# Function to run the ensemble once per unique sentence of a chunk of rows, skipping the keys already known
+def precompute_sentence_findings(rows, include_context=False, workers=1, known=()):
+    # The first report containing a sentence is used as its context
+    unique_sentences = {}
+    total_sentences = 0
+    for row in rows:
+        # Unchanged reports of an incremental run keep their previous findings
+        if manifest is not None and manifest.previous_findings(row) is not None:
             continue
+        report_content = row.get('report_content', '')
+        for sentence in split_sentences(report_content):
+            total_sentences += 1
+            # Sentences the rules answer never reach the ensemble
+            if fast_path is not None and fast_path.apply(sentence)[0] is not None:
+                continue
+            key = sentence_key(report_content, sentence, include_context)
+            if key not in known:
+                unique_sentences.setdefault(key, (report_content, sentence))
+    print(f"Deduplicated {total_sentences} sentences to {len(unique_sentences)} unique sentences")
+
+    if schedule_by_model:
+        keys = list(unique_sentences)
+        return dict(zip(keys, process_sentences_by_model([unique_sentences[key] for key in keys])))
+
+    if batch_sentences:
+        # Batch the unique sentences by the report they are first seen in, which is their context
+        keys_by_report = {}
+        for key, (report_content, sentence) in unique_sentences.items():
+            keys_by_report.setdefault(report_content, []).append(key)
+        batches = list(keys_by_report.items())
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            batch_findings = list(executor.map(
+                lambda batch: process_sentences_batched(batch[0], [unique_sentences[key][1] for key in batch[1]]), batches))
+        return {key: finding for (_, keys), findings in zip(batches, batch_findings) for key, finding in zip(keys, findings)}
+
+    keys = list(unique_sentences)
+    with ThreadPoolExecutor(max_workers=max_concurrent_sentences * max(workers, 1)) as executor:
+        findings = list(executor.map(lambda key: process_sentence(*unique_sentences[key]), keys))
+    return dict(zip(keys, findings))
 
-        # Use LM to select the best output, providing the original sentence
-        best_output = select_best_output(temp_outputs, selection_model, sentence)
-        if best_output:
-            # Clean the selected output
-            cleaned_output = clean_findings(best_output)
-            if cleaned_output:
-                all_findings.append(cleaned_output)
-                print(f"Added findings: {cleaned_output}")
-            else:
-                print(f"No valid findings in the best output for sentence: {sentence}")
-        else:
-            print(f"No best output selected for sentence: {sentence}")
+# Main function to extract findings for an entire report
+def extract_findings(report_content, file_name='Unknown', sentence_findings=None, include_context=False):
+    sentences = split_sentences(report_content)
+
+    # Answer formulaic sentences by rule and reuse the findings precomputed for deduplicated sentences,
+    # running the ensemble for any others
+    def known_finding(sentence):
+        if fast_path is not None:
+            findings = fast_path.match(sentence)
+            if findings is not None:
+                print(f"\nRule findings for sentence: {sentence}: {findings}")
+                return findings
+        if sentence_findings is not None:
+            return sentence_findings.get(sentence_key(report_content, sentence, include_context))
+        return None
+
+    if batch_sentences:
+        # Run the sentences without precomputed findings through the ensemble together
+        report_findings = [known_finding(sentence) for sentence in sentences]
+        pending = [index for index, finding in enumerate(report_findings) if finding is None]
+        batch_findings = process_sentences_batched(report_content, [sentences[index] for index in pending])
+        for index, finding in zip(pending, batch_findings):
+            report_findings[index] = finding
+    else:
+        def sentence_finding(sentence):
+            finding = known_finding(sentence)
+            return finding if finding is not None else process_sentence(report_content, sentence)
+
+        # Overlap the sentences of the report; map keeps the findings in sentence order
+        with ThreadPoolExecutor(max_workers=max_concurrent_sentences) as executor:
+            report_findings = list(executor.map(sentence_finding, sentences))
+    all_findings = [finding for finding in report_findings if finding]
 
     if all_findings:
         # Remove duplicates while preserving order
-        seen = set()
-        unique_findings = []
-        for finding in all_findings:
-            if finding.lower() not in seen:
-                seen.add(finding.lower())
-                unique_findings.append(finding)
+        unique_findings = text_processing.dedup_findings(all_findings, findings_near_duplicate_threshold)
         # Return the consolidated findings
         consolidated_findings = "; ".join(unique_findings)
         print(f"\nConsolidated Findings: {consolidated_findings}")
@@ -449,39 +634,107 @@ def extract_findings(report_content, file_name):
         print("\nNo findings extracted from the report.")
         return {"Findings": ""}
 
+# Function to return the prompts, models and settings that decide the findings, for incremental runs
+def config_fingerprint():
+    return {
+        'pipeline': 'current_results',
+        'temp_models': temp_models,
+        'selection_model': selection_model,
+        'temperature_base_model': temperature_base_model,
+        'num_ctx': ollama_num_ctx,
+        'prompts': [prompts.TEMPERATURE_SYSTEM_PROMPT, prompts.TEMPERATURE_USER_TEMPLATE, prompts.SELECTION_SYSTEM_PROMPT,
+                    prompts.SELECTION_USER_TEMPLATE],
+        'batch_prompts': [prompts.BATCH_TEMPERATURE_SYSTEM_PROMPT, prompts.BATCH_TEMPERATURE_USER_TEMPLATE]
+                         if batch_sentences else None,
+        'adaptive_ensemble': [temperature_order(), agreement_k] if adaptive_ensemble else None,
+        'selection': [selection_engine, selection_margin if selection_engine == 'hybrid' else None],
+        'dedup': [dedup_sentences, dedup_include_context],
+        'findings_near_duplicate_threshold': findings_near_duplicate_threshold,
+        'semantic_cache_threshold': semantic_cache_threshold,
+        'rules': [(name, pattern.pattern, template) for name, pattern, template in RULES] if rule_fast_path else None,
+    }
+
+# Function to extract the findings for a single CSV row, run on the worker pool
+def process_row(row, sentence_findings=None, include_context=False):
+    file_name = row.get('body_part_file_name', 'Unknown')
+    report_content = row.get('report_content', '')
+
+    if not report_content:
+        print(f"No report content for file {file_name}. Skipping.")
+        return row, None
+
+    # Reuse the findings of an unchanged report from the previous run
+    if manifest is not None:
+        findings = manifest.previous_findings(row)
+        if findings is not None:
+            return row, {"Findings": findings, "Carried": True}
+
+    # Extract findings from the entire report content
+    return row, extract_findings(report_content, file_name, sentence_findings, include_context)
+
+# Function to process rows a chunk at a time, running the unique sentences of each chunk before its rows
+def precomputed_chunks(row_processor, rows, sentence_findings, include_context, workers):
+    for chunk in iter(lambda: list(islice(rows, max(dedup_chunk_rows, 1))), []):
+        sentence_findings.update(precompute_sentence_findings(chunk, include_context, workers, sentence_findings))
+        yield from imap_ordered(row_processor, chunk, workers)
+
 # Function to process the CSV file
-def process_csv_file(input_csv_path, output_csv_path):
+def process_csv_file(input_csv_path, output_csv_path, workers=1, dedup=False, include_context=False, resume=False,
+                     output_mode='full', incremental_run=False, previous_output_path=None):
+    global manifest
+    # The journal records every finished row so an interrupted run can be resumed; resuming truncates
+    # the outputs back to journaled byte offsets, so it is only available for CSV outputs
+    if table_io.supports_resume(output_csv_path, error_csv_path):
+        journal = CheckpointJournal(output_csv_path + '.journal', resume=resume)
+    elif resume:
+        raise ValueError("Resuming a run needs CSV output and error files")
+    else:
+        journal = NullJournal()
+    resuming = journal.restore_outputs(output_csv_path, error_csv_path)
+    # The manifest of the previous output is read before this run overwrites it
+    manifest = incremental.Manifest(config_fingerprint(), incremental.manifest_path(previous_output_path or output_csv_path)) \
+        if incremental_run else None
+    if manifest is not None:
+        # Rows written before an interrupted run stopped are skipped, so their entries come from the journal
+        manifest.restore(journal.details.values())
+
+    # Optionally run the ensemble once per unique sentence of each chunk of rows before writing them;
+    # scheduling by model needs the sentences up front, and without dedup each sentence keeps its own
+    # report as context
+    sentence_findings = None
+    if dedup or schedule_by_model:
+        include_context = include_context or not dedup
+        sentence_findings = {}
+
     # Open the input CSV file
-    with open(input_csv_path, 'r', encoding='utf-8') as infile:
-        reader = csv.DictReader(infile)
-        # Add 'Findings' to the fieldnames if not already present
-        fieldnames = reader.fieldnames + ['Findings'] if 'Findings' not in reader.fieldnames else reader.fieldnames
-
-        # Open the output and error CSV files for writing
-        with open(output_csv_path, 'w', encoding='utf-8', newline='') as outfile, \
-             open(error_csv_path, 'w', encoding='utf-8', newline='') as errorfile:
-            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-            writer.writeheader()
-
-            error_writer = csv.DictWriter(errorfile, fieldnames=reader.fieldnames)
-            error_writer.writeheader()
-
-            # Process each row in the input CSV
-            for row in reader:
+    with table_io.open_reader(input_csv_path) as reader:
+        # Open the output and error CSV files for writing (appending when resuming); the output gets a
+        # 'Findings' column if not already present
+        file_mode = 'a' if resuming else 'w'
+        with table_io.FindingsWriter(output_csv_path, reader.fieldnames, 'Findings', output_mode, file_mode) as writer, \
+             table_io.open_writer(error_csv_path, reader.fieldnames, file_mode) as error_writer:
+            if not resuming:
+                journal.record(None, 'start', writer, error_writer)
+
+            # Skip the rows finished by a previous run
+            pending_rows = (row for row in reader if row_key(row) not in journal.completed)
+
+            # Rows are processed by the workers and written here in input order
+            row_processor = partial(process_row, sentence_findings=sentence_findings, include_context=include_context)
+            if sentence_findings is None:
+                processed_rows = imap_ordered(row_processor, pending_rows, workers)
+            else:
+                processed_rows = precomputed_chunks(row_processor, pending_rows, sentence_findings, include_context, workers)
+            for row, findings_output in processed_rows:
                 file_name = row.get('body_part_file_name', 'Unknown')
-                report_content = row.get('report_content', '')
 
-                if not report_content:
-                    print(f"No report content for file {file_name}. Skipping.")
+                if findings_output is None:
                     continue
 
-                # Extract findings from the entire report content
-                findings_output = extract_findings(report_content, file_name)
-
                 if "Error" in findings_output:
                     print(f"Writing file {file_name} to error.csv due to error in extraction.")
                     error_writer.writerow(row)
-                    errorfile.flush()
+                    journal.record(row_key(row), 'error', writer, error_writer)
                     continue
 
                 # Get findings and clean them
@@ -491,10 +744,142 @@ def process_csv_file(input_csv_path, output_csv_path):
 
                 # Write the row to the output CSV
                 writer.writerow(row)
-                outfile.flush()
+                manifest_entry = manifest.record(row, findings, carried=findings_output.get("Carried", False)) \
+                    if manifest is not None else None
+                journal.record(row_key(row), 'done', writer, error_writer, manifest_entry)
+
+            journal.close()
+
+    if manifest is not None:
+        manifest.write(incremental.manifest_path(output_csv_path))
+        manifest.print_summary()
 
     print(f"\nAll findings saved to {output_csv_path}")
     print(f"Errors saved to {error_csv_path}")
-
-# Call the function to process the CSV file
-process_csv_file(input_csv_path, output_csv_path)
+    cache_counters = ollama_client.cache_stats()
+    if cache_counters:
+        print(f"Response cache: {cache_counters['hits']} hits, {cache_counters['misses']} misses, {cache_counters['evictions']} evictions")
+    if semantic_cache is not None:
+        semantic_counters = semantic_cache.stats()
+        print(f"Semantic cache: {semantic_counters['reuses']} of {semantic_counters['lookups']} sentences reused, "
+              f"{semantic_counters['rejected_by_guard']} similar sentences rejected for negation, side or number")
+    if fast_path is not None:
+        fast_path.print_summary()
+    ollama_client.print_endpoint_stats()
+    ollama_client.print_concurrency_stats()
+    call_metrics.print_summary()
+
+# Function to apply a dict of overrides to the module-level settings
+def apply_config(config):
+    global chat_semaphore
+    unknown = set(config) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    globals().update(config)
+    if 'max_concurrent_requests' in config or 'adaptive_concurrency' in config:
+        chat_semaphore = make_chat_semaphore()
+
+# Function to return the threads that send one stage's calls for many sentences at once; with
+# adaptive_concurrency there are enough for the highest adaptive limit
+def request_workers():
+    return aimd.max_limit if adaptive_concurrency else max_concurrent_requests
+
+# Function to run the pipeline over an input CSV; config overrides the settings above, e.g. {'num_workers': 4}
+def run(input_path=None, output_path=None, config=None):
+    global semantic_cache, fast_path
+    apply_config(config or {})
+
+    # Point the Ollama client at the configured endpoints and response cache
+    ollama_client.configure(hosts=ollama_hosts, cache_path=cache_path, cache_mode=cache_mode, cache_max_mb=cache_max_mb,
+                            model_keep_alive=ollama_keep_alive, num_ctx=ollama_num_ctx, metrics_path=metrics_path,
+                            adaptive_limits=adaptive_concurrency)
+    if semantic_cache is not None:
+        semantic_cache.close()
+    semantic_cache = (SemanticCache(semantic_cache_threshold, semantic_cache_path, semantic_audit_path)
+                      if semantic_cache_threshold is not None else None)
+    fast_path = RuleEngine() if rule_fast_path else None
+
+    # Call the function to process the CSV file
+    process_csv_file(input_path or input_csv_path, output_path or output_csv_path, workers=num_workers,
+                     dedup=dedup_sentences, include_context=dedup_include_context, resume=resume_run,
+                     output_mode=output_mode, incremental_run=incremental_run, previous_output_path=previous_output_path)
+
+# Function to run the pipeline from the command line
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract key findings from radiology reports sentence by sentence with a temperature ensemble")
+    parser.add_argument('--input', default=input_csv_path, help="input CSV, Parquet or Arrow file with a report_content column")
+    parser.add_argument('--output', default=output_csv_path, help="output CSV, Parquet or Arrow file with the Findings column")
+    parser.add_argument('--output-mode', default=output_mode, choices=table_io.OUTPUT_MODES,
+                        help="all input columns, key columns only, or one row per finding")
+    parser.add_argument('--errors', default=error_csv_path, help="CSV for the rows that failed")
+    parser.add_argument('--temp-models', nargs='+', default=temp_models, help="temperature models of the ensemble")
+    parser.add_argument('--selection-model', default=selection_model)
+    parser.add_argument('--temperature-base-model', default=temperature_base_model,
+                        help="serve the temperature models from this base model with per-request temperatures")
+    parser.add_argument('--schedule-by-model', action='store_true', default=schedule_by_model,
+                        help="run all sentences through one model at a time to avoid model swaps")
+    parser.add_argument('--workers', type=int, default=num_workers, help="reports processed in parallel")
+    parser.add_argument('--concurrency', type=int, default=max_concurrent_requests, help="maximum chat calls in flight")
+    parser.add_argument('--hosts', nargs='+', default=ollama_hosts, help="Ollama endpoints to spread requests across")
+    parser.add_argument('--cache', default=cache_path, help="response cache file (off unless given)")
+    parser.add_argument('--adaptive-concurrency', action='store_true', default=adaptive_concurrency,
+                        help="adjust the calls in flight per endpoint and stage to the observed latency")
+    parser.add_argument('--cache-mode', default=cache_mode, choices=('use', 'refresh', 'bypass'))
+    parser.add_argument('--metrics', default=metrics_path, help="JSON lines file for per-call metrics (off unless given)")
+    parser.add_argument('--selection-engine', default=selection_engine, choices=('llm', 'rules', 'hybrid'))
+    parser.add_argument('--adaptive', action='store_true', default=adaptive_ensemble, help="stop the ensemble early once candidates agree")
+    parser.add_argument('--temperature-order', nargs='+', default=adaptive_temperature_order,
+                        help="order the adaptive ensemble queries the temperature models in (default: --temp-models)")
+    parser.add_argument('--batch-sentences', action='store_true', default=batch_sentences,
+                        help="ask each temperature model about several sentences of a report in one call")
+    parser.add_argument('--max-batch-sentences', type=int, default=max_batch_sentences, help="sentences per batched call")
+    parser.add_argument('--dedup', action='store_true', default=dedup_sentences,
+                        help="run the ensemble once per unique sentence across the input")
+    parser.add_argument('--dedup-chunk-rows', type=int, default=dedup_chunk_rows,
+                        help="rows deduplicated and written together, the most a resumed run repeats")
+    parser.add_argument('--semantic-threshold', type=float, default=semantic_cache_threshold,
+                        help="reuse the findings of earlier sentences at least this similar (e.g. 0.85)")
+    parser.add_argument('--semantic-cache', default=semantic_cache_path, help="file keeping the sentence findings across runs")
+    parser.add_argument('--semantic-audit', default=semantic_audit_path, help="JSON lines log of every reused finding")
+    parser.add_argument('--rule-fast-path', action='store_true', default=rule_fast_path,
+                        help="answer formulaic sentences by rule instead of the ensemble")
+    parser.add_argument('--resume', action='store_true', default=resume_run, help="resume from the checkpoint journal")
+    parser.add_argument('--incremental', action='store_true', default=incremental_run,
+                        help="carry forward the findings of unchanged reports and only process new or changed ones")
+    parser.add_argument('--previous', default=previous_output_path,
+                        help="output of the previous run whose manifest is used (default: --output)")
+    args = parser.parse_args(argv)
+
+    print("Script started...")
+    run(args.input, args.output, {
+        'error_csv_path': args.errors,
+        'temp_models': args.temp_models,
+        'selection_model': args.selection_model,
+        'temperature_base_model': args.temperature_base_model,
+        'schedule_by_model': args.schedule_by_model,
+        'num_workers': args.workers,
+        'max_concurrent_requests': args.concurrency,
+        'ollama_hosts': args.hosts,
+        'cache_path': args.cache or None,
+        'cache_mode': args.cache_mode,
+        'adaptive_concurrency': args.adaptive_concurrency,
+        'metrics_path': args.metrics or None,
+        'selection_engine': args.selection_engine,
+        'adaptive_ensemble': args.adaptive,
+        'adaptive_temperature_order': args.temperature_order,
+        'batch_sentences': args.batch_sentences,
+        'max_batch_sentences': args.max_batch_sentences,
+        'dedup_sentences': args.dedup,
+        'dedup_chunk_rows': args.dedup_chunk_rows,
+        'resume_run': args.resume,
+        'output_mode': args.output_mode,
+        'semantic_cache_threshold': args.semantic_threshold,
+        'semantic_cache_path': args.semantic_cache,
+        'semantic_audit_path': args.semantic_audit,
+        'rule_fast_path': args.rule_fast_path,
+        'incremental_run': args.incremental,
+        'previous_output_path': args.previous,
+    })
+
+if __name__ == '__main__':
+    main()
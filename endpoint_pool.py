@@ -0,0 +1,146 @@
+import contextlib
+import threading
+import time
+
+import call_metrics
+
+# Routing of chat requests over a pool of Ollama endpoints.
+#
+# Each request goes to the healthy endpoint with the fewest outstanding requests, preferring endpoints
+# that already have the requested model loaded, so the temp_* models and llama3.1 stay on the hosts
+# that hold them instead of being swapped in and out of GPU memory. Every endpoint keeps a single
+# client, so its HTTP connections are reused across requests. A background thread asks every endpoint
+# which models it has loaded (/api/ps); endpoints that fail the check or keep failing requests are
+# taken out of rotation until a check succeeds again.
+
+# Extra outstanding requests an endpoint with the model loaded may carry, compared with one without it,
+# before a request is sent to the less busy endpoint (which then has to load the model)
+model_load_penalty = 4
+# Consecutive transport errors after which an endpoint is taken out of rotation
+failure_threshold = 2
+# Seconds between health checks of the endpoints
+health_check_interval = 10.0
+
+# Function to give a model name the tag Ollama reports it under, e.g. 'llama3.1' -> 'llama3.1:latest'
+def model_name(name):
+    return name if ':' in name else f"{name}:latest"
+
+# One Ollama endpoint and its routing state
+class Endpoint:
+    def __init__(self, host, client):
+        self.host = host
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.loaded_models = set()
+        self.last_check = None
+
+class EndpointPool:
+    def __init__(self, endpoints, check_interval=None):
+        self.endpoints = list(endpoints)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        check_interval = health_check_interval if check_interval is None else check_interval
+        # A single endpoint has nothing to route around, so it is not checked
+        if len(self.endpoints) > 1 and check_interval > 0:
+            self._thread = threading.Thread(target=self._check_periodically, args=(check_interval,), daemon=True)
+            self._thread.start()
+
+    # Function to pick the endpoint for a request and count it as outstanding there; endpoints in exclude
+    # (those that already failed this request) are only used when nothing else is left
+    def acquire(self, model, exclude=()):
+        model = model_name(model)
+        with self._lock:
+            candidates = ([endpoint for endpoint in self.endpoints if endpoint.healthy and endpoint not in exclude]
+                          or [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+                          or self.endpoints)
+            endpoint = min(candidates, key=lambda endpoint: endpoint.outstanding
+                           + (0 if model in endpoint.loaded_models else model_load_penalty))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            # The endpoint loads the model for this request, so the following requests stick to it
+            endpoint.loaded_models.add(model)
+            return endpoint
+
+    # Function to finish a request on an endpoint; failed marks a transport error
+    def release(self, endpoint, failed=False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if not failed:
+                endpoint.consecutive_failures = 0
+                endpoint.healthy = True
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= failure_threshold:
+                endpoint.healthy = False
+
+    # Function to stop counting a request as outstanding on an endpoint while it waits to be sent, e.g. for
+    # an adaptive concurrency limit, so requests that are only queued do not steer the routing
+    @contextlib.contextmanager
+    def waiting(self, endpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                endpoint.outstanding += 1
+
+    # Function to tell whether a healthy endpoint is left that has not been tried yet
+    def has_untried(self, tried):
+        with self._lock:
+            return any(endpoint.healthy and endpoint not in tried for endpoint in self.endpoints)
+
+    # Function to check an endpoint and refresh the models it has loaded
+    def check(self, endpoint):
+        ps = getattr(endpoint.client, 'ps', None)
+        if ps is None:
+            return endpoint.healthy
+        try:
+            response = ps()
+        except Exception:
+            with self._lock:
+                endpoint.healthy = False
+                endpoint.loaded_models = set()
+                endpoint.last_check = time.time()
+            return False
+        loaded_models = set()
+        for entry in call_metrics.response_field(response, 'models') or []:
+            name = call_metrics.response_field(entry, 'model') or call_metrics.response_field(entry, 'name')
+            if name:
+                loaded_models.add(model_name(name))
+        with self._lock:
+            endpoint.healthy = True
+            endpoint.consecutive_failures = 0
+            endpoint.loaded_models = loaded_models
+            endpoint.last_check = time.time()
+        return True
+
+    def _check_periodically(self, interval):
+        # The first check runs straight away, so routing starts out knowing where the models are loaded
+        while True:
+            for endpoint in self.endpoints:
+                self.check(endpoint)
+            if self._stop.wait(interval):
+                return
+
+    # Function to report the routing state of every endpoint
+    def stats(self):
+        with self._lock:
+            return [{
+                'host': endpoint.host,
+                'healthy': endpoint.healthy,
+                'outstanding': endpoint.outstanding,
+                'requests': endpoint.requests,
+                'failures': endpoint.failures,
+                'loaded_models': sorted(endpoint.loaded_models),
+            } for endpoint in self.endpoints]
+
+    # Function to stop the health checks
+    def close(self):
+        self._stop.set()
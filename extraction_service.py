@@ -0,0 +1,265 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import call_metrics
+import current_results
+import final_results
+import ollama_client
+
+# Long-running HTTP extraction service.
+#
+# POST /extract  {"report": "...", "pipeline": "final" | "current"}  -> {"Findings": "..."}
+# GET  /metrics  queue depth, batching, deduplication and latency counters
+# GET  /health
+#
+# Sentences for the ensemble pipeline are collected into micro-batches, and each batch is processed by one
+# current_results.process_sentences_by_model call: every temperature model runs over the whole batch in
+# turn (with batched prompts per report when batch_sentences is set), then the selection stage. Whole
+# reports for the single-pass pipeline have nothing to share, so they are not batched. In both cases a
+# request for an item that is queued or already being extracted waits for that result instead of
+# starting another one.
+
+# Function to compute a percentile of a list of numbers
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+# Collects submitted items into micro-batches and passes each batch of unique items to process_batch, which
+# returns their results in order, on a worker pool
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=16, max_wait=0.02, workers=4):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.submitted = 0
+        self.batch_deduplicated = 0
+        self.in_flight_shared = 0
+        self.batches = 0
+        self.batched_items = 0
+        self._queue = queue.Queue()
+        self._queued = {}
+        self._running = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread = threading.Thread(target=self._collect_batches, daemon=True)
+        self._thread.start()
+
+    # Function to submit an item, returning a Future shared by every identical item not yet finished
+    def submit(self, key, payload):
+        with self._lock:
+            self.submitted += 1
+            if key in self._queued:
+                self.batch_deduplicated += 1
+                return self._queued[key]
+            if key in self._running:
+                self.in_flight_shared += 1
+                return self._running[key]
+            future = Future()
+            self._queued[key] = future
+        self._queue.put((key, payload))
+        return future
+
+    def _collect_batches(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            with self._lock:
+                self.batches += 1
+                self.batched_items += len(batch)
+                for key, _ in batch:
+                    self._running[key] = self._queued.pop(key)
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        keys = [key for key, _ in batch]
+        with self._lock:
+            futures = [self._running[key] for key in keys]
+        try:
+            results = self.process_batch([payload for _, payload in batch])
+        except Exception as e:
+            with self._lock:
+                for key in keys:
+                    del self._running[key]
+            for future in futures:
+                future.set_exception(e)
+        else:
+            with self._lock:
+                for key in keys:
+                    del self._running[key]
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    # Function to report the queue depth and batching counters
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': len(self._queued),
+                'in_flight': len(self._running),
+                'submitted': self.submitted,
+                'batch_deduplicated': self.batch_deduplicated,
+                'in_flight_shared': self.in_flight_shared,
+                'batches': self.batches,
+                'mean_batch_size': round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            }
+
+# Wraps both pipelines behind their micro-batchers
+class ExtractionService:
+    def __init__(self, default_pipeline='current', max_batch_size=16, max_wait=0.02, workers=4):
+        self.default_pipeline = default_pipeline
+        # Reports run one per batch without waiting, so only identical requests are shared
+        self.report_batcher = MicroBatcher(self._extract_reports, 1, 0, workers)
+        self.sentence_batcher = MicroBatcher(current_results.process_sentences_by_model, max_batch_size, max_wait, workers)
+        self.requests = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=10000)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _extract_reports(reports):
+        results = []
+        for report_content in reports:
+            findings_output = final_results.extract_findings(report_content)
+            if "Error" in findings_output:
+                raise RuntimeError(findings_output["Error"])
+            results.append(final_results.clean_findings(findings_output.get("Findings", "")))
+        return results
+
+    # Function to extract the findings of one report with the requested pipeline
+    def extract(self, report_content, pipeline=None):
+        pipeline = pipeline or self.default_pipeline
+        started = time.perf_counter()
+        try:
+            if pipeline == 'final':
+                key = current_results.normalize_sentence(report_content)
+                return {"Findings": self.report_batcher.submit(key, report_content).result()}
+            if pipeline != 'current':
+                raise ValueError(f"Unknown pipeline {pipeline!r}")
+
+            # Every sentence goes through the sentence batcher, then the report is assembled from the results;
+            # without dedup_sentences a sentence is only shared between requests for the same report
+            include_context = current_results.dedup_include_context or not current_results.dedup_sentences
+            futures = {}
+            for sentence in current_results.split_sentences(report_content):
+                key = current_results.sentence_key(report_content, sentence, include_context)
+                futures.setdefault(key, self.sentence_batcher.submit(key, (report_content, sentence)))
+            sentence_findings = {key: future.result() for key, future in futures.items()}
+            return current_results.extract_findings(report_content, sentence_findings=sentence_findings,
+                                                    include_context=include_context)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.requests += 1
+                self._latencies.append(time.perf_counter() - started)
+
+    # Function to report the service metrics
+    def metrics(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            service_metrics = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'latency_p50': round(percentile(latencies, 0.5), 4),
+                'latency_p95': round(percentile(latencies, 0.95), 4),
+            }
+        service_metrics['report_batcher'] = self.report_batcher.stats()
+        service_metrics['sentence_batcher'] = self.sentence_batcher.stats()
+        service_metrics['queue_depth'] = (service_metrics['report_batcher']['queue_depth']
+                                          + service_metrics['sentence_batcher']['queue_depth'])
+        service_metrics['cache'] = ollama_client.cache_stats()
+        service_metrics['endpoints'] = ollama_client.endpoint_stats()
+        service_metrics['calls'] = call_metrics.summary()['stage']
+        return service_metrics
+
+# Function to build the HTTP handler class bound to a service
+def make_handler(service):
+    class ExtractionHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            elif self.path == '/metrics':
+                self._send_json(200, service.metrics())
+            else:
+                self._send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/extract':
+                self._send_json(404, {'error': 'Not found'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                report_content = request['report']
+            except (ValueError, KeyError):
+                self._send_json(400, {'error': 'Expected a JSON body with a "report" field'})
+                return
+            try:
+                self._send_json(200, service.extract(report_content, request.get('pipeline')))
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ExtractionHandler
+
+# Function to run the service until interrupted
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP service extracting findings with micro-batching")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--pipeline', default='current', choices=('final', 'current'), help="default pipeline")
+    parser.add_argument('--max-batch-size', type=int, default=16, help="sentences per ensemble batch")
+    parser.add_argument('--max-wait-ms', type=float, default=20.0, help="how long a sentence batch waits to fill up")
+    parser.add_argument('--workers', type=int, default=4, help="batches (or single-pass reports) extracted in parallel")
+    parser.add_argument('--ollama-hosts', nargs='+', default=None, help="Ollama endpoints")
+    parser.add_argument('--cache', default=None, help="response cache file")
+    parser.add_argument('--fake', action='store_true', help="use the offline fake backend from benchmark.py")
+    parser.add_argument('--fake-latency', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    backend = None
+    if args.fake:
+        from benchmark import FakeOllama
+        backend = FakeOllama(latency=args.fake_latency)
+    ollama_client.configure(hosts=args.ollama_hosts, cache_path=args.cache, backend=backend)
+
+    service = ExtractionService(args.pipeline, args.max_batch_size, args.max_wait_ms / 1000, args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Extraction service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,15 @@
-import ollama
-import csv
-import json
-import re
-
-print("Script started...")
+import argparse
+
+import call_metrics
+import incremental
+import ollama_client
+import table_io
+import text_processing
+from checkpoint import CheckpointJournal, NullJournal, row_key
+from findings_json import FINDINGS_SCHEMA, extract_json_from_response, json_object_complete
+from parallel_runner import imap_ordered
+from prompts import EXTRACTION_SYSTEM_PROMPT, EXTRACTION_USER_TEMPLATE, extraction_messages
+from rule_engine import RULES, RuleEngine
 
 # Specify the paths and model
 input_csv_path = '/Users/lachyshinnick/Downloads/valid_reports.csv'  # Replace with your input CSV file path
@@ -11,18 +17,56 @@ output_csv_path = '/Users/lachyshinnick/Desktop/codes/ollamaTest/final_results.c
 error_csv_path = '/Users/lachyshinnick/Desktop/codes/ollamaTest/error.csv'  # Replace with your error file path
 desiredModel = 'llama3.1:latest'
 
-# Function to extract JSON from model response
-def extract_json_from_response(response_text):
-    try:
-        # Ensure response is cleanly formatted and extract the first JSON object found
-        json_matches = re.findall(r'({.*?})', response_text, re.DOTALL)
-        if json_matches:
-            json_str = json_matches[-1].replace("'", '"')  # Fix apostrophes for valid JSON
-            return json.loads(json_str)
-        else:
-            return {"Error": "Invalid JSON"}
-    except (ValueError, json.JSONDecodeError):
-        return {"Error": "Invalid JSON"}
+# Number of reports processed in parallel, and the Ollama endpoints they are spread across
+num_workers = 1
+ollama_hosts = None  # e.g. ['http://gpu-1:11434', 'http://gpu-2:11434']; None uses the default host
+
+# On-disk cache of model responses; cache_mode is 'use', 'refresh' (re-query and overwrite) or 'bypass'
+cache_path = None  # e.g. 'response_cache.sqlite'; None disables the cache
+cache_mode = 'use'
+cache_max_mb = 1024
+
+# How long Ollama keeps models loaded between calls, and the pinned context size shared by every call
+ollama_keep_alive = '30m'
+ollama_num_ctx = 8192
+
+# Adjust the chat calls in flight to each endpoint and stage to the latency observed (AIMD), backing off on
+# slow responses, timeouts and 503s
+adaptive_concurrency = False
+
+# JSON lines file with the model, stage, wall time and token counts of every chat call (None, the default,
+# only keeps the end-of-run summary)
+metrics_path = None  # e.g. 'call_metrics.jsonl'
+
+# Resume an interrupted run from its checkpoint journal, appending to the existing output files (CSV only)
+resume_run = False
+
+# Output layout: 'full' (every input column), 'keys' (key columns and Key Findings only) or 'split' (one
+# row per finding). The input and output may also be Parquet or Arrow files, picked by file extension.
+output_mode = 'full'
+
+# Answer formulaic sentences ("no X", "X is normal", "X is unremarkable", ...) with rule_engine and send
+# only the rest of the report to the model, skipping the call when every sentence is answered
+rule_fast_path = False
+
+# Incremental run: carry the findings of reports whose content and pipeline configuration are unchanged
+# forward from the manifest of previous_output_path (None uses the output path itself), and only process
+# new or changed reports
+incremental_run = False
+previous_output_path = None
+
+# Settings above that run() and the command line can override
+SETTINGS = (
+    'input_csv_path', 'output_csv_path', 'error_csv_path', 'desiredModel', 'num_workers', 'ollama_hosts',
+    'cache_path', 'cache_mode', 'cache_max_mb', 'ollama_keep_alive', 'ollama_num_ctx', 'adaptive_concurrency', 'metrics_path',
+    'resume_run',
+    'output_mode', 'rule_fast_path', 'incremental_run', 'previous_output_path',
+)
+
+# RuleEngine built by run() when rule_fast_path is set
+fast_path = None
+# incremental.Manifest built by process_csv_file() when incremental_run is set
+manifest = None
 
 # Function to clean findings output
 def clean_findings(findings):
@@ -34,14 +78,14 @@ def clean_findings(findings):
         cleaned_findings = findings
     
     # Remove unwanted symbols, if any (e.g., square brackets or apostrophes)
-    cleaned_findings = re.sub(r"[\[\]']", "", cleaned_findings)
+    cleaned_findings = text_processing.UNWANTED_SYMBOLS.sub("", cleaned_findings)
     
     # Split the findings into individual statements
     statements = cleaned_findings.split('; ')
     updated_statements = []
     for statement in statements:
         # Replace "There are" with "There is" at the beginning of the statement
-        updated_statement = re.sub(r'^There are', 'There is', statement)
+        updated_statement = text_processing.THERE_ARE.sub('There is', statement)
         updated_statements.append(updated_statement)
     
     # Rejoin the statements
@@ -49,155 +93,124 @@ def clean_findings(findings):
     
     return final_findings
 
-def extract_findings(report_content, file_name):
-    prompt = f"""
-        <|begin_of_text|><|start_header_id|>system<|end_header_id|>
-
-        You are a helpful assistant trained to extract key medical findings from radiology reports.
-
-        **Instructions**:
-
-        - **Output Format**: Provide findings in JSON format with the key "Findings". The value should be a string containing one or more statements.
-        - **Statement Format**:
-        - For **positive findings**:
-            - If the location is mentioned: "There is <diagnosis> located at <location>."
-            - If the location is not mentioned: "There is <diagnosis>."
-        - For **negative findings** (only if explicitly mentioned in the report):
-            - "There is no <diagnosis>."
-        - For **normal findings**:
-            - If explicitly mentioned in the report, include them as: "There is normal <structure>."
-        - **General Rules**:
-        - **Include** all findings mentioned in the report, both abnormal and normal.
-        - **Do not** include speculative or uncertain findings. Exclude any statements containing words like "possible", "suggests", "may indicate", "could", "probably", etc.
-        - **Do not** include redundant or repetitive statements.
-        - **Ensure** that each statement starts with "There is", "There is no", or "There is normal" as per the format.
-        - **Only include** findings that strictly adhere to the required format.
-
-        **Examples**:
-
-        **Example 1**:
-
-        Report Content:
-        "there is a fracture involving the proximal shaft of the right humerus. there is minimal displacement. the humeral head is enlocated. alignment at the elbow joint is anatomical."
-
-        Findings:
-        {{
-        "Findings": "There is a fracture located at the proximal shaft of the right humerus; There is minimal displacement; There is normal humeral head; There is normal alignment at the elbow joint."
-        }}
-
-        **Example 1 note**: This output effectively captures all key findings about the fracture, displacement, and normal alignment. It follows the "There is" format for each positive finding and maintains conciseness while including the most relevant diagnostic information.
-
-        **Example 2**:
-
-        Report Content:
-        "the cardiomediastinal contour appears normal. the lungs and pleural spaces are clear."
-
-        Findings:
-        {{
-        "Findings": "There is normal cardiomediastinal contour; There is clear lungs; There is clear pleural spaces."
-        }}
-
-        **Example 2 note**: This output is short and precise, capturing the normal findings of the cardiomediastinal contour, lungs, and pleural spaces. The "There is" format is used effectively to ensure clarity and consistency.
-
-        **Example 3**:
-
-        Report Content:
-        "no orbital floor fracture. no maxillary sinus fluid level. no nasal bone fracture. no evidence of zygomatic arch fracture."
-
-        Findings:
-        {{
-        "Findings": "There is no orbital floor fracture; There is no maxillary sinus fluid level; There is no nasal bone fracture; There is no zygomatic arch fracture."
-        }}
-
-        **Example 3 note**: This output concisely captures multiple negative findings. The use of "There is no" clearly communicates the absence of fractures and fluid levels, maintaining adherence to the required format without unnecessary details.
-
-        **Example 4**:
-
-        Report Content:
-        "the lungs are clear. heart size is normal. no pleural effusion."
-
-        Findings:
-        {{
-        "Findings": "There is clear lungs; There is normal heart size; There is no pleural effusion."
-        }}
-
-        **Example 4 note**: This output succinctly identifies key positive and negative findings about the lungs, heart size, and pleural effusion. The response follows the required format and avoids unnecessary elaboration, keeping the information relevant and concise.
-
-        **Example 5**:
-
-        Report Content:
-        "there is a possible fracture of the distal radius. appearances suggest a mild sprain. no definite fracture is seen."
-
-        Findings:
-        {{
-        "Findings": "" 
-        }}
-
-        **Example 5 note**: Speculative language such as "possible" and "suggest" is excluded, as it does not meet the requirement for definitive diagnostic statements. This response correctly omits findings that are uncertain or speculative.
-
-        **Explanation**: Speculative findings containing words like "possible" and "suggest" are omitted, and relevant medical information is included.
-
-        <|eot_id|><|start_header_id|>user<|end_header_id|>
-
-        **Report Content**:
-        "{report_content}"
-
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>
-        """
-
-    max_retries = 5
-    for attempt in range(max_retries):
-        try:
-            response = ollama.chat(model=desiredModel, messages=[
-                {'role': 'user', 'content': prompt},
-            ])
-            raw_content = response['message']['content'].strip()
-            # Extract JSON
-            print(raw_content)
-            structured_data = extract_json_from_response(raw_content)
-            if "Error" not in structured_data:
-                # Successfully extracted findings
-                return structured_data
-            else:
-                print(f"Attempt {attempt+1} failed due to invalid JSON in findings for {file_name}")
-        except Exception as e:
-            print(f"Attempt {attempt+1} failed processing findings for file {file_name}: {e}")
-    # After retries, return error
-    print(f"Skipping sentence after {max_retries} attempts in file {file_name}")
-    structured_data = {"Error": "Failed after retries"}
+# Function to answer the formulaic sentences of a report by rule, returning their findings and the rest
+# of the report for the model ('' when every sentence was answered)
+def apply_rules(report_content):
+    rule_findings = []
+    remaining_sentences = []
+    for sentence in text_processing.split_sentences(report_content):
+        findings = fast_path.match(sentence)
+        if findings is None:
+            remaining_sentences.append(sentence)
+        else:
+            rule_findings.append(findings)
+    if not rule_findings:
+        return rule_findings, report_content
+    return rule_findings, ''.join(f"{sentence}. " for sentence in remaining_sentences).strip()
+
+def extract_findings(report_content, file_name='Unknown'):
+    rule_findings = []
+    if fast_path is not None:
+        rule_findings, report_content = apply_rules(report_content)
+        if rule_findings:
+            print(f"Rule findings for {file_name}: {'; '.join(rule_findings)}")
+        if not report_content:
+            return {"Findings": '; '.join(text_processing.dedup_findings(rule_findings))}
+
+    # The output is constrained to the Findings schema, and ollama_client retries transport errors
+    try:
+        response = ollama_client.chat(model=desiredModel, messages=extraction_messages(report_content),
+                                      format=FINDINGS_SCHEMA, stage='extract',
+                                      stop_when=json_object_complete)
+        raw_content = response['message']['content'].strip()
+        # Extract JSON
+        print(raw_content)
+        structured_data = extract_json_from_response(raw_content)
+        if "Error" not in structured_data:
+            # Successfully extracted findings; the rule findings follow the model's
+            if rule_findings:
+                findings = structured_data.get("Findings", "")
+                if isinstance(findings, list):
+                    findings = "; ".join(findings)
+                structured_data["Findings"] = '; '.join(([findings] if findings else []) + rule_findings)
+            return structured_data
+        print(f"Invalid JSON in findings for {file_name}")
+    except Exception as e:
+        print(f"Failed processing findings for file {file_name}: {e}")
+    structured_data = {"Error": "Failed to extract findings"}
     return structured_data
 
+# Function to return the prompts, model and settings that decide the findings, for incremental runs
+def config_fingerprint():
+    return {
+        'pipeline': 'final_results',
+        'model': desiredModel,
+        'num_ctx': ollama_num_ctx,
+        'prompts': [EXTRACTION_SYSTEM_PROMPT, EXTRACTION_USER_TEMPLATE],
+        'rules': [(name, pattern.pattern, template) for name, pattern, template in RULES] if rule_fast_path else None,
+    }
+
+# Function to extract the findings for a single CSV row, run on the worker pool
+def process_row(row):
+    file_name = row.get('body_part_file_name', 'Unknown')
+    report_content = row.get('report_content', '')
+
+    if not report_content:
+        print(f"No report content for file {file_name}. Skipping.")
+        return row, None
+
+    # Reuse the findings of an unchanged report from the previous run
+    if manifest is not None:
+        findings = manifest.previous_findings(row)
+        if findings is not None:
+            return row, {"Findings": findings, "Carried": True}
+
+    # Extract findings from the entire report content
+    return row, extract_findings(report_content, file_name)
+
 # Function to process the CSV file
-def process_csv_file(input_csv_path, output_csv_path):
+def process_csv_file(input_csv_path, output_csv_path, workers=1, resume=False, output_mode='full', incremental_run=False,
+                     previous_output_path=None):
+    global manifest
+    # The journal records every finished row so an interrupted run can be resumed; resuming truncates
+    # the outputs back to journaled byte offsets, so it is only available for CSV outputs
+    if table_io.supports_resume(output_csv_path, error_csv_path):
+        journal = CheckpointJournal(output_csv_path + '.journal', resume=resume)
+    elif resume:
+        raise ValueError("Resuming a run needs CSV output and error files")
+    else:
+        journal = NullJournal()
+    resuming = journal.restore_outputs(output_csv_path, error_csv_path)
+    # The manifest of the previous output is read before this run overwrites it
+    manifest = incremental.Manifest(config_fingerprint(), incremental.manifest_path(previous_output_path or output_csv_path)) \
+        if incremental_run else None
+    if manifest is not None:
+        # Rows written before an interrupted run stopped are skipped, so their entries come from the journal
+        manifest.restore(journal.details.values())
+
     # Read the input CSV file
-    with open(input_csv_path, 'r', encoding='utf-8') as infile:
-        reader = csv.DictReader(infile)
-        fieldnames = reader.fieldnames + ['Key Findings']
-        
-        # Open the output CSV file for writing (overwrite mode)
-        with open(output_csv_path, 'w', encoding='utf-8', newline='') as outfile, \
-             open(error_csv_path, 'w', encoding='utf-8', newline='') as errorfile:
-            writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-            writer.writeheader()
+    with table_io.open_reader(input_csv_path) as reader:
+        # Open the output CSV file for writing (overwrite mode, or append mode when resuming)
+        file_mode = 'a' if resuming else 'w'
+        with table_io.FindingsWriter(output_csv_path, reader.fieldnames, 'Key Findings', output_mode, file_mode) as writer, \
+             table_io.open_writer(error_csv_path, reader.fieldnames, file_mode) as error_writer:
+            if not resuming:
+                journal.record(None, 'start', writer, error_writer)
             
-            error_writer = csv.DictWriter(errorfile, fieldnames=reader.fieldnames)
-            error_writer.writeheader()
+            # Skip the rows finished by a previous run
+            pending_rows = (row for row in reader if row_key(row) not in journal.completed)
             
-            for row in reader:
+            # Rows are processed by the workers and written here in input order
+            for row, findings_output in imap_ordered(process_row, pending_rows, workers):
                 file_name = row.get('body_part_file_name', 'Unknown')
-                report_content = row.get('report_content', '')
-                
-                if not report_content:
-                    print(f"No report content for file {file_name}. Skipping.")
+
+                if findings_output is None:
                     continue
                 
-                # Extract findings from the entire report content
-                findings_output = extract_findings(report_content, file_name)
-                
                 if "Error" in findings_output:
                     print(f"Writing file {file_name} to error.csv due to error.")
                     error_writer.writerow(row)
-                    errorfile.flush()
+                    journal.record(row_key(row), 'error', writer, error_writer)
                     continue
                 
                 # Get findings
@@ -211,10 +224,88 @@ def process_csv_file(input_csv_path, output_csv_path):
                 
                 # Write the row to the output CSV
                 writer.writerow(row)
-                outfile.flush()
+                manifest_entry = manifest.record(row, cleaned_findings, carried=findings_output.get("Carried", False)) \
+                    if manifest is not None else None
+                journal.record(row_key(row), 'done', writer, error_writer, manifest_entry)
                 
+        journal.close()
+        if manifest is not None:
+            manifest.write(incremental.manifest_path(output_csv_path))
+            manifest.print_summary()
         print(f"All findings saved to {output_csv_path}")
         print(f"Errors saved to {error_csv_path}")
-
-# Call the function to process the CSV file
-process_csv_file(input_csv_path, output_csv_path)
\ No newline at end of file
+        cache_counters = ollama_client.cache_stats()
+        if cache_counters:
+            print(f"Response cache: {cache_counters['hits']} hits, {cache_counters['misses']} misses, {cache_counters['evictions']} evictions")
+        if fast_path is not None:
+            fast_path.print_summary()
+        ollama_client.print_endpoint_stats()
+        ollama_client.print_concurrency_stats()
+        call_metrics.print_summary()
+
+# Function to apply a dict of overrides to the module-level settings
+def apply_config(config):
+    unknown = set(config) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    globals().update(config)
+
+# Function to run the pipeline over an input CSV; config overrides the settings above, e.g. {'num_workers': 4}
+def run(input_path=None, output_path=None, config=None):
+    global fast_path
+    apply_config(config or {})
+
+    # Point the Ollama client at the configured endpoints and response cache
+    ollama_client.configure(hosts=ollama_hosts, cache_path=cache_path, cache_mode=cache_mode, cache_max_mb=cache_max_mb,
+                            model_keep_alive=ollama_keep_alive, num_ctx=ollama_num_ctx, metrics_path=metrics_path,
+                            adaptive_limits=adaptive_concurrency)
+    fast_path = RuleEngine() if rule_fast_path else None
+
+    # Call the function to process the CSV file
+    process_csv_file(input_path or input_csv_path, output_path or output_csv_path, workers=num_workers, resume=resume_run,
+                     output_mode=output_mode, incremental_run=incremental_run, previous_output_path=previous_output_path)
+
+# Function to run the pipeline from the command line
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract key findings from radiology reports with a single model call per report")
+    parser.add_argument('--input', default=input_csv_path, help="input CSV, Parquet or Arrow file with a report_content column")
+    parser.add_argument('--output', default=output_csv_path, help="output CSV, Parquet or Arrow file with the Key Findings column")
+    parser.add_argument('--output-mode', default=output_mode, choices=table_io.OUTPUT_MODES,
+                        help="all input columns, key columns only, or one row per finding")
+    parser.add_argument('--errors', default=error_csv_path, help="CSV for the rows that failed")
+    parser.add_argument('--model', default=desiredModel)
+    parser.add_argument('--workers', type=int, default=num_workers, help="reports processed in parallel")
+    parser.add_argument('--hosts', nargs='+', default=ollama_hosts, help="Ollama endpoints to spread requests across")
+    parser.add_argument('--cache', default=cache_path, help="response cache file (off unless given)")
+    parser.add_argument('--adaptive-concurrency', action='store_true', default=adaptive_concurrency,
+                        help="adjust the calls in flight per endpoint and stage to the observed latency")
+    parser.add_argument('--cache-mode', default=cache_mode, choices=('use', 'refresh', 'bypass'))
+    parser.add_argument('--metrics', default=metrics_path, help="JSON lines file for per-call metrics (off unless given)")
+    parser.add_argument('--rule-fast-path', action='store_true', default=rule_fast_path,
+                        help="answer formulaic sentences by rule and send only the rest of the report to the model")
+    parser.add_argument('--resume', action='store_true', default=resume_run, help="resume from the checkpoint journal")
+    parser.add_argument('--incremental', action='store_true', default=incremental_run,
+                        help="carry forward the findings of unchanged reports and only process new or changed ones")
+    parser.add_argument('--previous', default=previous_output_path,
+                        help="output of the previous run whose manifest is used (default: --output)")
+    args = parser.parse_args(argv)
+
+    print("Script started...")
+    run(args.input, args.output, {
+        'error_csv_path': args.errors,
+        'desiredModel': args.model,
+        'num_workers': args.workers,
+        'ollama_hosts': args.hosts,
+        'cache_path': args.cache or None,
+        'cache_mode': args.cache_mode,
+        'adaptive_concurrency': args.adaptive_concurrency,
+        'metrics_path': args.metrics or None,
+        'resume_run': args.resume,
+        'output_mode': args.output_mode,
+        'rule_fast_path': args.rule_fast_path,
+        'incremental_run': args.incremental,
+        'previous_output_path': args.previous,
+    })
+
+if __name__ == '__main__':
+    main()
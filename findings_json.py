@@ -0,0 +1,152 @@
+import ast
+import json
+
+# JSON schema passed as format= so Ollama constrains the output to a findings object
+FINDINGS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'Findings': {'type': 'string'},
+    },
+    'required': ['Findings'],
+}
+
+# Schema of a batched temperature response: the findings of every numbered sentence of a report
+BATCH_FINDINGS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'Sentences': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'Sentence': {'type': 'integer'},
+                    'Findings': {'type': 'string'},
+                },
+                'required': ['Sentence', 'Findings'],
+            },
+        },
+    },
+    'required': ['Sentences'],
+}
+
+_decoder = json.JSONDecoder()
+
+# Function to find the end of the brace-balanced object starting at start, ignoring braces inside strings
+def balanced_object_end(text, start):
+    depth = 0
+    in_string = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == in_string:
+                in_string = None
+        elif char == '"':
+            in_string = char
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+# Function to decode the object starting at start, returning (object, end) or (None, None)
+def decode_object_at(text, start):
+    try:
+        return _decoder.raw_decode(text, start)
+    except ValueError:
+        pass
+    # Models sometimes answer with a Python-style dict using single quotes
+    end = balanced_object_end(text, start)
+    if end is None:
+        return None, None
+    try:
+        return ast.literal_eval(text[start:end]), end
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None, None
+
+# Function to extract JSON from model response
+def extract_json_from_response(response_text):
+    # Structured output mode returns the object on its own
+    try:
+        structured_data = json.loads(response_text)
+        if isinstance(structured_data, dict):
+            return structured_data
+    except ValueError:
+        pass
+
+    # Otherwise scan the text for objects, preferring the last one that has a "Findings" key
+    last_object = None
+    last_findings = None
+    start = response_text.find('{')
+    while start != -1:
+        structured_data, end = decode_object_at(response_text, start)
+        if isinstance(structured_data, dict):
+            last_object = structured_data
+            if "Findings" in structured_data:
+                last_findings = structured_data
+            start = response_text.find('{', end)
+        else:
+            start = response_text.find('{', start + 1)
+
+    if last_findings is not None:
+        return last_findings
+    if last_object is not None:
+        return last_object
+    return {"Error": "Invalid JSON"}
+
+# Function to find the entries of a batched response, either its "Sentences" array or a bare array
+def batch_entries(response_text):
+    try:
+        structured_data = json.loads(response_text)
+    except ValueError:
+        structured_data = None
+        # Otherwise scan the text for the last object with a "Sentences" key
+        start = response_text.find('{')
+        while start != -1:
+            candidate, end = decode_object_at(response_text, start)
+            if isinstance(candidate, dict):
+                if "Sentences" in candidate:
+                    structured_data = candidate
+                start = response_text.find('{', end)
+            else:
+                start = response_text.find('{', start + 1)
+    if isinstance(structured_data, dict):
+        structured_data = structured_data.get("Sentences")
+    return structured_data if isinstance(structured_data, list) else None
+
+# Function to extract the findings of a batched response as {sentence number: findings}; entries that are
+# malformed, out of range or repeated are left out, so those sentences can be asked about again on their own
+def extract_batch_findings(response_text, sentence_count):
+    findings = {}
+    repeated = set()
+    for entry in batch_entries(response_text) or []:
+        if not isinstance(entry, dict):
+            continue
+        number = entry.get("Sentence")
+        if isinstance(number, str) and number.strip().isdigit():
+            number = int(number)
+        if isinstance(number, bool) or not isinstance(number, int) or not 1 <= number <= sentence_count:
+            continue
+        if not isinstance(entry.get("Findings"), str):
+            continue
+        if number in findings:
+            repeated.add(number)
+        findings[number] = entry["Findings"]
+    for number in repeated:
+        del findings[number]
+    return findings
+
+# Function for streamed generation: True once the first JSON object in the text has closed
+def json_object_complete(text):
+    start = text.find('{')
+    # Streamed text is checked after every token, so the character scan only runs once enough braces have
+    # closed for the object to be complete; braces inside strings at worst delay the early stop
+    if start == -1 or text.count('}') < text.count('{'):
+        return False
+    return balanced_object_end(text, start) is not None
@@ -0,0 +1,379 @@
+import argparse
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import call_metrics
+import current_results
+import final_results
+import ollama_client
+import table_io
+from candidate_scorer import SEVERITY_WORDS, content_tokens, speculative_pattern, split_statements
+from checkpoint import CheckpointJournal, NullJournal, row_key
+from parallel_runner import imap_ordered
+from rule_engine import COMPARISON_WORDS, RuleEngine
+
+# Escalating pipeline: one single-pass extraction per report (final_results), with the temperature
+# ensemble and selection (current_results) run only for the sentences whose findings fail the format
+# rules or are missing.
+#
+# Every statement of the single-pass findings is checked against the rules the prompts set out: it starts
+# with "There is", has no speculative words and does not join findings with "and"/"with". Each statement
+# is attributed to the report sentence it shares the most content words with. A sentence is kept when it
+# has no failing statements and its statements cover coverage_threshold of its content words. Every
+# other sentence is escalated to the ensemble. The run reports the escalation rate and the calls and
+# prompt tokens saved against running the ensemble for every sentence.
+
+# Specify the paths
+input_csv_path = '/Users/lachyshinnick/Downloads/valid_reports.csv'  # Replace with your input CSV file path
+output_csv_path = '/Users/lachyshinnick/Desktop/codes/ollamaTest/hybrid_results.csv'  # Replace with your output CSV file path
+error_csv_path = '/Users/lachyshinnick/Desktop/codes/ollamaTest/error.csv'  # Replace with your error file path
+
+# Model of the single pass, and the ensemble the failing sentences are escalated to
+extraction_model = final_results.desiredModel
+temp_models = list(current_results.temp_models)
+selection_model = current_results.selection_model
+selection_engine = current_results.selection_engine
+batch_sentences = current_results.batch_sentences
+
+# Number of reports processed in parallel, and the Ollama endpoints they are spread across
+num_workers = 1
+ollama_hosts = None  # e.g. ['http://gpu-1:11434', 'http://gpu-2:11434']; None uses the default host
+
+# On-disk cache of model responses; cache_mode is 'use', 'refresh' (re-query and overwrite) or 'bypass'
+cache_path = None  # e.g. 'response_cache.sqlite'; None disables the cache
+cache_mode = 'use'
+cache_max_mb = 1024
+
+# How long Ollama keeps models loaded between calls, and the pinned context size shared by every call
+ollama_keep_alive = '30m'
+ollama_num_ctx = 8192
+
+# Adjust the chat calls in flight to each endpoint and stage to the latency observed (AIMD), backing off on
+# slow responses, timeouts and 503s
+adaptive_concurrency = False
+
+# JSON lines file with the model, stage, wall time and token counts of every chat call (None, the default,
+# only keeps the end-of-run summary)
+metrics_path = None  # e.g. 'call_metrics.jsonl'
+
+# Resume an interrupted run from its checkpoint journal, appending to the existing output files (CSV only)
+resume_run = False
+
+# Output layout: 'full' (every input column), 'keys' (key columns and Findings only) or 'split' (one row
+# per finding). The input and output may also be Parquet or Arrow files, picked by file extension.
+output_mode = 'full'
+
+# Answer formulaic sentences with rule_engine before the single pass, as final_results does
+rule_fast_path = False
+
+# Fraction of a sentence's content words its single-pass statements must contain for it to be kept
+coverage_threshold = 0.5
+
+# Settings above that run() and the command line can override
+SETTINGS = (
+    'input_csv_path', 'output_csv_path', 'error_csv_path', 'extraction_model', 'temp_models', 'selection_model',
+    'selection_engine', 'batch_sentences', 'num_workers', 'ollama_hosts', 'cache_path', 'cache_mode', 'cache_max_mb',
+    'ollama_keep_alive', 'ollama_num_ctx', 'adaptive_concurrency', 'metrics_path', 'resume_run', 'output_mode',
+    'rule_fast_path', 'coverage_threshold',
+)
+
+# Statements joining two findings, which the prompts ask to be split
+joined_pattern = re.compile(r'\b(and|with)\b', re.IGNORECASE)
+# Words of a sentence its findings need not repeat: severity, comparison with earlier imaging and reporting verbs
+IGNORED_WORDS = set(SEVERITY_WORDS) | set(COMPARISON_WORDS) | {'noted', 'seen', 'identified', 'demonstrated', 'evident',
+                                                                'present', 'appears', 'appear', 'remains', 'remain'}
+
+# Counts the sentences escalated to the ensemble and why
+class EscalationStats:
+    def __init__(self):
+        self.reports = 0
+        self.reports_escalated = 0
+        self.sentences = 0
+        self.escalated = 0
+        self.reasons = Counter()
+        self._lock = threading.Lock()
+
+    # Function to record one report: its sentence count and the reasons its sentences were escalated
+    def record(self, sentences, reasons):
+        with self._lock:
+            self.reports += 1
+            self.reports_escalated += bool(reasons)
+            self.sentences += sentences
+            self.escalated += len(reasons)
+            self.reasons.update(reasons)
+
+    # Function to summarise the escalations and the cost against running the ensemble for every sentence
+    def stats(self):
+        stage_stats = call_metrics.summary()['stage']
+        single_pass = stage_stats.get('extract', {})
+        ensemble = [stage_stats[stage] for stage in current_results.ENSEMBLE_STAGES if stage in stage_stats]
+        ensemble_calls = sum(stats['calls'] for stats in ensemble)
+        ensemble_tokens = sum(stats['prompt_tokens'] for stats in ensemble)
+        with self._lock:
+            counters = {
+                'reports': self.reports,
+                'reports_escalated': self.reports_escalated,
+                'sentences': self.sentences,
+                'escalated': self.escalated,
+                'escalation_rate': round(self.escalated / self.sentences, 4) if self.sentences else 0.0,
+                'reasons': dict(self.reasons),
+                'calls': single_pass.get('calls', 0) + ensemble_calls,
+                'prompt_tokens': single_pass.get('prompt_tokens', 0) + ensemble_tokens,
+            }
+        # The full ensemble is estimated from what the escalated sentences cost. With no escalations only the
+        # call count can be estimated, one call per temperature model and one selection per sentence, and
+        # tokens are only known when the responses reported them (streams stopped early do not)
+        if counters['escalated']:
+            counters['full_ensemble_calls'] = round(ensemble_calls / counters['escalated'] * counters['sentences'])
+        else:
+            counters['full_ensemble_calls'] = (len(temp_models) + 1) * counters['sentences']
+        counters['full_ensemble_prompt_tokens'] = (round(ensemble_tokens / counters['escalated'] * counters['sentences'])
+                                                   if counters['escalated'] and ensemble_tokens else None)
+        for cost in ('calls', 'prompt_tokens'):
+            full = counters[f'full_ensemble_{cost}']
+            counters[f'{cost}_saved'] = round(1 - counters[cost] / full, 4) if full else None
+        return counters
+
+    # Function to print the escalation rate and the cost saved at the end of a run
+    def print_summary(self):
+        counters = self.stats()
+        reasons = ', '.join(f"{reason} {count}" for reason, count in counters['reasons'].items())
+        print(f"Escalated {counters['escalated']} of {counters['sentences']} sentences ({counters['escalation_rate']:.1%}) "
+              f"in {counters['reports_escalated']} of {counters['reports']} reports" + (f" ({reasons})" if reasons else ""))
+        print(f"Cost: {counters['calls']} calls against about {counters['full_ensemble_calls']} for the full ensemble"
+              + (f" ({counters['calls_saved']:.1%} saved)" if counters['calls_saved'] is not None else ""))
+        if counters['prompt_tokens_saved'] is not None:
+            print(f"Prompt tokens: {counters['prompt_tokens']} against about {counters['full_ensemble_prompt_tokens']} "
+                  f"for the full ensemble ({counters['prompt_tokens_saved']:.1%} saved)")
+
+# Escalation counters of the current run
+escalation = EscalationStats()
+
+# Function to list the format rules a statement breaks ('format', 'speculative', 'conjunction')
+def statement_problems(statement):
+    problems = []
+    if not statement.strip().lower().startswith('there is'):
+        problems.append('format')
+    if speculative_pattern.search(statement):
+        problems.append('speculative')
+    if joined_pattern.search(statement):
+        problems.append('conjunction')
+    return problems
+
+# Function to attribute every statement to the sentence it shares the most content words with, returning
+# the statements of each sentence and those that match no sentence
+def attribute_statements(statements, sentences):
+    sentence_tokens = [content_tokens(sentence) - IGNORED_WORDS for sentence in sentences]
+    attributed = [[] for _ in sentences]
+    unattributed = []
+    for statement in statements:
+        tokens = content_tokens(statement)
+        overlaps = [len(tokens & other) for other in sentence_tokens]
+        best = max(range(len(sentences)), key=lambda index: overlaps[index], default=None)
+        if best is None or not overlaps[best]:
+            unattributed.append(statement)
+        else:
+            attributed[best].append(statement)
+    return attributed, unattributed
+
+# Function to check a sentence's single-pass statements, returning why it has to be escalated or None
+def escalation_reason(sentence, statements):
+    for statement in statements:
+        problems = statement_problems(statement)
+        if problems:
+            return problems[0]
+    sentence_tokens = content_tokens(sentence) - IGNORED_WORDS
+    if not sentence_tokens:
+        return None
+    covered = sentence_tokens & content_tokens(' '.join(statements))
+    if len(covered) / len(sentence_tokens) < coverage_threshold:
+        return 'missing' if not statements else 'coverage'
+    return None
+
+# Function to run the ensemble and selection for the escalated sentences of a report
+def escalate(report_content, sentences):
+    if current_results.batch_sentences:
+        return current_results.process_sentences_batched(report_content, sentences)
+    with ThreadPoolExecutor(max_workers=current_results.max_concurrent_sentences) as executor:
+        return list(executor.map(partial(current_results.process_sentence, report_content), sentences))
+
+# Main function to extract findings for an entire report
+def extract_findings(report_content, file_name='Unknown'):
+    sentences = current_results.split_sentences(report_content)
+    single_pass = final_results.extract_findings(report_content, file_name)
+
+    if "Error" in single_pass:
+        # Without a single-pass answer every sentence goes to the ensemble
+        attributed, unattributed = [[] for _ in sentences], []
+        reasons = ['extraction_failed'] * len(sentences)
+    else:
+        statements = split_statements(final_results.clean_findings(single_pass.get("Findings", "")))
+        attributed, unattributed = attribute_statements(statements, sentences)
+        reasons = [escalation_reason(sentence, sentence_statements)
+                   for sentence, sentence_statements in zip(sentences, attributed)]
+        # Statements matching no sentence are only kept when they follow the format rules
+        unattributed = [statement for statement in unattributed if not statement_problems(statement)]
+
+    escalated = [index for index, reason in enumerate(reasons) if reason is not None]
+    escalation.record(len(sentences), [reasons[index] for index in escalated])
+    if escalated:
+        print(f"Escalating {len(escalated)} of {len(sentences)} sentences of {file_name} to the ensemble")
+        for index, finding in zip(escalated, escalate(report_content, [sentences[index] for index in escalated])):
+            attributed[index] = [finding] if finding else []
+
+    all_findings = [statement for sentence_statements in attributed for statement in sentence_statements] + unattributed
+    if "Error" in single_pass and not all_findings:
+        # Neither the single pass nor the ensemble produced anything, so the row goes to the error file
+        print(f"\nNo findings for {file_name} after the single pass failed.")
+        return {"Error": single_pass["Error"]}
+    consolidated_findings = current_results.clean_findings(all_findings) if all_findings else ""
+    print(f"\nConsolidated Findings: {consolidated_findings}")
+    return {"Findings": consolidated_findings}
+
+# Function to extract the findings for a single CSV row, run on the worker pool
+def process_row(row):
+    file_name = row.get('body_part_file_name', 'Unknown')
+    report_content = row.get('report_content', '')
+
+    if not report_content:
+        print(f"No report content for file {file_name}. Skipping.")
+        return row, None
+
+    # Extract findings from the entire report content
+    return row, extract_findings(report_content, file_name)
+
+# Function to process the CSV file
+def process_csv_file(input_csv_path, output_csv_path, workers=1, resume=False, output_mode='full'):
+    # The journal records every finished row so an interrupted run can be resumed; resuming truncates
+    # the outputs back to journaled byte offsets, so it is only available for CSV outputs
+    if table_io.supports_resume(output_csv_path, error_csv_path):
+        journal = CheckpointJournal(output_csv_path + '.journal', resume=resume)
+    elif resume:
+        raise ValueError("Resuming a run needs CSV output and error files")
+    else:
+        journal = NullJournal()
+    resuming = journal.restore_outputs(output_csv_path, error_csv_path)
+
+    # Open the input CSV file
+    with table_io.open_reader(input_csv_path) as reader:
+        # Open the output and error CSV files for writing (appending when resuming)
+        file_mode = 'a' if resuming else 'w'
+        with table_io.FindingsWriter(output_csv_path, reader.fieldnames, 'Findings', output_mode, file_mode) as writer, \
+             table_io.open_writer(error_csv_path, reader.fieldnames, file_mode) as error_writer:
+            if not resuming:
+                journal.record(None, 'start', writer, error_writer)
+
+            # Skip the rows finished by a previous run
+            pending_rows = (row for row in reader if row_key(row) not in journal.completed)
+
+            # Rows are processed by the workers and written here in input order
+            for row, findings_output in imap_ordered(process_row, pending_rows, workers):
+                if findings_output is None:
+                    continue
+
+                if "Error" in findings_output:
+                    print(f"Writing file {row.get('body_part_file_name', 'Unknown')} to error.csv due to error in extraction.")
+                    error_writer.writerow(row)
+                    journal.record(row_key(row), 'error', writer, error_writer)
+                    continue
+
+                row['Findings'] = findings_output.get("Findings", "")
+                writer.writerow(row)
+                journal.record(row_key(row), 'done', writer, error_writer)
+
+            journal.close()
+
+    print(f"\nAll findings saved to {output_csv_path}")
+    print(f"Errors saved to {error_csv_path}")
+    cache_counters = ollama_client.cache_stats()
+    if cache_counters:
+        print(f"Response cache: {cache_counters['hits']} hits, {cache_counters['misses']} misses, {cache_counters['evictions']} evictions")
+    if final_results.fast_path is not None:
+        final_results.fast_path.print_summary()
+    escalation.print_summary()
+    ollama_client.print_endpoint_stats()
+    ollama_client.print_concurrency_stats()
+    call_metrics.print_summary()
+
+# Function to apply a dict of overrides to the module-level settings
+def apply_config(config):
+    unknown = set(config) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    globals().update(config)
+
+# Function to run the pipeline over an input CSV; config overrides the settings above, e.g. {'num_workers': 4}
+def run(input_path=None, output_path=None, config=None):
+    global escalation
+    apply_config(config or {})
+
+    # Point the Ollama client at the configured endpoints and response cache
+    ollama_client.configure(hosts=ollama_hosts, cache_path=cache_path, cache_mode=cache_mode, cache_max_mb=cache_max_mb,
+                            model_keep_alive=ollama_keep_alive, num_ctx=ollama_num_ctx, metrics_path=metrics_path,
+                            adaptive_limits=adaptive_concurrency)
+    # The single pass and the ensemble run with the models and options configured here
+    final_results.apply_config({'desiredModel': extraction_model, 'error_csv_path': error_csv_path})
+    current_results.apply_config({'temp_models': temp_models, 'selection_model': selection_model,
+                                  'selection_engine': selection_engine, 'batch_sentences': batch_sentences,
+                                  'adaptive_concurrency': adaptive_concurrency, 'error_csv_path': error_csv_path})
+    final_results.fast_path = RuleEngine() if rule_fast_path else None
+    escalation = EscalationStats()
+
+    # Call the function to process the CSV file
+    process_csv_file(input_path or input_csv_path, output_path or output_csv_path, workers=num_workers, resume=resume_run,
+                     output_mode=output_mode)
+
+# Function to run the pipeline from the command line
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract key findings with a single model call per report, escalating "
+                                                 "the sentences that fail the format rules to the temperature ensemble")
+    parser.add_argument('--input', default=input_csv_path, help="input CSV, Parquet or Arrow file with a report_content column")
+    parser.add_argument('--output', default=output_csv_path, help="output CSV, Parquet or Arrow file with the Findings column")
+    parser.add_argument('--output-mode', default=output_mode, choices=table_io.OUTPUT_MODES,
+                        help="all input columns, key columns only, or one row per finding")
+    parser.add_argument('--errors', default=error_csv_path, help="CSV for the rows that failed")
+    parser.add_argument('--model', default=extraction_model, help="model of the single-pass extraction")
+    parser.add_argument('--temp-models', nargs='+', default=temp_models, help="temperature models of the ensemble")
+    parser.add_argument('--selection-model', default=selection_model)
+    parser.add_argument('--selection-engine', default=selection_engine, choices=('llm', 'rules', 'hybrid'))
+    parser.add_argument('--batch-sentences', action='store_true', default=batch_sentences,
+                        help="ask each temperature model about all escalated sentences of a report in one call")
+    parser.add_argument('--coverage', type=float, default=coverage_threshold,
+                        help="fraction of a sentence's content words its single-pass findings must cover")
+    parser.add_argument('--workers', type=int, default=num_workers, help="reports processed in parallel")
+    parser.add_argument('--hosts', nargs='+', default=ollama_hosts, help="Ollama endpoints to spread requests across")
+    parser.add_argument('--cache', default=cache_path, help="response cache file (off unless given)")
+    parser.add_argument('--adaptive-concurrency', action='store_true', default=adaptive_concurrency,
+                        help="adjust the calls in flight per endpoint and stage to the observed latency")
+    parser.add_argument('--cache-mode', default=cache_mode, choices=('use', 'refresh', 'bypass'))
+    parser.add_argument('--metrics', default=metrics_path, help="JSON lines file for per-call metrics (off unless given)")
+    parser.add_argument('--rule-fast-path', action='store_true', default=rule_fast_path,
+                        help="answer formulaic sentences by rule before the single pass")
+    parser.add_argument('--resume', action='store_true', default=resume_run, help="resume from the checkpoint journal")
+    args = parser.parse_args(argv)
+
+    print("Script started...")
+    run(args.input, args.output, {
+        'error_csv_path': args.errors,
+        'extraction_model': args.model,
+        'temp_models': args.temp_models,
+        'selection_model': args.selection_model,
+        'selection_engine': args.selection_engine,
+        'batch_sentences': args.batch_sentences,
+        'coverage_threshold': args.coverage,
+        'num_workers': args.workers,
+        'ollama_hosts': args.hosts,
+        'cache_path': args.cache or None,
+        'cache_mode': args.cache_mode,
+        'adaptive_concurrency': args.adaptive_concurrency,
+        'metrics_path': args.metrics or None,
+        'resume_run': args.resume,
+        'output_mode': args.output_mode,
+        'rule_fast_path': args.rule_fast_path,
+    })
+
+if __name__ == '__main__':
+    main()
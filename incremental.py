@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from checkpoint import row_key
+
+# Incremental runs, which only send new or changed reports to the model.
+#
+# An incremental run writes a manifest next to its output (<output>.manifest.json). For every row written
+# it records a fingerprint and the findings written for it. The fingerprint covers the row's full_path,
+# its report content and the pipeline configuration (prompts, models and the settings that change the
+# findings). The next run reads the previous output's manifest. Every row whose fingerprint is unchanged
+# gets its findings carried forward, and only new or changed rows are processed. Error rows are not
+# recorded, so they are retried. Every recorded entry is also kept in the checkpoint journal, so a resumed
+# run restores the entries of the rows written before it was interrupted.
+
+MANIFEST_SUFFIX = '.manifest.json'
+# Bump when a code change alters the findings without changing any prompt or setting that is hashed
+PIPELINE_VERSION = 1
+
+# Function to return the manifest path of an output file
+def manifest_path(output_path):
+    return output_path + MANIFEST_SUFFIX
+
+# Function to hash the configuration of a pipeline run, so a change to it invalidates every row
+def config_hash(config):
+    payload = json.dumps({'pipeline_version': PIPELINE_VERSION, **config}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Function to fingerprint a row by its key, its report content and the configuration hash
+def row_fingerprint(row, config_digest):
+    content_digest = hashlib.sha256((row.get('report_content') or '').encode('utf-8')).hexdigest()
+    return hashlib.sha256(f"{row_key(row)}\0{content_digest}\0{config_digest}".encode('utf-8')).hexdigest()
+
+# The findings of the previous run and the rows written by this one
+class Manifest:
+    def __init__(self, config, previous_path=None):
+        self.config_digest = config_hash(config)
+        self.previous = {}
+        self.rows = {}
+        self.carried = 0
+        self.processed = 0
+        self._lock = threading.Lock()
+        if previous_path and os.path.exists(previous_path):
+            with open(previous_path, 'r', encoding='utf-8') as infile:
+                previous = json.load(infile)
+            if previous.get('config_hash') != self.config_digest:
+                print(f"The pipeline configuration changed since {previous_path}, so every row is processed again")
+            else:
+                self.previous = previous.get('rows', {})
+                print(f"Loaded {len(self.previous)} rows from {previous_path}")
+
+    # Function to return the findings of an unchanged row from the previous run, or None
+    def previous_findings(self, row):
+        return self.previous.get(row_fingerprint(row, self.config_digest))
+
+    # Function to record the findings written for a row; carried marks findings taken from the previous run.
+    # Returns the entry, for the checkpoint journal to keep.
+    def record(self, row, findings, carried=False):
+        entry = {'fingerprint': row_fingerprint(row, self.config_digest), 'findings': findings, 'carried': carried}
+        self.restore([entry])
+        return entry
+
+    # Function to restore the entries journaled by an interrupted run that is being resumed
+    def restore(self, entries):
+        with self._lock:
+            for entry in entries:
+                self.rows[entry['fingerprint']] = entry['findings']
+                if entry['carried']:
+                    self.carried += 1
+                else:
+                    self.processed += 1
+
+    # Function to write the manifest, replacing any previous one only once it is complete
+    def write(self, path):
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as outfile:
+            json.dump({'created': time.time(), 'config_hash': self.config_digest, 'rows': self.rows}, outfile)
+        os.replace(temporary_path, path)
+
+    # Function to print how many rows were carried forward
+    def print_summary(self):
+        print(f"Incremental run: {self.carried} rows carried forward unchanged, {self.processed} rows processed")
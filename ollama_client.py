@@ -0,0 +1,217 @@
+import random
+import sys
+import threading
+import time
+
+import call_metrics
+from adaptive_concurrency import AdaptiveConcurrency, is_overload
+from endpoint_pool import Endpoint, EndpointPool
+from response_cache import ResponseCache
+
+# Pool of the configured Ollama endpoints, or of stand-in backends with a chat() method such as
+# benchmark.FakeOllama; None until first use when nothing is configured (the default ollama host)
+_pool = None
+_pool_lock = threading.Lock()
+
+# Optional on-disk response cache shared by every chat() call
+_cache = None
+
+# Optional AIMD limits on the calls in flight per endpoint and stage
+_limits = None
+
+# Keep models loaded between calls and pin the context size, so Ollama neither reloads a model nor
+# re-evaluates the constant system prompt prefix that it already holds in its KV cache
+keep_alive = '30m'
+default_options = {'num_ctx': 8192}
+
+# Stream responses and stop generation as soon as the caller's stop_when(text) is satisfied, e.g. once
+# the JSON object has closed; closing the stream makes Ollama cancel the rest of the generation
+stream_early_stop = True
+# Output token caps per stage, so a model that keeps talking cannot run on indefinitely
+stage_num_predict = {'extract': 512, 'temperature': 256, 'select': 16}
+
+# Transport errors are retried with exponential backoff; invalid model output is never retried here
+max_retries = 4
+retry_base_delay = 1.0
+retry_max_delay = 30.0
+
+# Function to point chat() at one or more Ollama endpoints and optionally enable the response cache.
+# backend replaces Ollama with a stand-in object, or a list of them to act as several endpoints.
+# adaptive_limits adjusts the calls in flight to every endpoint and stage to the latency it observes.
+def configure(hosts=None, cache_path=None, cache_mode='use', cache_max_mb=1024, model_keep_alive=None, num_ctx=None,
+              backend=None, metrics_path=None, adaptive_limits=False):
+    global _pool, _cache, _limits, keep_alive
+    call_metrics.configure(metrics_path)
+    if model_keep_alive is not None:
+        keep_alive = model_keep_alive
+    if num_ctx is not None:
+        default_options['num_ctx'] = num_ctx
+    if backend is not None:
+        backends = backend if isinstance(backend, (list, tuple)) else [backend]
+        endpoints = [Endpoint(getattr(stand_in, 'host', f"backend-{index}"), stand_in)
+                     for index, stand_in in enumerate(backends)]
+    elif hosts:
+        endpoints = [Endpoint(host, ollama_module().Client(host=host)) for host in hosts]
+    else:
+        endpoints = None
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = EndpointPool(endpoints) if endpoints else None
+    if _cache is not None:
+        _cache.close()
+    _cache = ResponseCache(cache_path, max_bytes=cache_max_mb * 1024 * 1024, mode=cache_mode) if cache_path else None
+    _limits = AdaptiveConcurrency() if adaptive_limits else None
+
+# Function to import ollama on first use, so the pipelines can run offline against a stand-in backend
+def ollama_module():
+    import ollama
+    return ollama
+
+# Function to return the endpoint pool, falling back to the default ollama host when none is configured
+def endpoint_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EndpointPool([Endpoint(None, ollama_module())])
+        return _pool
+
+# Function to report the routing state of every endpoint (None before the first request)
+def endpoint_stats():
+    return _pool.stats() if _pool is not None else None
+
+# Function to print how the requests were spread over the endpoints, when there is more than one
+def print_endpoint_stats():
+    stats = endpoint_stats()
+    if not stats or len(stats) < 2:
+        return
+    for endpoint in stats:
+        print(f"Endpoint {endpoint['host']}: {endpoint['requests']} requests, {endpoint['failures']} failures, "
+              f"{'healthy' if endpoint['healthy'] else 'unhealthy'}, models loaded: {', '.join(endpoint['loaded_models']) or 'none'}")
+
+# Function to report the adaptive concurrency limits (None when they are disabled)
+def concurrency_stats():
+    return _limits.stats() if _limits is not None else None
+
+# Function to print the adaptive concurrency limits reached by every endpoint and stage
+def print_concurrency_stats():
+    for limiter in concurrency_stats() or []:
+        print(f"Concurrency {limiter['limiter']}: limit {limiter['limit']} (peak {limiter['peak_in_flight']} in flight), "
+              f"{limiter['increases']} increases, {limiter['decreases']} decreases over {limiter['calls']} calls, "
+              f"baseline latency {limiter['baseline_latency']}s")
+
+# Function to convert an ollama response (dict or response object) into a plain dict for caching
+def response_to_dict(response):
+    if hasattr(response, 'model_dump'):
+        return response.model_dump(exclude_none=True)
+    return dict(response)
+
+# Function to decide whether an error came from the connection or server rather than the request itself
+def is_transport_error(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # ollama.ResponseError carries the HTTP status of the failed request
+    status_code = getattr(error, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    httpx = sys.modules.get('httpx')
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+# Function to read a streamed response until it is done or stop_when(text) is satisfied
+def consume_stream(model, chunks, stop_when):
+    content = ''
+    chunk_count = 0
+    final_chunk = None
+    try:
+        for chunk in chunks:
+            chunk_count += 1
+            content += chunk['message']['content'] or ''
+            if chunk['done']:
+                final_chunk = chunk
+                break
+            if stop_when(content):
+                break
+    finally:
+        # Closing the stream drops the connection, which cancels the generation on the server
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+    response = {'model': model, 'message': {'role': 'assistant', 'content': content}, 'done': True}
+    if final_chunk is not None:
+        for name in call_metrics.RESPONSE_FIELDS + ('done_reason',):
+            value = call_metrics.response_field(final_chunk, name)
+            if value is not None:
+                response[name] = value
+    else:
+        # Ollama streams one token per chunk
+        response['eval_count'] = chunk_count
+        response['done_reason'] = 'stopped_early'
+    return response
+
+# Function to send a chat request, failing over to another endpoint on transport errors and retrying
+# with exponential backoff and jitter once every healthy endpoint has failed
+def chat_with_retries(model, messages, stage='chat', stop_when=None, **kwargs):
+    pool = endpoint_pool()
+    tried = []
+    for attempt in range(max_retries + 1):
+        endpoint = pool.acquire(model, exclude=tried)
+        client = endpoint.client
+        limiter = _limits.limiter(endpoint.host, stage) if _limits is not None else None
+        if limiter is not None:
+            at_limit = limiter.acquire(while_waiting=pool.waiting(endpoint))
+        started = time.perf_counter()
+        try:
+            if stop_when is not None and stream_early_stop:
+                response = consume_stream(model, client.chat(model=model, messages=messages, stream=True, **kwargs), stop_when)
+            else:
+                response = client.chat(model=model, messages=messages, **kwargs)
+        except Exception as e:
+            if limiter is not None:
+                limiter.release(time.perf_counter() - started, overloaded=is_overload(e), at_limit=at_limit)
+            transport_error = is_transport_error(e)
+            pool.release(endpoint, failed=transport_error)
+            call_metrics.record(model, stage, time.perf_counter() - started, error=e, attempt=attempt + 1,
+                                host=endpoint.host)
+            if attempt == max_retries or not transport_error:
+                raise
+            tried.append(endpoint)
+            if pool.has_untried(tried):
+                print(f"Transport error from Ollama at {endpoint.host} ({e}), failing over")
+                continue
+            tried = []
+            delay = min(retry_max_delay, retry_base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"Transport error from Ollama ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+        else:
+            if limiter is not None:
+                limiter.release(time.perf_counter() - started, at_limit=at_limit)
+            pool.release(endpoint)
+            call_metrics.record(model, stage, time.perf_counter() - started, response=response, attempt=attempt + 1,
+                                host=endpoint.host)
+            return response
+
+# Function to send a chat request, answering from the response cache when the same request was seen before.
+# stage ('extract', 'temperature', 'select', ...) labels the call in the metrics and picks its output cap;
+# stop_when(text), when given, ends a streamed generation as soon as the text seen so far is enough.
+def chat(model, messages, stage='chat', stop_when=None, **kwargs):
+    stage_options = {'num_predict': stage_num_predict[stage]} if stage in stage_num_predict else {}
+    kwargs['options'] = {**default_options, **stage_options, **(kwargs.get('options') or {})}
+    kwargs.setdefault('keep_alive', keep_alive)
+    if _cache is None:
+        return chat_with_retries(model, messages, stage, stop_when, **kwargs)
+
+    # keep_alive does not change the response, so it is left out of the cache key
+    key = ResponseCache.make_key(model, messages, {name: value for name, value in kwargs.items() if name != 'keep_alive'})
+    started = time.perf_counter()
+    cached = _cache.get(key)
+    if cached is not None:
+        call_metrics.record(model, stage, time.perf_counter() - started, response=cached, cached=True)
+        return cached
+    response = response_to_dict(chat_with_retries(model, messages, stage, stop_when, **kwargs))
+    _cache.put(key, model, response)
+    return response
+
+# Function to return the response cache hit/miss counters (None when the cache is disabled)
+def cache_stats():
+    return _cache.stats() if _cache is not None else None
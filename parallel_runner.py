@@ -0,0 +1,20 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Function to apply func to every item on a pool of workers, yielding the results in input order
+def imap_ordered(func, items, workers=1, max_pending=None):
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    # Keep a bounded window of submitted items so large inputs are not read into memory at once
+    max_pending = max_pending or workers * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
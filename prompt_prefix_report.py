@@ -0,0 +1,91 @@
+import csv
+import json
+import statistics
+import sys
+import time
+import uuid
+
+import ollama_client
+from prompts import extraction_messages, selection_messages, temperature_messages
+
+# Before/after report of the prompt prefix reuse, run against a live Ollama server.
+#
+# Each sample is sent twice: once with a unique line at the start of the system message, which
+# stops Ollama from reusing any evaluated prefix (the situation before the prompts were split),
+# and once as the pipelines send it now, with the constant system prefix.
+#
+# Usage: python prompt_prefix_report.py <input_csv> [samples] [host]
+
+extraction_model = 'llama3.1:latest'
+temperature_model = 'temp_0.0:latest'
+selection_model = 'llama3.1:latest'
+
+# Function to prepend a unique line to the system message so no prefix can be reused
+def without_prefix_reuse(messages):
+    system_message = dict(messages[0], content=f"Request {uuid.uuid4()}\n\n{messages[0]['content']}")
+    return [system_message] + messages[1:]
+
+# Function to time a single chat call and collect Ollama's prompt evaluation counters
+def measure(model, messages):
+    started = time.perf_counter()
+    response = ollama_client.chat(model=model, messages=messages, options={'num_predict': 32})
+    return {
+        'wall_time': time.perf_counter() - started,
+        'prompt_eval_count': response.get('prompt_eval_count') or 0,
+        'prompt_eval_duration': (response.get('prompt_eval_duration') or 0) / 1e9,
+    }
+
+# Function to build (stage, model, messages) samples from the rows of a results or input CSV
+def build_samples(csv_path, sample_count):
+    samples = []
+    with open(csv_path, 'r', encoding='utf-8') as infile:
+        for row in csv.DictReader(infile):
+            report_content = row.get('report_content', '')
+            sentences = [s.strip() for s in report_content.split('.') if s.strip()]
+            if not sentences:
+                continue
+            sentence = sentences[0]
+            findings = row.get('Findings') or row.get('Key Findings') or f"There is {sentence}"
+            options = "\n".join(f"Option {idx}: {json.dumps({'Findings': statement.strip()})}"
+                                for idx, statement in enumerate(findings.split(';')[:3], start=1))
+            samples.append(('extract', extraction_model, extraction_messages(report_content)))
+            samples.append(('temperature', temperature_model, temperature_messages(report_content, sentence)))
+            samples.append(('select', selection_model, selection_messages(sentence, options)))
+            if len(samples) >= sample_count * 3:
+                break
+    return samples
+
+# Function to run every sample with and without prefix reuse and summarise the difference per stage
+def prefix_report(csv_path, sample_count=10):
+    samples = build_samples(csv_path, sample_count)
+    results = {}
+    # Stages run one after another, and all "before" calls run before the "after" calls, because
+    # any other prompt evaluated in between would evict the cached prefix
+    for stage in ('extract', 'temperature', 'select'):
+        stage_samples = [(model, messages) for sample_stage, model, messages in samples if sample_stage == stage]
+        results[stage] = {
+            'before': [measure(model, without_prefix_reuse(messages)) for model, messages in stage_samples],
+            'after': [measure(model, messages) for model, messages in stage_samples],
+        }
+
+    report = {}
+    for stage, stage_results in results.items():
+        if not stage_results['before']:
+            continue
+        report[stage] = {}
+        for field in ('prompt_eval_count', 'prompt_eval_duration', 'wall_time'):
+            before = statistics.mean(sample[field] for sample in stage_results['before'])
+            after = statistics.mean(sample[field] for sample in stage_results['after'])
+            report[stage][field] = {
+                'before': round(before, 4),
+                'after': round(after, 4),
+                'saving': round(1 - after / before, 4) if before else None,
+            }
+    return report
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python prompt_prefix_report.py <input_csv> [samples] [host]")
+        sys.exit(1)
+    ollama_client.configure(hosts=[sys.argv[3]] if len(sys.argv) > 3 else None)
+    print(json.dumps(prefix_report(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10), indent=2))
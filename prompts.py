@@ -0,0 +1,412 @@
+# Prompts for the extraction, temperature and selection stages.
+#
+# Each prompt is split into a constant system message (instructions and few-shot examples) and a
+# short user message holding the per-report or per-sentence text. Keeping the long prefix
+# byte-identical between calls lets Ollama reuse the already evaluated prefix from its KV cache.
+
+# Single-pass extraction of a whole report (final_results.py)
+EXTRACTION_SYSTEM_PROMPT = """You are a helpful assistant trained to extract key medical findings from radiology reports.
+
+**Instructions**:
+
+- **Output Format**: Provide findings in JSON format with the key "Findings". The value should be a string containing one or more statements.
+- **Statement Format**:
+- For **positive findings**:
+    - If the location is mentioned: "There is <diagnosis> located at <location>."
+    - If the location is not mentioned: "There is <diagnosis>."
+- For **negative findings** (only if explicitly mentioned in the report):
+    - "There is no <diagnosis>."
+- For **normal findings**:
+    - If explicitly mentioned in the report, include them as: "There is normal <structure>."
+- **General Rules**:
+- **Include** all findings mentioned in the report, both abnormal and normal.
+- **Do not** include speculative or uncertain findings. Exclude any statements containing words like "possible", "suggests", "may indicate", "could", "probably", etc.
+- **Do not** include redundant or repetitive statements.
+- **Ensure** that each statement starts with "There is", "There is no", or "There is normal" as per the format.
+- **Only include** findings that strictly adhere to the required format.
+
+**Examples**:
+
+**Example 1**:
+
+Report Content:
+"there is a fracture involving the proximal shaft of the right humerus. there is minimal displacement. the humeral head is enlocated. alignment at the elbow joint is anatomical."
+
+Findings:
+{
+"Findings": "There is a fracture located at the proximal shaft of the right humerus; There is minimal displacement; There is normal humeral head; There is normal alignment at the elbow joint."
+}
+
+**Example 1 note**: This output effectively captures all key findings about the fracture, displacement, and normal alignment. It follows the "There is" format for each positive finding and maintains conciseness while including the most relevant diagnostic information.
+
+**Example 2**:
+
+Report Content:
+"the cardiomediastinal contour appears normal. the lungs and pleural spaces are clear."
+
+Findings:
+{
+"Findings": "There is normal cardiomediastinal contour; There is clear lungs; There is clear pleural spaces."
+}
+
+**Example 2 note**: This output is short and precise, capturing the normal findings of the cardiomediastinal contour, lungs, and pleural spaces. The "There is" format is used effectively to ensure clarity and consistency.
+
+**Example 3**:
+
+Report Content:
+"no orbital floor fracture. no maxillary sinus fluid level. no nasal bone fracture. no evidence of zygomatic arch fracture."
+
+Findings:
+{
+"Findings": "There is no orbital floor fracture; There is no maxillary sinus fluid level; There is no nasal bone fracture; There is no zygomatic arch fracture."
+}
+
+**Example 3 note**: This output concisely captures multiple negative findings. The use of "There is no" clearly communicates the absence of fractures and fluid levels, maintaining adherence to the required format without unnecessary details.
+
+**Example 4**:
+
+Report Content:
+"the lungs are clear. heart size is normal. no pleural effusion."
+
+Findings:
+{
+"Findings": "There is clear lungs; There is normal heart size; There is no pleural effusion."
+}
+
+**Example 4 note**: This output succinctly identifies key positive and negative findings about the lungs, heart size, and pleural effusion. The response follows the required format and avoids unnecessary elaboration, keeping the information relevant and concise.
+
+**Example 5**:
+
+Report Content:
+"there is a possible fracture of the distal radius. appearances suggest a mild sprain. no definite fracture is seen."
+
+Findings:
+{
+"Findings": "" 
+}
+
+**Example 5 note**: Speculative language such as "possible" and "suggest" is excluded, as it does not meet the requirement for definitive diagnostic statements. This response correctly omits findings that are uncertain or speculative.
+
+**Explanation**: Speculative findings containing words like "possible" and "suggest" are omitted, and relevant medical information is included."""
+
+EXTRACTION_USER_TEMPLATE = """**Report Content**:
+"{report_content}"
+"""
+
+# Per-sentence extraction by the temperature models (current_results.py)
+TEMPERATURE_SYSTEM_PROMPT = """You are a helpful assistant trained to extract key medical findings from radiology reports.
+
+**Instructions**:
+
+- **Output Format**: Provide findings in JSON format with the key "Findings". The value should be a string containing one or more statements.
+        - **Statement Format**:
+        - For **positive findings**:
+            - If the location is mentioned: "There is <diagnosis> located at <location>."
+            - If the location is not mentioned: "There is <diagnosis>."
+        - For **negative findings** (only if explicitly mentioned in the report):
+            - If the location is mentioned: "There is no <diagnosis> located at <location>."
+            - If the location is not mentioned: "There is <diagnosis>."
+            - For **normal findings**:
+            - If explicitly mentioned in the report, include them as: "There is normal <structure>."
+            - If the term "unremarkable" is used to describe a body part, interpret this as "There is no abnormality at <body part>."
+        - **General Rules**:
+        - **Do not hallucinate**: Only include information explicitly mentioned in the report. Do not make any assumptions or create findings that are not directly stated.
+        - **One finding per sentence**: Do not combine findings into a single sentence using conjunctions like "and" or "with". Each statement should describe one finding at one location.
+        - **If a sentence in the report says "There is <condition-1> and <condition-2> at <location>", split it into two separate findings like: "There is <condition-1> at <location>; There is <condition-2> at <location>".**
+        - **Do not use conjunctions like "and" or "with" to connect multiple findings**. Instead, separate each finding into its own sentence.
+        - **Use nouns instead of adverbs** to describe locations. For example, replace "subdiaphragmatically" with "at sub-diaphragm".
+        - **Remove adjectives describing severity or visibility** unless they are clinically significant. For example, remove words like "mild" or "conspicuous" unless explicitly required for diagnosis.
+        - **Include** all findings mentioned in the report, both abnormal and normal.
+        - **Do not** include speculative or uncertain findings. Exclude any statements containing words like "possible", "suggests", "may indicate", "could", "probably", etc.
+        - **Do not** include redundant or repetitive statements.
+        - **Do not** include any references to previous X-rays or imaging results. Focus solely on the current medical findings and diagnosis in the report.
+        - **Ensure** that each statement starts with "There is", "There is no", or "There is normal" as per the format.
+        - **Only include** findings that strictly adhere to the required format and information given in the report.
+        - **Use exact medical terminology from the report without substitutions or synonyms**
+        - **Do not include possible findings, and do not include severity of the degree of findings. Remove words such as "mild", "acute", "minimal", and other descriptors that indicate the extent of the condition.
+
+
+**Examples**:
+
+**Example 1**:
+
+Sentence:
+"There is a greenstick fracture of the distal radius."
+
+Findings:
+{
+"Findings": "There is a greenstick fracture located at distal radius;"
+}
+
+**Example 1 note**: The finding is expressed concisely, beginning with “There is” to follow the standard format. The phrase “located at distal radius” clarifies the specific location of the fracture, providing a clear and structured description.
+
+**Example 2**:
+
+Sentence:
+"there is a conspicuous gas-filled and dilated bowel loop located at the left mid-abdomen."
+
+Findings:
+{
+    "Findings": "There is a gas-filled bowel loop located at the left mid-abdomen; There is a dilated bowel loop located at the left mid-abdomen."
+}
+
+**Example 2 note**: The adjective "conspicuous" is removed as it is unnecessary. The phrase "gas-filled and dilated bowel loop" is split into two sentences to ensure only one finding per sentence. The word "and" is avoided, and the sentence structure is simplified. The word "mildly" is removed as we are not concerned with the degree of the diagnosis.
+
+**Example 3**:
+
+Sentence:
+"the lungs are clear, heart size is normal and no pleural effusion."
+
+Findings:
+{
+"Findings": "There is clear lungs; There is normal heart size; There is no pleural effusion;"
+}
+
+**Example 3 note**: The sentence is split into three distinct findings, each starting with “There is” or “There is no,” ensuring clarity and adherence to the preferred format. This avoids using “and” and provides a clear, standardized description of each observation.
+
+**Example 4**:
+
+Sentence:
+"There is minimal displacement of the fracture at the right humerus."
+
+Findings:
+{
+"Findings": "There is displacement of fracture located at right humerus;"
+}
+
+**Example 4 note**: The descriptor “minimal” is removed as we are not concerned with the degree of the diagnosis, only its presence. The finding is expressed as “There is displacement of fracture,” and the location “right humerus” is included to provide clarity.
+
+**Example 5**:
+
+Sentence:
+"The humeral head is enlocated."
+
+Findings:
+{
+"Findings": "There is an enlocated humeral head;"
+}
+
+**Example 5 note**: The term “enlocated” indicates normal positioning and should be expressed as “There is an enlocated humeral head.."
+
+**Example 6**:
+
+Report Content:
+"there is central bronchial wall thickening and a mild peribronchial interstitial opacity located at upper lower zones."
+
+Findings:
+{
+"Findings": "There is central bronchial wall thickening located at upper lower zones; There is a peribronchial interstitial opacity located at upper lower zones."
+}
+
+**Example 3 note**: The adjective "mild" is removed as it does not contribute to the essential finding. The findings are separated into two sentences, with each describing one distinct condition. The conjunction "and" is removed to prevent the combination of findings into one sentence.
+
+**Example 7**:
+
+Sentence:
+"This could reflect localized ileus."
+
+Findings:
+{
+"Findings": ""
+}
+
+**Example 7 note**: This does not include any findings, because the findings are not definite.\""""
+
+TEMPERATURE_USER_TEMPLATE = """**Report Content** (only for context):
+{report_content}
+
+---
+
+Focus solely on summarising this sentence as per the instructions above. Ensure each findings starts with "there is", even if it does not make perfect grammatical sense to do so.
+"{sentence}"
+"""
+
+# Batched extraction of several sentences of a report by each temperature model (current_results.py);
+# the system prompt extends the per-sentence one, so both share its evaluated prefix
+BATCH_TEMPERATURE_SYSTEM_PROMPT = TEMPERATURE_SYSTEM_PROMPT + """
+
+**Several sentences at once**:
+
+When you are given several numbered sentences, summarise each of them separately as per the instructions above, exactly as if it had been given on its own. Respond with a JSON object with the key "Sentences", holding one entry per numbered sentence in the same order: {"Sentence": <number>, "Findings": "<statements>"}. Use "" as the findings of a sentence without definite findings, and never move a finding to another sentence's entry.
+
+**Example**:
+
+Sentences:
+Sentence 1: "the lungs are clear."
+Sentence 2: "This could reflect localized ileus."
+
+Findings:
+{
+"Sentences": [{"Sentence": 1, "Findings": "There is clear lungs;"}, {"Sentence": 2, "Findings": ""}]
+}"""
+
+BATCH_TEMPERATURE_USER_TEMPLATE = """**Report Content** (only for context):
+{report_content}
+
+---
+
+Focus solely on summarising each of these sentences separately as per the instructions above. Ensure each findings starts with "there is", even if it does not make perfect grammatical sense to do so.
+{sentences}
+"""
+
+# Selection of the best temperature model output for a sentence (current_results.py)
+SELECTION_SYSTEM_PROMPT = """You are an expert assistant trained to select the most accurate and properly formatted medical findings from the options provided below.
+
+**Instructions**:
+
+- **Original Sentence**:
+  Given in each task below, together with the options to choose from.
+
+- **Criteria for Selection**:
+  1. **Adherence to Statement Formats**:
+      - **Positive Findings**:
+          - Must start with "There is <diagnosis> located at <location>." if location is mentioned.
+          - Must start with "There is <diagnosis>." if location is not mentioned.
+      - **Negative Findings**:
+          - Must start with "There is no <diagnosis> located at <location>." if location is mentioned.
+          - Must start with "There is no <diagnosis>." if location is not mentioned.
+  2. **Information Completeness and Relevance**:
+      - Select the finding that includes all relevant findings from the original sentence without omissions.
+      - Select the finding such that no additional or irrelevant findings should be added.
+      - The information you select should add some knowledge.
+  3. **Clarity and Precision**:
+      - The selected statement should be clear, precise, and free from ambiguity.
+      - The selected statement should be split up as much as possible, so that each sentence has its own point.
+  4. **No Speculative or Redundant Information**:
+      - Exclude any findings that are speculative or uncertain. Specifically, do not include findings containing words such as ‘probably,’ ‘probable,’ ‘suggests,’ ‘possible,’ ‘may indicate,’ or any similar terms that imply uncertainty.
+      - Avoid redundant or repetitive statements.
+      - If none of the statements align with the criteria, output the number 9
+  5. **Alignment with Original Language**:
+      - Select the statement that best adheres to the original language in the original statement only if it aligns with the above statements.
+      
+
+- **Response Requirement**:
+  Respond with only the number of the selected option (e.g., '1', '2', etc.) and nothing else.
+
+**examples**:
+
+**Example 1**:
+
+**Original Sentence**:
+"There is a greenstick fracture of the distal radius."
+
+**Options**:
+Option 1: {"Findings": "There is a greenstick fracture located at distal radius;"}
+Option 2: {"Findings": "There is a fracture at distal radius."}
+
+**Best Option**:
+1
+
+**Explanation**:
+Option 1 provides a more detailed and precise finding by specifying the type of fracture ("greenstick") and its exact location ("distal radius"). This aligns with the criteria of clarity and completeness.
+
+---
+
+**Example 2**:
+
+**Original Sentence**:
+"there is a conspicuous gas-filled and dilated bowel loop located at the left mid-abdomen."
+
+**Options**:
+Option 1: {"Findings": "There is a gas-filled bowel loop located at the left mid-abdomen; There is a dilated bowel loop located at the left mid-abdomen."}
+Option 2: {"Findings": "There is a conspicuous gas-filled and dilated bowel loop located at the left mid-abdomen."}
+
+**Best Option**:
+1
+
+**Explanation**:
+Option 1 splits the findings into two separate statements, enhancing clarity by addressing each condition individually. It also removes the unnecessary adjective "conspicuous," adhering to the general rules.
+
+---
+
+**Example 3**:
+
+**Original Sentence**:
+"no acute bony or soft tissue anomaly."
+
+**Options**:
+Option 1: {"Findings": "There is no acute bony or soft tissue anomaly."}
+Option 2: {"Findings": "There is no acute bony anomaly; There is no acute soft tissue anomaly;"}
+
+**Best Option**:
+2
+
+**Explanation**:
+Option 2 splits the negative findings into two separate statements, ensuring each finding is clear and follows the one finding per statement rule.
+
+---
+
+**Example 4**:
+
+**Original Sentence**:
+"a small gas locule persists here."
+
+**Options**:
+Option 1: {"Findings": "There is a gas locule located at the right lateral chest wall;"}
+Option 2: {"Findings": "There is a small gas locule located at unspecified location;"}
+
+**Best Option**:
+1
+
+**Explanation**:
+Option 1 provides a specific location for the gas locule, making the finding more informative and actionable compared to the vague "unspecified location."
+
+---
+
+**Example 5**:
+
+**Original Sentence**:
+"there is associated mild right lower lobe collapse."
+
+**Options**:
+Option 1: {"Findings": "There is a collapse located at right lower lobe;"}
+Option 2: {"Findings": "There is right lower lobe collapse; There is mild right lower lobe collapse;"}
+
+**Best Option**:
+1
+
+**Explanation**:
+Option 1 accurately captures the finding without redundancy. Option 2 repeats the same condition by stating both “right lower lobe collapse” and “mild right lower lobe collapse,” which does not add any additional meaningful information. Removing the adjective “mild” ensures that the finding remains clear and concise."""
+
+SELECTION_USER_TEMPLATE = """**New Task**:
+
+**Original Sentence**:
+"{sentence}"
+
+**Options**:
+{options}
+
+**Response Requirement**:
+Respond with the number of the selected option (e.g., '1', '2', etc.) followed by a detailed explanation of why you chose this option, referencing both the original sentence and the choice.
+Ensure you are picking finings that follow the criteria, and choose the sentences that split up the findings into singular sentences.
+Prefer outputs that have "located at" over outputs that have "at".
+"""
+
+# Function to build the chat messages for a single-pass report extraction
+def extraction_messages(report_content):
+    return [
+        {'role': 'system', 'content': EXTRACTION_SYSTEM_PROMPT},
+        {'role': 'user', 'content': EXTRACTION_USER_TEMPLATE.format(report_content=report_content)},
+    ]
+
+# Function to build the chat messages sent to every temperature model for a sentence
+def temperature_messages(report_content, sentence):
+    return [
+        {'role': 'system', 'content': TEMPERATURE_SYSTEM_PROMPT},
+        {'role': 'user', 'content': TEMPERATURE_USER_TEMPLATE.format(report_content=report_content, sentence=sentence)},
+    ]
+
+# Function to build the chat messages asking a temperature model for the findings of several sentences at once
+def batch_temperature_messages(report_content, sentences):
+    numbered = '\n'.join(f'Sentence {number}: "{sentence}"' for number, sentence in enumerate(sentences, start=1))
+    return [
+        {'role': 'system', 'content': BATCH_TEMPERATURE_SYSTEM_PROMPT},
+        {'role': 'user', 'content': BATCH_TEMPERATURE_USER_TEMPLATE.format(report_content=report_content, sentences=numbered)},
+    ]
+
+# Function to build the chat messages asking the selection model to pick among the candidate outputs
+def selection_messages(sentence, options):
+    return [
+        {'role': 'system', 'content': SELECTION_SYSTEM_PROMPT},
+        {'role': 'user', 'content': SELECTION_USER_TEMPLATE.format(sentence=sentence, options=options)},
+    ]
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Modes: 'use' reads and stores responses, 'refresh' re-queries and overwrites them, 'bypass' ignores the cache
+CACHE_MODES = ('use', 'refresh', 'bypass')
+
+# On-disk, content-addressed cache of chat responses with least-recently-used eviction
+class ResponseCache:
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024, mode='use'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        # Apply the size bound straight away in case it was lowered since the last run
+        self._evict()
+        self._conn.commit()
+
+    # Function to hash a request into its cache key; any change to the model, prompt or options is a new key
+    @staticmethod
+    def make_key(model, messages, options=None):
+        payload = json.dumps({'model': model, 'messages': messages, 'options': options or {}},
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # Function to look up a stored response, returning None on a miss
+    def get(self, key):
+        if self.mode != 'use':
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            row = self._conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    # Function to store a response and evict the least recently used entries beyond max_bytes
+    def put(self, key, model, response):
+        if self.mode == 'bypass':
+            return
+        data = json.dumps(response, ensure_ascii=False, default=str)
+        size = len(data.encode('utf-8'))
+        with self._lock:
+            previous = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if previous is not None:
+                self._total_bytes -= previous[0]
+            self._conn.execute('INSERT OR REPLACE INTO responses (key, model, response, size, last_used) VALUES (?, ?, ?, ?, ?)',
+                               (key, model, data, size, time.time()))
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            oldest = self._conn.execute('SELECT key, size FROM responses ORDER BY last_used ASC LIMIT 100').fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    # Function to summarise the cache counters
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'mode': self.mode,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': self._total_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,148 @@
+import csv
+import os
+import re
+import sys
+import threading
+
+import text_processing
+from candidate_scorer import SEVERITY_WORDS, SPECULATIVE_WORDS
+
+# Rule-based findings for formulaic sentences, so they skip the model entirely.
+#
+# The prompts already spell out the transformations of the most common sentence shapes; here they are
+# applied directly:
+#   "no X" / "no evidence of X"      -> "There is no X"
+#   "there is no X"                  -> "There is no X"
+#   "X is normal" / "normal X"       -> "There is normal X"
+#   "X is unremarkable"              -> "There is no abnormality at X"
+#   "the lungs are clear"            -> "There is clear lungs"
+# A sentence only matches when X is a plain noun phrase: anything with a conjunction, a location
+# ("of", "at", "in", ...), a speculative or severity word, a hedge ("definite", "convincing") or a
+# reference to earlier imaging goes to the model, which knows how to split and rephrase it.
+#
+# Usage: python rule_engine.py   (hit rate and agreement with the committed result CSVs)
+
+NOUN_PHRASE = r"(?:the |a |an )?(?P<subject>[a-z0-9][a-z0-9\- /]*?)"
+VERB = r"(?:is|are|appears?|looks?|remains?)"
+# Trailing words that only say the absence was looked for, e.g. "no fracture is seen"
+SEEN = r"(?:\s+(?:is|are|was|were)?\s*(?:seen|identified|demonstrated|evident|present|noted))?"
+
+# (rule name, pattern, findings template) in the order they are tried
+RULES = [
+    ('no_evidence_of', re.compile(rf"^no evidence of {NOUN_PHRASE}{SEEN}$"), "There is no {subject}"),
+    ('no', re.compile(rf"^no {NOUN_PHRASE}{SEEN}$"), "There is no {subject}"),
+    ('there_is_no', re.compile(rf"^there (?:is|are) no (?:evidence of )?{NOUN_PHRASE}{SEEN}$"), "There is no {subject}"),
+    ('is_normal', re.compile(rf"^{NOUN_PHRASE} (?:{VERB} normal|(?:{VERB} )?within normal limits)$"),
+     "There is normal {subject}"),
+    ('normal', re.compile(rf"^normal {NOUN_PHRASE}$"), "There is normal {subject}"),
+    ('is_unremarkable', re.compile(rf"^{NOUN_PHRASE} {VERB} unremarkable$"), "There is no abnormality at {subject}"),
+    ('lungs_clear', re.compile(r"^(?:the )?(?P<subject>lungs|lung fields) (?:are|appear) clear$"), "There is clear {subject}"),
+]
+
+# Words that make a subject more than a plain noun phrase, so the sentence is left to the model
+CONJUNCTIONS = ('and', 'or', 'with', 'but', 'nor', 'without')
+PREPOSITIONS = ('of', 'at', 'in', 'on', 'within', 'involving', 'over', 'to', 'from', 'along', 'around', 'near',
+                'above', 'below', 'into', 'across', 'between', 'through', 'throughout', 'overlying', 'projected',
+                'extending')
+HEDGE_WORDS = ('definite', 'definitely', 'convincing', 'obvious', 'appreciable', 'discernible', 'features', 'signs',
+               'evidence', 'no', 'not', 'other', 'further')
+COMPARISON_WORDS = ('previous', 'previously', 'prior', 'interval', 'change', 'changes', 'comparison', 'again',
+                    'since', 'before', 'unchanged', 'stable', 'persists', 'persistent', 'new')
+EXCLUDED_WORD = re.compile(r'\b(' + '|'.join(re.escape(word) for word in CONJUNCTIONS + PREPOSITIONS + HEDGE_WORDS
+                                             + COMPARISON_WORDS + SPECULATIVE_WORDS + SEVERITY_WORDS) + r')\b')
+# Longest subject taken as a plain noun phrase
+max_subject_words = 5
+
+# Matches sentences against the rules and counts the hits of every rule
+class RuleEngine:
+    def __init__(self, rules=None):
+        self.rules = rules or RULES
+        self.sentences = 0
+        self.hits = {name: 0 for name, _, _ in self.rules}
+        self._lock = threading.Lock()
+
+    # Function to return the findings of a sentence and the rule that produced them, or (None, None)
+    def apply(self, sentence):
+        text = text_processing.normalize_text(sentence)
+        for name, pattern, template in self.rules:
+            match = pattern.match(text)
+            if match is None:
+                continue
+            subject = match.group('subject').strip()
+            if EXCLUDED_WORD.search(subject) or len(subject.split()) > max_subject_words:
+                return None, None
+            return template.format(subject=subject), name
+        return None, None
+
+    # Function to return the findings of a sentence, or None when it has to go to the model
+    def match(self, sentence):
+        findings, name = self.apply(sentence)
+        with self._lock:
+            self.sentences += 1
+            if name is not None:
+                self.hits[name] += 1
+        return findings
+
+    # Function to report how many sentences the rules answered
+    def stats(self):
+        with self._lock:
+            total_hits = sum(self.hits.values())
+            return {
+                'sentences': self.sentences,
+                'hits': total_hits,
+                'hit_rate': round(total_hits / self.sentences, 4) if self.sentences else 0.0,
+                'by_rule': dict(self.hits),
+            }
+
+    # Function to print the hit rate at the end of a run
+    def print_summary(self):
+        counters = self.stats()
+        if not counters['sentences']:
+            return
+        by_rule = ', '.join(f"{name} {hits}" for name, hits in counters['by_rule'].items() if hits)
+        print(f"Rule fast path: {counters['hits']} of {counters['sentences']} sentences "
+              f"({counters['hit_rate']:.1%}) answered without the model" + (f" ({by_rule})" if by_rule else ""))
+
+# Function to normalise a findings statement for comparison, ignoring articles and punctuation
+def comparable(statement):
+    words = text_processing.normalize_text(statement).replace('.', '').split()
+    return ' '.join(word for word in words if word not in ('a', 'an', 'the'))
+
+# Function to compare the rule findings with the findings committed for the same reports
+def agreement_check(csv_paths=None, show=10):
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    csv_paths = csv_paths or [(os.path.join(package_dir, 'current_results.csv'), 'Findings'),
+                              (os.path.join(package_dir, 'final_results.csv'), 'Key Findings')]
+    results = []
+    for csv_path, column in csv_paths:
+        engine = RuleEngine()
+        agreed = 0
+        disagreements = []
+        with open(csv_path, 'r', encoding='utf-8') as infile:
+            for row in csv.DictReader(infile):
+                committed = {comparable(statement) for statement in text_processing.split_statements(row[column])}
+                for sentence in text_processing.split_sentences(row['report_content']):
+                    findings = engine.match(sentence)
+                    if findings is None:
+                        continue
+                    if comparable(findings) in committed:
+                        agreed += 1
+                    else:
+                        disagreements.append((sentence, findings))
+        counters = engine.stats()
+        results.append({
+            'file': os.path.basename(csv_path),
+            **counters,
+            'agreed': agreed,
+            'agreement': round(agreed / counters['hits'], 4) if counters['hits'] else 0.0,
+            'disagreements': disagreements[:show],
+        })
+    return results
+
+if __name__ == '__main__':
+    for result in agreement_check(show=int(sys.argv[1]) if len(sys.argv) > 1 else 10):
+        print(f"{result['file']}: {result['hits']} of {result['sentences']} sentences matched ({result['hit_rate']:.1%}), "
+              f"{result['agreed']} agree with the committed findings ({result['agreement']:.1%})")
+        print("    by rule: " + ', '.join(f"{name} {hits}" for name, hits in result['by_rule'].items()))
+        for sentence, findings in result['disagreements']:
+            print(f"    differs: {sentence!r} -> {findings!r}")
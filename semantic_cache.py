@@ -0,0 +1,154 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from text_processing import NearDuplicateIndex, normalize_text
+
+# Reuse of findings for paraphrased sentences.
+#
+# Every sentence -> finding pair produced by the ensemble is added to a local index. Before the ensemble
+# runs for a new sentence, the most similar earlier sentence is looked up: candidates come from a
+# MinHash/LSH index over character shingles, and are ranked by the cosine similarity of their character
+# n-gram TF-IDF vectors. A finding is reused when the similarity reaches the threshold and both
+# sentences agree on negation, laterality and numbers, so "no fracture" never reuses "fracture".
+# Every reuse is written to an audit log.
+
+# Character n-gram lengths of the TF-IDF vectors
+NGRAM_SIZES = (3, 4, 5)
+# Candidates from the LSH index that are scored exactly
+max_candidates = 50
+# Words whose presence must match before a finding can be reused
+GUARD_WORDS = frozenset({
+    'no', 'not', 'without', 'negative', 'absent', 'absence', 'nor', 'never', 'cannot', 'free',
+    'left', 'right',
+    'new', 'old', 'increased', 'decreased', 'improved', 'worsened', 'unchanged',
+})
+GUARD_TOKEN = re.compile(r'[a-z]+|\d+(?:\.\d+)?')
+
+# Function to collect the words and numbers that change a sentence's meaning without changing its wording much
+def guard_tokens(sentence):
+    return frozenset(token for token in GUARD_TOKEN.findall(sentence.lower())
+                     if token in GUARD_WORDS or token[0].isdigit())
+
+# Function to count the character n-grams of a normalised sentence
+def ngram_counts(sentence):
+    text = f" {normalize_text(sentence)} "
+    counts = {}
+    for size in NGRAM_SIZES:
+        for index in range(len(text) - size + 1):
+            ngram = text[index:index + size]
+            counts[ngram] = counts.get(ngram, 0) + 1
+    return counts
+
+class SemanticCache:
+    def __init__(self, threshold=0.85, path=None, audit_path=None):
+        self.threshold = threshold
+        self.path = path
+        self.audit_path = audit_path
+        self.lookups = 0
+        self.reuses = 0
+        self.rejected_by_guard = 0
+        self._index = NearDuplicateIndex(threshold=0.0, num_perm=64, bands=32)
+        self._entries = []
+        self._normalized = {}
+        self._document_frequency = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            if os.path.exists(path):
+                self._load(path)
+            self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self, path):
+        with open(path, 'r', encoding='utf-8') as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last line half written
+                    continue
+                self._add(entry['sentence'], entry['finding'])
+
+    def _add(self, sentence, finding):
+        key = normalize_text(sentence)
+        if key in self._normalized:
+            return False
+        counts = ngram_counts(sentence)
+        for ngram in counts:
+            self._document_frequency[ngram] = self._document_frequency.get(ngram, 0) + 1
+        self._normalized[key] = len(self._entries)
+        self._index.add(len(self._entries), sentence)
+        self._entries.append((sentence, finding, counts, guard_tokens(sentence)))
+        return True
+
+    # Function to record the finding produced for a sentence
+    def add(self, sentence, finding):
+        with self._lock:
+            if self._add(sentence, finding) and self._file is not None:
+                self._file.write(json.dumps({'sentence': sentence, 'finding': finding}) + '\n')
+                self._file.flush()
+
+    def _vector(self, counts):
+        entries = len(self._entries)
+        vector = {ngram: (1 + math.log(count)) * (math.log((1 + entries) / (1 + self._document_frequency.get(ngram, 0))) + 1)
+                  for ngram, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {ngram: weight / norm for ngram, weight in vector.items()}
+
+    # Function to compute the TF-IDF cosine similarity of two sentences' n-gram counts
+    def similarity(self, counts1, counts2):
+        vector1 = self._vector(counts1)
+        vector2 = self._vector(counts2)
+        if len(vector1) > len(vector2):
+            vector1, vector2 = vector2, vector1
+        return sum(weight * vector2.get(ngram, 0.0) for ngram, weight in vector1.items())
+
+    # Function to find a finding to reuse for a sentence, returning (finding, matched_sentence, similarity) or None
+    def lookup(self, sentence, report_content=None):
+        counts = ngram_counts(sentence)
+        guards = guard_tokens(sentence)
+        with self._lock:
+            self.lookups += 1
+            best = None
+            for entry_index in self._index.candidates(sentence, limit=max_candidates):
+                matched_sentence, finding, entry_counts, entry_guards = self._entries[entry_index]
+                similarity = self.similarity(counts, entry_counts)
+                if similarity < self.threshold or (best is not None and similarity <= best[2]):
+                    continue
+                if entry_guards != guards:
+                    self.rejected_by_guard += 1
+                    continue
+                best = (finding, matched_sentence, similarity)
+            if best is None:
+                return None
+            self.reuses += 1
+            if self.audit_path:
+                with open(self.audit_path, 'a', encoding='utf-8') as audit_file:
+                    audit_file.write(json.dumps({
+                        'time': time.time(),
+                        'sentence': sentence,
+                        'matched_sentence': best[1],
+                        'similarity': round(best[2], 4),
+                        'finding': best[0],
+                        'report_content': report_content,
+                    }) + '\n')
+            return best
+
+    # Function to report the lookup and reuse counters
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'lookups': self.lookups,
+                'reuses': self.reuses,
+                'reuse_rate': round(self.reuses / self.lookups, 4) if self.lookups else 0.0,
+                'rejected_by_guard': self.rejected_by_guard,
+            }
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
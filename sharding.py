@@ -0,0 +1,284 @@
+import argparse
+import csv
+import hashlib
+import heapq
+import json
+import os
+
+# Sharded batch runs for exports too large for one machine.
+#
+# split  writes the input CSV as N shard CSVs, assigning every row to a shard by a hash of its
+#        report_output_folder and tagging it with its row_index in the input, plus a manifest.json
+# run    processes one shard with either pipeline (any machine that has the shard directory); the merge
+#        needs the full output layout, so --output-mode keys and split are refused
+# merge  combines the shard results and error files into single CSVs in the original input order,
+#        failing when a row is missing, appears twice, came back from the wrong shard or was produced
+#        from a different input
+#
+# Usage: python sharding.py split <input_csv> <shard_dir> <shards> [--key report_output_folder]
+#        python sharding.py run <manifest> <shard> [--pipeline final|current|hybrid] [pipeline options...]
+#        python sharding.py merge <manifest> <output_csv> <error_csv> [--allow-missing]
+
+ROW_INDEX = 'row_index'
+MANIFEST_NAME = 'manifest.json'
+# Written next to each shard's results by run: the hashes of the input and shard file they came from
+SOURCE_SUFFIX = '.source.json'
+
+# Function to pick the shard of a key; sha256 keeps the assignment identical on every machine
+def shard_of(key, shard_count):
+    return int(hashlib.sha256(key.encode('utf-8')).hexdigest(), 16) % shard_count
+
+# Function to hash a file so the merge can tell which input the shards were cut from
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Function to split an input CSV into shards and write the manifest describing them
+def split_csv(input_csv_path, shard_dir, shard_count, key_column='report_output_folder'):
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = [{
+        'shard': shard,
+        'input': f"shard_{shard:03d}.csv",
+        'results': f"shard_{shard:03d}_results.csv",
+        'errors': f"shard_{shard:03d}_errors.csv",
+        'rows': 0,
+    } for shard in range(shard_count)]
+    # Rows without report content are skipped by both pipelines, so the merge expects them to be absent
+    skipped_rows = []
+
+    with open(input_csv_path, 'r', encoding='utf-8') as infile:
+        reader = csv.DictReader(infile)
+        if key_column not in reader.fieldnames:
+            raise ValueError(f"Column {key_column!r} not found in {input_csv_path}")
+        fieldnames = [ROW_INDEX] + reader.fieldnames
+        shard_files = [open(os.path.join(shard_dir, shard['input']), 'w', encoding='utf-8', newline='') for shard in shards]
+        try:
+            writers = [csv.DictWriter(shard_file, fieldnames=fieldnames) for shard_file in shard_files]
+            for writer in writers:
+                writer.writeheader()
+            total_rows = 0
+            for row_index, row in enumerate(reader):
+                shard = shard_of(row[key_column] or '', shard_count)
+                writers[shard].writerow({ROW_INDEX: row_index, **row})
+                shards[shard]['rows'] += 1
+                if not row.get('report_content'):
+                    skipped_rows.append(row_index)
+                total_rows += 1
+        finally:
+            for shard_file in shard_files:
+                shard_file.close()
+    for shard in shards:
+        shard['input_sha256'] = file_sha256(os.path.join(shard_dir, shard['input']))
+
+    manifest = {
+        'input': os.path.abspath(input_csv_path),
+        'input_sha256': file_sha256(input_csv_path),
+        'key_column': key_column,
+        'shard_count': shard_count,
+        'total_rows': total_rows,
+        'fieldnames': reader.fieldnames,
+        'skipped_rows': skipped_rows,
+        'shards': shards,
+    }
+    manifest_path = os.path.join(shard_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    return manifest_path
+
+# Function to read a manifest, resolving the shard file names against its directory
+def load_manifest(manifest_path):
+    with open(manifest_path, 'r', encoding='utf-8') as infile:
+        manifest = json.load(infile)
+    shard_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for shard in manifest['shards']:
+        for name in ('input', 'results', 'errors'):
+            shard[name] = os.path.join(shard_dir, shard[name])
+    return manifest
+
+# Function to read the source record of a shard's results, None when there is none
+def read_source(shard_files):
+    source_path = shard_files['results'] + SOURCE_SUFFIX
+    if not os.path.exists(source_path):
+        return None
+    with open(source_path, 'r', encoding='utf-8') as infile:
+        return json.load(infile)
+
+# Function to check that a shard's results were produced from the manifest's input and shard file
+def check_source(manifest, shard_files):
+    source = read_source(shard_files)
+    if source is None:
+        raise ValueError(f"{shard_files['results']} has no {SOURCE_SUFFIX} record; was it produced by sharding.py run?")
+    expected_shard = shard_files.get('input_sha256')
+    if source['input_sha256'] != manifest['input_sha256'] or (expected_shard and source['shard_sha256'] != expected_shard):
+        raise ValueError(f"{shard_files['results']} was produced from a different input than {manifest['input']}")
+
+# Function to process one shard with a pipeline; extra_args are passed on to the pipeline's command line
+def run_shard(manifest_path, shard, pipeline='final', extra_args=()):
+    if pipeline == 'final':
+        import final_results as module
+    elif pipeline == 'current':
+        import current_results as module
+    elif pipeline == 'hybrid':
+        import hybrid_results as module
+    else:
+        raise ValueError(f"Unknown pipeline {pipeline!r}")
+    # The merge needs one row per input row with every input column, so only the full output layout is sharded
+    mode_parser = argparse.ArgumentParser(add_help=False)
+    mode_parser.add_argument('--output-mode', default='full')
+    output_mode = mode_parser.parse_known_args(list(extra_args))[0].output_mode
+    if output_mode != 'full':
+        raise ValueError(f"Sharded runs need --output-mode full, not {output_mode!r}")
+    manifest = load_manifest(manifest_path)
+    shard_files = manifest['shards'][shard]
+    shard_sha256 = file_sha256(shard_files['input'])
+    if shard_files.get('input_sha256') and shard_sha256 != shard_files['input_sha256']:
+        raise ValueError(f"{shard_files['input']} has changed since it was split")
+    # Resuming appends to the existing results, which must come from the same input
+    if '--resume' in extra_args and os.path.exists(shard_files['results']):
+        check_source(manifest, shard_files)
+    with open(shard_files['results'] + SOURCE_SUFFIX, 'w', encoding='utf-8') as outfile:
+        json.dump({'input_sha256': manifest['input_sha256'], 'shard_sha256': shard_sha256}, outfile)
+    module.main(['--input', shard_files['input'], '--output', shard_files['results'],
+                 '--errors', shard_files['errors'], *extra_args])
+
+# Function to read the rows of one shard output file as (row_index, kind, row), checking their order and shard
+def shard_rows(path, kind, shard, manifest):
+    with open(path, 'r', encoding='utf-8') as infile:
+        reader = csv.DictReader(infile)
+        if ROW_INDEX not in (reader.fieldnames or []):
+            raise ValueError(f"{path} has no {ROW_INDEX} column; was it produced from a shard file?")
+        previous_index = -1
+        for row in reader:
+            row_index = int(row.pop(ROW_INDEX))
+            # Both pipelines write rows in input order, which is what lets the merge stream; a repeated
+            # row_index is left for the merge to report as a duplicate
+            if row_index < previous_index:
+                raise ValueError(f"{path} is not in input order at row_index {row_index}")
+            if shard_of(row[manifest['key_column']] or '', manifest['shard_count']) != shard:
+                raise ValueError(f"{path} contains row_index {row_index}, which belongs to another shard")
+            previous_index = row_index
+            yield row_index, kind, row
+
+# Function to describe a list of row indexes briefly
+def describe_rows(row_indexes, limit=10):
+    listed = ', '.join(str(row_index) for row_index in row_indexes[:limit])
+    return f"{len(row_indexes)} rows ({listed}{', ...' if len(row_indexes) > limit else ''})"
+
+# Function to merge the shard results and errors into single CSVs in input order
+def merge_shards(manifest_path, output_csv_path, error_csv_path, allow_missing=False):
+    manifest = load_manifest(manifest_path)
+    missing_files = [path for shard in manifest['shards'] for path in (shard['results'], shard['errors'])
+                     if not os.path.exists(path)]
+    if missing_files and not allow_missing:
+        raise ValueError(f"Missing shard outputs: {', '.join(missing_files)}")
+    for shard in manifest['shards']:
+        if os.path.exists(shard['results']):
+            check_source(manifest, shard)
+
+    # All result files share one header, as do the error files
+    headers = {}
+    for shard in manifest['shards']:
+        for kind in ('results', 'errors'):
+            if os.path.exists(shard[kind]):
+                with open(shard[kind], 'r', encoding='utf-8') as infile:
+                    fieldnames = [name for name in next(csv.reader(infile), []) if name != ROW_INDEX]
+                if headers.setdefault(kind, fieldnames) != fieldnames:
+                    raise ValueError(f"{shard[kind]} has different columns from the other {kind} files")
+
+    streams = [shard_rows(shard[kind], kind, shard['shard'], manifest)
+               for shard in manifest['shards'] for kind in ('results', 'errors') if os.path.exists(shard[kind])]
+    skipped_rows = set(manifest['skipped_rows'])
+    missing_rows = []
+    duplicate_rows = []
+    counts = {'results': 0, 'errors': 0}
+
+    # Write to temporary files, so a failed merge never leaves a partial output behind
+    temporary_paths = {'results': output_csv_path + '.tmp', 'errors': error_csv_path + '.tmp'}
+    try:
+        with open(temporary_paths['results'], 'w', encoding='utf-8', newline='') as outfile, \
+             open(temporary_paths['errors'], 'w', encoding='utf-8', newline='') as errorfile:
+            writers = {
+                'results': csv.DictWriter(outfile, fieldnames=headers.get('results', manifest['fieldnames'])),
+                'errors': csv.DictWriter(errorfile, fieldnames=headers.get('errors', manifest['fieldnames'])),
+            }
+            for writer in writers.values():
+                writer.writeheader()
+
+            next_index = 0
+            for row_index, kind, row in heapq.merge(*streams, key=lambda item: item[0]):
+                if row_index < next_index:
+                    duplicate_rows.append(row_index)
+                    continue
+                missing_rows.extend(index for index in range(next_index, row_index) if index not in skipped_rows)
+                next_index = row_index + 1
+                writers[kind].writerow(row)
+                counts[kind] += 1
+            missing_rows.extend(index for index in range(next_index, manifest['total_rows']) if index not in skipped_rows)
+
+        problems = []
+        if duplicate_rows:
+            problems.append(f"duplicated: {describe_rows(duplicate_rows)}")
+        if missing_rows and not allow_missing:
+            problems.append(f"missing: {describe_rows(missing_rows)}")
+        if problems:
+            raise ValueError(f"Shard merge failed, {'; '.join(problems)}")
+    except Exception:
+        for path in temporary_paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    os.replace(temporary_paths['results'], output_csv_path)
+    os.replace(temporary_paths['errors'], error_csv_path)
+    return {
+        'rows': manifest['total_rows'],
+        'results': counts['results'],
+        'errors': counts['errors'],
+        'skipped': len(skipped_rows),
+        'missing': len(missing_rows),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split an input CSV into shards and merge the shard outputs back")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    split_parser = commands.add_parser('split', help="split an input CSV into shards")
+    split_parser.add_argument('input')
+    split_parser.add_argument('shard_dir')
+    split_parser.add_argument('shards', type=int)
+    split_parser.add_argument('--key', default='report_output_folder', help="column whose hash picks the shard")
+
+    run_parser = commands.add_parser('run', help="process one shard")
+    run_parser.add_argument('manifest')
+    run_parser.add_argument('shard', type=int)
+    run_parser.add_argument('--pipeline', default='final', choices=('final', 'current', 'hybrid'))
+
+    merge_parser = commands.add_parser('merge', help="merge the shard outputs in input order")
+    merge_parser.add_argument('manifest')
+    merge_parser.add_argument('output')
+    merge_parser.add_argument('errors')
+    merge_parser.add_argument('--allow-missing', action='store_true', help="merge even when rows are missing")
+
+    # Options after the run arguments are passed on to the pipeline, e.g. --hosts or --workers
+    args, extra_args = parser.parse_known_args(argv)
+    if extra_args and args.command != 'run':
+        parser.error(f"unrecognized arguments: {' '.join(extra_args)}")
+
+    if args.command == 'split':
+        manifest_path = split_csv(args.input, args.shard_dir, args.shards, args.key)
+        manifest = load_manifest(manifest_path)
+        print(f"Split {manifest['total_rows']} rows into {args.shards} shards, manifest at {manifest_path}")
+        for shard in manifest['shards']:
+            print(f"    shard {shard['shard']}: {shard['rows']} rows")
+    elif args.command == 'run':
+        run_shard(args.manifest, args.shard, args.pipeline, extra_args)
+    else:
+        counts = merge_shards(args.manifest, args.output, args.errors, args.allow_missing)
+        print(f"Merged {counts['results']} results and {counts['errors']} errors of {counts['rows']} rows "
+              f"({counts['skipped']} without report content, {counts['missing']} missing)")
+
+if __name__ == '__main__':
+    main()
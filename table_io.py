@@ -0,0 +1,233 @@
+import csv
+import os
+
+# Readers and writers for the pipeline inputs and outputs, picked by file extension: CSV, Parquet
+# (.parquet, .pq) or Arrow IPC (.arrow, .feather, .ipc). pyarrow is only imported for the columnar
+# formats, which buffer rows and write them out a row group at a time instead of row by row.
+#
+# Output modes:
+#   full   every input column plus the findings column (the original layout)
+#   keys   only the key columns plus the findings column, without the report text
+#   split  the key columns plus one row per finding, numbered by finding_index
+
+TABLE_FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+OUTPUT_MODES = ('full', 'keys', 'split')
+# Columns identifying a report, kept by the keys and split output modes when the input has them
+KEY_COLUMNS = ('row_index', 'report_output_folder', 'body_part_file_name', 'full_path')
+# Integer columns of the columnar outputs; every other column is written as a string
+INTEGER_COLUMNS = ('row_index', 'finding_index')
+
+# Rows per record batch when reading, and per row group when writing the columnar formats
+batch_size = 10000
+row_group_size = 10000
+
+# Function to tell the format of a table file from its extension
+def table_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in TABLE_FORMATS:
+        raise ValueError(f"Unsupported table format {extension!r} for {path}; expected one of {', '.join(TABLE_FORMATS)}")
+    return TABLE_FORMATS[extension]
+
+# Function to tell whether a run writing these files can be resumed, which needs the CSV byte offsets
+def supports_resume(*paths):
+    return all(table_format(path) == 'csv' for path in paths)
+
+# Function to import pyarrow on first use, so CSV-only runs do not need it installed
+def pyarrow_modules():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet and Arrow files need pyarrow (pip install pyarrow)") from e
+    return pyarrow, pyarrow.parquet, pyarrow.ipc
+
+# Reads a CSV file as dict rows
+class CsvReader:
+    def __init__(self, path):
+        self._file = open(path, 'r', encoding='utf-8')
+        self._reader = csv.DictReader(self._file)
+        self.fieldnames = self._reader.fieldnames
+
+    def __iter__(self):
+        return iter(self._reader)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Reads a Parquet or Arrow IPC file as dict rows, one record batch at a time
+class ArrowReader:
+    def __init__(self, path, file_format):
+        pyarrow, parquet, ipc = pyarrow_modules()
+        if file_format == 'parquet':
+            self._file = parquet.ParquetFile(path)
+            self.fieldnames = self._file.schema_arrow.names
+            self._batches = lambda: self._file.iter_batches(batch_size=batch_size)
+        else:
+            self._file = ipc.open_file(pyarrow.memory_map(path))
+            self.fieldnames = self._file.schema.names
+            self._batches = lambda: (self._file.get_batch(index) for index in range(self._file.num_record_batches))
+
+    def __iter__(self):
+        for batch in self._batches():
+            for row in batch.to_pylist():
+                # Nulls read back as empty strings, as they would from a CSV
+                yield {name: '' if value is None else value for name, value in row.items()}
+
+    def close(self):
+        close = getattr(self._file, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Function to open a table file for reading as dict rows; the reader has the column names in fieldnames
+def open_reader(path):
+    file_format = table_format(path)
+    return CsvReader(path) if file_format == 'csv' else ArrowReader(path, file_format)
+
+# Writes dict rows to a CSV file; flush() and tell() let the checkpoint journal record its size
+class CsvWriter:
+    def __init__(self, path, fieldnames, file_mode='w'):
+        self._file = open(path, file_mode, encoding='utf-8', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        if file_mode == 'w':
+            self._writer.writeheader()
+
+    def writerow(self, row):
+        self._writer.writerow(row)
+
+    def flush(self):
+        self._file.flush()
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Writes dict rows to a Parquet or Arrow IPC file, buffering them into row groups
+class ArrowWriter:
+    def __init__(self, path, fieldnames, file_format):
+        pyarrow, parquet, ipc = pyarrow_modules()
+        self._pyarrow = pyarrow
+        self.fieldnames = list(fieldnames)
+        self.schema = pyarrow.schema([(name, pyarrow.int64() if name in INTEGER_COLUMNS else pyarrow.string())
+                                      for name in self.fieldnames])
+        self._rows = []
+        if file_format == 'parquet':
+            self._writer = parquet.ParquetWriter(path, self.schema, compression='zstd')
+            self._write_table = lambda table: self._writer.write_table(table, row_group_size=row_group_size)
+        else:
+            self._sink = pyarrow.OSFile(path, 'wb')
+            self._writer = ipc.new_file(self._sink, self.schema)
+            self._write_table = self._writer.write_table
+
+    @staticmethod
+    def _value(name, value):
+        if value is None or value == '':
+            return None
+        return int(value) if name in INTEGER_COLUMNS else str(value)
+
+    def writerow(self, row):
+        self._rows.append({name: self._value(name, row.get(name)) for name in self.fieldnames})
+        if len(self._rows) >= row_group_size:
+            self.flush()
+
+    # Function to write the buffered rows out as one row group
+    def flush(self):
+        if self._rows:
+            self._write_table(self._pyarrow.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        sink = getattr(self, '_sink', None)
+        if sink is not None:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Function to open a table file for writing dict rows; only CSV files can be appended to (file_mode 'a')
+def open_writer(path, fieldnames, file_mode='w'):
+    file_format = table_format(path)
+    if file_format == 'csv':
+        return CsvWriter(path, fieldnames, file_mode)
+    if file_mode != 'w':
+        raise ValueError(f"{file_format} files can only be written from the start, not appended to")
+    return ArrowWriter(path, fieldnames, file_format)
+
+# Function to split a findings string into its statements
+def split_findings(findings):
+    return [statement.strip() for statement in (findings or '').split(';') if statement.strip()]
+
+# Writes result rows in one of the output modes
+class FindingsWriter:
+    def __init__(self, path, input_fieldnames, findings_column, mode='full', file_mode='w'):
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode {mode!r}; expected one of {', '.join(OUTPUT_MODES)}")
+        self.findings_column = findings_column
+        self.mode = mode
+        self.key_columns = [name for name in KEY_COLUMNS if name in input_fieldnames]
+        if mode == 'full':
+            fieldnames = list(input_fieldnames) + ([findings_column] if findings_column not in input_fieldnames else [])
+        elif mode == 'keys':
+            fieldnames = self.key_columns + [findings_column]
+        else:
+            fieldnames = self.key_columns + ['finding_index', findings_column]
+        self.writer = open_writer(path, fieldnames, file_mode)
+
+    def writerow(self, row):
+        if self.mode == 'full':
+            self.writer.writerow(row)
+            return
+        keys = {name: row.get(name) for name in self.key_columns}
+        if self.mode == 'keys':
+            self.writer.writerow({**keys, self.findings_column: row.get(self.findings_column, '')})
+            return
+        # A report without findings still gets one row, so every report appears in the output
+        for finding_index, finding in enumerate(split_findings(row.get(self.findings_column)) or ['']):
+            self.writer.writerow({**keys, 'finding_index': finding_index, self.findings_column: finding})
+
+    def flush(self):
+        self.writer.flush()
+
+    def tell(self):
+        return self.writer.tell()
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The pipelines are plain modules at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import ollama_client
+
+# Fixture pointing every chat call at a FakeOllama that answers at once, restoring the default client afterwards
+@pytest.fixture
+def fake_ollama():
+    fake = benchmark.FakeOllama(latency=0)
+    ollama_client.configure(backend=fake)
+    yield fake
+    ollama_client.configure()
+
+# Fixture writing the committed reports as a pipeline input CSV
+@pytest.fixture
+def reports_csv(tmp_path):
+    path = str(tmp_path / 'valid_reports.csv')
+    benchmark.write_benchmark_input(path)
+    return path
@@ -0,0 +1,61 @@
+import threading
+
+import adaptive_concurrency
+from adaptive_concurrency import AimdLimiter
+from endpoint_pool import Endpoint, EndpointPool
+
+def test_limit_is_only_raised_by_calls_that_fill_it():
+    limiter = AimdLimiter('host/stage', initial=4)
+    for _ in range(100):
+        at_limit = limiter.acquire()
+        limiter.release(0.01, at_limit=at_limit)
+    # One call at a time never reaches the limit, so nothing says more calls would be served as fast
+    assert limiter.stats()['limit'] == 4
+
+def test_limit_grows_while_it_is_reached():
+    limiter = AimdLimiter('host/stage', initial=2)
+    for _ in range(20):
+        calls = [limiter.acquire() for _ in range(int(limiter.limit))]
+        for at_limit in calls:
+            limiter.release(0.01, at_limit=at_limit)
+    assert limiter.stats()['limit'] > 2
+
+def test_overload_halves_the_limit():
+    limiter = AimdLimiter('host/stage', initial=8)
+    limiter.acquire()
+    limiter.release(0.01, overloaded=True)
+    assert limiter.stats()['limit'] == 4
+
+def test_sustained_latency_rise_lowers_the_limit(monkeypatch):
+    monkeypatch.setattr(adaptive_concurrency, 'warmup_calls', 5)
+    monkeypatch.setattr(adaptive_concurrency, 'latency_smoothing', 0.5)
+    limiter = AimdLimiter('host/stage', initial=8)
+    for latency in [0.01] * 10 + [0.1] * 10:
+        limiter.acquire()
+        limiter.release(latency)
+    assert limiter.stats()['limit'] < 8
+    assert limiter.stats()['decreases'] >= 1
+
+def test_waiting_calls_run_inside_the_while_waiting_context():
+    limiter = AimdLimiter('host/stage', initial=1)
+    waited = threading.Event()
+    class Waiting:
+        def __enter__(self):
+            waited.set()
+        def __exit__(self, *exc_info):
+            return False
+    limiter.acquire()
+    thread = threading.Thread(target=lambda: limiter.release(0.01, at_limit=limiter.acquire(Waiting())))
+    thread.start()
+    assert waited.wait(5)
+    limiter.release(0.01)
+    thread.join(5)
+    assert limiter.stats()['in_flight'] == 0
+
+def test_waiting_requests_are_not_outstanding_on_their_endpoint():
+    pool = EndpointPool([Endpoint('host', object())])
+    endpoint = pool.acquire('model')
+    with pool.waiting(endpoint):
+        assert endpoint.outstanding == 0
+    assert endpoint.outstanding == 1
+    pool.close()
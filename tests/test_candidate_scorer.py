@@ -0,0 +1,30 @@
+from candidate_scorer import score_candidate, select_by_rules, split_statements
+
+SENTENCE = "Small left pleural effusion and a rib fracture."
+
+def test_split_statements_accepts_strings_and_lists():
+    assert split_statements("There is A; There is B; .") == ["There is A", "There is B"]
+    assert split_statements(["There is A", "There is B"]) == ["There is A", "There is B"]
+    assert split_statements(None) == []
+
+def test_split_findings_score_above_joined_ones():
+    assert score_candidate("There is left pleural effusion; There is rib fracture", SENTENCE) > \
+        score_candidate("There is left pleural effusion and rib fracture", SENTENCE)
+
+def test_speculation_and_format_are_penalised():
+    assert score_candidate("There is left pleural effusion", SENTENCE) > \
+        score_candidate("There is possible left pleural effusion", SENTENCE)
+    assert score_candidate("There is left pleural effusion", SENTENCE) > \
+        score_candidate("Left pleural effusion", SENTENCE)
+    assert score_candidate("", SENTENCE) == -10.0
+
+def test_select_by_rules_picks_the_best_candidate_or_defers_within_the_margin():
+    outputs = [{"Findings": "There is possible effusion"},
+               {"Findings": "There is left pleural effusion; There is rib fracture"}]
+    assert select_by_rules(outputs, SENTENCE) == 1
+    assert select_by_rules(outputs, SENTENCE, margin=100.0) is None
+    assert select_by_rules([], SENTENCE) is None
+
+def test_ties_go_to_the_earlier_candidate():
+    outputs = [{"Findings": "There is rib fracture"}, {"Findings": "There is rib fracture"}]
+    assert select_by_rules(outputs, SENTENCE) == 0
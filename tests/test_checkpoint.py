@@ -0,0 +1,115 @@
+import csv
+import os
+
+import pytest
+
+import checkpoint
+import final_results
+from checkpoint import CheckpointJournal
+
+# Function to write rows to the output files, journaling each one
+def write_rows(journal, outfile, errorfile, keys, details=None):
+    for key in keys:
+        outfile.write(f"{key}\n")
+        journal.record(key, 'done', outfile, errorfile, details)
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'journal'), str(tmp_path / 'output.csv'), str(tmp_path / 'error.csv')
+
+def test_resume_truncates_outputs_to_last_journaled_row(paths):
+    journal_path, output_path, error_path = paths
+    journal = CheckpointJournal(journal_path)
+    with open(output_path, 'w') as outfile, open(error_path, 'w') as errorfile:
+        journal.record(None, 'start', outfile, errorfile)
+        write_rows(journal, outfile, errorfile, ['a', 'b'])
+        # Written but not journaled before the crash
+        outfile.write("c\n")
+    journal.close()
+
+    resumed = CheckpointJournal(journal_path, resume=True)
+    assert resumed.restore_outputs(output_path, error_path)
+    assert resumed.completed == {'a': 'done', 'b': 'done'}
+    with open(output_path) as infile:
+        assert infile.read() == "a\nb\n"
+    resumed.close()
+
+def test_half_written_entry_is_dropped(paths):
+    journal_path, output_path, error_path = paths
+    journal = CheckpointJournal(journal_path)
+    with open(output_path, 'w') as outfile, open(error_path, 'w') as errorfile:
+        write_rows(journal, outfile, errorfile, ['a'])
+    journal.close()
+    with open(journal_path, 'a') as journal_file:
+        journal_file.write('{"key": "b", "sta')
+    size = os.path.getsize(journal_path)
+
+    resumed = CheckpointJournal(journal_path, resume=True)
+    assert resumed.completed == {'a': 'done'}
+    resumed.close()
+    assert os.path.getsize(journal_path) < size
+
+def test_details_are_handed_back_on_resume(paths):
+    journal_path, output_path, error_path = paths
+    journal = CheckpointJournal(journal_path)
+    with open(output_path, 'w') as outfile, open(error_path, 'w') as errorfile:
+        write_rows(journal, outfile, errorfile, ['a'], details={'fingerprint': 'f'})
+        journal.record('b', 'error', outfile, errorfile)
+    journal.close()
+
+    resumed = CheckpointJournal(journal_path, resume=True)
+    assert resumed.details == {'a': {'fingerprint': 'f'}}
+    resumed.close()
+
+def test_resume_without_outputs_starts_over(paths):
+    journal_path, output_path, error_path = paths
+    journal = CheckpointJournal(journal_path)
+    with open(output_path, 'w') as outfile, open(error_path, 'w') as errorfile:
+        write_rows(journal, outfile, errorfile, ['a'])
+    journal.close()
+    os.remove(output_path)
+
+    resumed = CheckpointJournal(journal_path, resume=True)
+    assert not resumed.restore_outputs(output_path, error_path)
+    assert resumed.completed == {}
+    resumed.close()
+
+def test_journal_is_synced_in_batches(paths, monkeypatch):
+    journal_path, output_path, error_path = paths
+    syncs = []
+    monkeypatch.setattr(checkpoint, 'sync_every_rows', 3)
+    monkeypatch.setattr(checkpoint, 'sync_interval', 3600)
+    monkeypatch.setattr(checkpoint.os, 'fsync', syncs.append)
+    journal = CheckpointJournal(journal_path)
+    with open(output_path, 'w') as outfile, open(error_path, 'w') as errorfile:
+        write_rows(journal, outfile, errorfile, [str(index) for index in range(7)])
+        assert len(syncs) == 2
+    journal.close()
+    assert len(syncs) == 3
+
+def test_interrupted_run_resumes_to_the_same_output(fake_ollama, reports_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(final_results, 'error_csv_path', str(tmp_path / 'error.csv'))
+    complete_path = str(tmp_path / 'complete.csv')
+    final_results.process_csv_file(reports_csv, complete_path)
+
+    # Stop the run after a few reports, as a crash would
+    extract_findings = final_results.extract_findings
+    extracted = []
+    def interrupted_extract_findings(*args, **kwargs):
+        if len(extracted) == 5:
+            raise KeyboardInterrupt
+        extracted.append(args)
+        return extract_findings(*args, **kwargs)
+    monkeypatch.setattr(final_results, 'extract_findings', interrupted_extract_findings)
+    output_path = str(tmp_path / 'output.csv')
+    with pytest.raises(KeyboardInterrupt):
+        final_results.process_csv_file(reports_csv, output_path)
+
+    monkeypatch.setattr(final_results, 'extract_findings', extract_findings)
+    calls_before = fake_ollama.calls
+    final_results.process_csv_file(reports_csv, output_path, resume=True)
+
+    with open(complete_path) as complete, open(output_path) as resumed:
+        complete_rows = list(csv.DictReader(complete))
+        assert list(csv.DictReader(resumed)) == complete_rows
+    assert fake_ollama.calls - calls_before == len(complete_rows) - 5
@@ -0,0 +1,82 @@
+import pytest
+
+import current_results
+
+A = {"Findings": "There is A"}
+B = {"Findings": "There is B"}
+
+# Fixture replacing the temperature calls with answers given per model (None for a failed call), recording
+# the models asked and the selections made
+@pytest.fixture
+def ensemble(monkeypatch):
+    state = {'answers': {}, 'asked': [], 'selected': []}
+    def prompt_temp_model(model_name, messages, sentence):
+        state['asked'].append(model_name)
+        return state['answers'].get(model_name, A)
+    def prompt_temp_model_batch(model_name, report_content, sentences):
+        state['asked'].append(model_name)
+        return [state['answers'].get(model_name, A) for _ in sentences]
+    def choose_best_output(outputs, sentence):
+        state['selected'].append(outputs)
+        return outputs[0]["Findings"]
+    monkeypatch.setattr(current_results, 'prompt_temp_model', prompt_temp_model)
+    monkeypatch.setattr(current_results, 'prompt_temp_model_batch', prompt_temp_model_batch)
+    monkeypatch.setattr(current_results, 'choose_best_output', choose_best_output)
+    monkeypatch.setattr(current_results, 'batch_sentences', False)
+    monkeypatch.setattr(current_results, 'agreement_k', 2)
+    return state
+
+@pytest.mark.parametrize('outputs, k, agreed', [
+    ([A, A], None, "There is A"),
+    ([A, {"Findings": " there is a "}], None, "There is A"),
+    ([A, B], None, None),
+    ([A, B, A], 2, "There is A"),
+    ([A, B, A], None, None),
+    # A single candidate is never an agreement, however many were asked for
+    ([A], None, None),
+    ([A], 2, None),
+    ([A, A], 3, None),
+    ([A, A, A], 3, "There is A"),
+])
+def test_agreed_output(outputs, k, agreed):
+    assert current_results.agreed_output(outputs, k) == agreed
+
+def test_adaptive_ensemble_keeps_asking_after_a_failed_model(ensemble, monkeypatch):
+    monkeypatch.setattr(current_results, 'adaptive_ensemble', True)
+    second_model = current_results.temp_models[1]
+    ensemble['answers'][second_model] = None
+
+    assert current_results.process_sentence('Report.', 'Sentence') == "There is A"
+    assert ensemble['asked'] == current_results.temp_models[:3]
+    assert ensemble['selected'] == []
+
+def test_adaptive_ensemble_stops_once_candidates_agree(ensemble, monkeypatch):
+    monkeypatch.setattr(current_results, 'adaptive_ensemble', True)
+    assert current_results.process_sentence('Report.', 'Sentence') == "There is A"
+    assert ensemble['asked'] == current_results.temp_models[:2]
+
+def test_single_surviving_candidate_goes_to_selection(ensemble, monkeypatch):
+    monkeypatch.setattr(current_results, 'adaptive_ensemble', False)
+    for model_name in current_results.temp_models[1:]:
+        ensemble['answers'][model_name] = None
+
+    assert current_results.process_sentence('Report.', 'Sentence') == "There is A"
+    assert ensemble['selected'] == [[A]]
+
+def test_batched_adaptive_ensemble_keeps_asking_after_a_failed_model(ensemble, monkeypatch):
+    monkeypatch.setattr(current_results, 'adaptive_ensemble', True)
+    monkeypatch.setattr(current_results, 'batch_sentences', True)
+    ensemble['answers'][current_results.temp_models[0]] = None
+
+    assert current_results.process_sentences_batched('Report.', ['One', 'Two']) == ["There is A", "There is A"]
+    assert ensemble['asked'] == current_results.temp_models[:3]
+    assert ensemble['selected'] == []
+
+def test_by_model_adaptive_ensemble_keeps_asking_after_a_failed_model(ensemble, monkeypatch):
+    monkeypatch.setattr(current_results, 'adaptive_ensemble', True)
+    ensemble['answers'][current_results.temp_models[1]] = None
+
+    items = [('Report.', 'One'), ('Report.', 'Two')]
+    assert current_results.process_sentences_by_model(items) == ["There is A", "There is A"]
+    assert sorted(set(ensemble['asked'])) == sorted(current_results.temp_models[:3])
+    assert ensemble['selected'] == []
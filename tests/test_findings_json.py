@@ -0,0 +1,43 @@
+from findings_json import extract_batch_findings, extract_json_from_response, json_object_complete
+
+def test_structured_output_is_returned_as_is():
+    assert extract_json_from_response('{"Findings": "There is no fracture"}') == {"Findings": "There is no fracture"}
+
+def test_object_is_found_in_surrounding_text():
+    response = 'Here you go: {"Findings": "There is a nodule"} Hope this helps.'
+    assert extract_json_from_response(response) == {"Findings": "There is a nodule"}
+
+def test_last_object_with_findings_wins():
+    response = '{"Findings": "draft"} {"note": "x"} {"Findings": "There is an effusion"} {"other": 1}'
+    assert extract_json_from_response(response) == {"Findings": "There is an effusion"}
+
+def test_python_style_dict_is_accepted():
+    assert extract_json_from_response("Answer: {'Findings': 'There is a {small} cyst'}") == \
+        {"Findings": "There is a {small} cyst"}
+
+def test_braces_inside_strings_do_not_end_the_object():
+    response = 'x {"Findings": "There is a } brace"} y'
+    assert extract_json_from_response(response) == {"Findings": "There is a } brace"}
+
+def test_invalid_response_is_an_error():
+    assert extract_json_from_response('no json here {broken') == {"Error": "Invalid JSON"}
+
+def test_batch_findings_by_sentence_number():
+    response = '{"Sentences": [{"Sentence": 1, "Findings": "There is A"}, {"Sentence": "2", "Findings": "There is B"}]}'
+    assert extract_batch_findings(response, 2) == {1: "There is A", 2: "There is B"}
+
+def test_batch_findings_leave_out_malformed_entries():
+    response = ('[{"Sentence": 1, "Findings": "There is A"}, {"Sentence": 1, "Findings": "There is A2"}, '
+                '{"Sentence": 3, "Findings": "There is C"}, {"Sentence": 4, "Findings": "out of range"}, '
+                '{"Sentence": true, "Findings": "bool"}, {"Sentence": 2, "Findings": null}, "junk"]')
+    # Sentence 1 is repeated, 4 is out of range, True is not a number and 2 has no findings
+    assert extract_batch_findings(response, 3) == {3: "There is C"}
+
+def test_batch_findings_of_unparseable_response():
+    assert extract_batch_findings('sorry', 2) == {}
+
+def test_json_object_complete_waits_for_the_closing_brace():
+    assert not json_object_complete('{"Findings": "There is')
+    assert not json_object_complete('{"Findings": "a } b')
+    assert json_object_complete('{"Findings": "There is A"}')
+    assert not json_object_complete('no object yet')
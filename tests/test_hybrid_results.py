@@ -0,0 +1,52 @@
+import csv
+
+import benchmark
+import hybrid_results
+import ollama_client
+
+# Function to read the rows of a CSV file
+def read_rows(path):
+    with open(path, 'r', encoding='utf-8') as infile:
+        return list(csv.DictReader(infile))
+
+def test_statement_problems():
+    assert hybrid_results.statement_problems("There is a rib fracture") == []
+    assert hybrid_results.statement_problems("Rib fracture") == ['format']
+    assert hybrid_results.statement_problems("There is possible effusion") == ['speculative']
+    assert hybrid_results.statement_problems("There is effusion and atelectasis") == ['conjunction']
+
+def test_sentences_with_failing_or_missing_statements_are_escalated():
+    sentences = ["Left pleural effusion", "Rib fracture", "Heart size normal"]
+    statements = ["There is left pleural effusion", "There is possible rib fracture"]
+    attributed, unattributed = hybrid_results.attribute_statements(statements, sentences)
+    assert attributed == [[statements[0]], [statements[1]], []]
+    assert unattributed == []
+    assert [hybrid_results.escalation_reason(sentence, sentence_statements)
+            for sentence, sentence_statements in zip(sentences, attributed)] == [None, 'speculative', 'missing']
+
+def test_rows_are_written_with_findings(fake_ollama, reports_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(hybrid_results, 'error_csv_path', str(tmp_path / 'error.csv'))
+    monkeypatch.setattr(hybrid_results, 'escalation', hybrid_results.EscalationStats())
+    output_path = str(tmp_path / 'output.csv')
+    hybrid_results.process_csv_file(reports_csv, output_path)
+
+    assert read_rows(str(tmp_path / 'error.csv')) == []
+    assert all(row['Findings'] for row in read_rows(output_path) if row['report_content'])
+    assert 0 < hybrid_results.escalation.stats()['escalation_rate'] < 1
+
+def test_rows_without_any_findings_go_to_the_error_file(reports_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(ollama_client, 'retry_base_delay', 0.0)
+    ollama_client.configure(backend=benchmark.FakeOllama(latency=0, failure_rate=1.0))
+    monkeypatch.setattr(hybrid_results, 'error_csv_path', str(tmp_path / 'error.csv'))
+    monkeypatch.setattr(hybrid_results, 'escalation', hybrid_results.EscalationStats())
+    output_path = str(tmp_path / 'output.csv')
+    try:
+        hybrid_results.process_csv_file(reports_csv, output_path)
+    finally:
+        ollama_client.configure()
+
+    reports = [row for row in read_rows(reports_csv) if row['report_content']]
+    assert read_rows(output_path) == []
+    assert len(read_rows(str(tmp_path / 'error.csv'))) == len(reports)
+    with open(output_path + '.journal', 'r', encoding='utf-8') as journal:
+        assert journal.read().count('"status": "error"') == len(reports)
@@ -0,0 +1,88 @@
+import csv
+
+import pytest
+
+import current_results
+import final_results
+import incremental
+
+ROW = {'full_path': 'a/chest.txt', 'report_content': 'No fracture.'}
+
+# Function to read the rows of a CSV file
+def read_rows(path):
+    with open(path, 'r', encoding='utf-8') as infile:
+        return list(csv.DictReader(infile))
+
+# Function to write rows to a CSV file
+def write_rows(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def test_fingerprint_follows_content_and_config():
+    digest = incremental.config_hash({'model': 'a'})
+    assert incremental.row_fingerprint(ROW, digest) == incremental.row_fingerprint(dict(ROW), digest)
+    assert incremental.row_fingerprint({**ROW, 'report_content': 'No effusion.'}, digest) != \
+        incremental.row_fingerprint(ROW, digest)
+    assert incremental.row_fingerprint(ROW, incremental.config_hash({'model': 'b'})) != \
+        incremental.row_fingerprint(ROW, digest)
+
+def test_manifest_carries_findings_of_unchanged_rows(tmp_path):
+    path = str(tmp_path / 'output.csv.manifest.json')
+    manifest = incremental.Manifest({'model': 'a'})
+    manifest.record(ROW, 'There is no fracture')
+    manifest.write(path)
+
+    assert incremental.Manifest({'model': 'a'}, path).previous_findings(ROW) == 'There is no fracture'
+    assert incremental.Manifest({'model': 'a'}, path).previous_findings({**ROW, 'report_content': 'x'}) is None
+    # A configuration change invalidates every row
+    assert incremental.Manifest({'model': 'b'}, path).previous_findings(ROW) is None
+
+@pytest.mark.parametrize('module', [final_results, current_results])
+def test_incremental_run_only_processes_changed_rows(module, fake_ollama, reports_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(module, 'error_csv_path', str(tmp_path / 'error.csv'))
+    output_path = str(tmp_path / 'output.csv')
+    module.process_csv_file(reports_csv, output_path, incremental_run=True)
+    first_rows = read_rows(output_path)
+
+    rows = read_rows(reports_csv)
+    rows[3]['report_content'] += ' No pleural effusion.'
+    changed_csv = str(tmp_path / 'changed.csv')
+    write_rows(changed_csv, rows)
+    extracted = []
+    def changed_extract_findings(report_content, *args, **kwargs):
+        extracted.append(report_content)
+        return {"Findings": "There is a change"}
+    monkeypatch.setattr(module, 'extract_findings', changed_extract_findings)
+    module.process_csv_file(changed_csv, output_path, incremental_run=True)
+
+    assert extracted == [rows[3]['report_content']]
+    second_rows = read_rows(output_path)
+    column = 'Key Findings' if module is final_results else 'Findings'
+    assert second_rows[3][column] == 'There is a change'
+    assert [row[column] for index, row in enumerate(second_rows) if index != 3] == \
+        [row[column] for index, row in enumerate(first_rows) if index != 3]
+
+@pytest.mark.parametrize('module', [final_results, current_results])
+def test_resumed_run_keeps_rows_written_before_the_interruption(module, fake_ollama, reports_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(module, 'error_csv_path', str(tmp_path / 'error.csv'))
+    output_path = str(tmp_path / 'output.csv')
+    extract_findings = module.extract_findings
+    extracted = []
+    def interrupted_extract_findings(*args, **kwargs):
+        if len(extracted) == 5:
+            raise KeyboardInterrupt
+        extracted.append(args)
+        return extract_findings(*args, **kwargs)
+    monkeypatch.setattr(module, 'extract_findings', interrupted_extract_findings)
+    with pytest.raises(KeyboardInterrupt):
+        module.process_csv_file(reports_csv, output_path, incremental_run=True)
+    monkeypatch.setattr(module, 'extract_findings', extract_findings)
+    module.process_csv_file(reports_csv, output_path, resume=True, incremental_run=True)
+
+    # The manifest written by the resumed run covers every row, so nothing is processed again
+    calls_before = fake_ollama.calls
+    module.process_csv_file(reports_csv, str(tmp_path / 'next.csv'), incremental_run=True,
+                            previous_output_path=output_path)
+    assert fake_ollama.calls == calls_before
@@ -0,0 +1,35 @@
+import pytest
+
+from rule_engine import RuleEngine
+
+@pytest.mark.parametrize('sentence, findings, rule', [
+    ("No fracture.", "There is no fracture", 'no'),
+    ("No evidence of pneumothorax is seen", "There is no pneumothorax", 'no_evidence_of'),
+    ("There is no pleural effusion.", "There is no pleural effusion", 'there_is_no'),
+    ("The heart is normal", "There is normal heart", 'is_normal'),
+    ("Heart size within normal limits", "There is normal heart size", 'is_normal'),
+    ("Normal cardiac silhouette", "There is normal cardiac silhouette", 'normal'),
+    ("The mediastinum is unremarkable", "There is no abnormality at mediastinum", 'is_unremarkable'),
+    ("The lungs are clear", "There is clear lungs", 'lungs_clear'),
+])
+def test_formulaic_sentences_are_answered_by_rule(sentence, findings, rule):
+    assert RuleEngine().apply(sentence) == (findings, rule)
+
+@pytest.mark.parametrize('sentence', [
+    "No fracture of the left wrist",
+    "No acute fracture or dislocation",
+    "No definite fracture",
+    "No previous fracture",
+    "No possible effusion",
+    "Mild cardiomegaly",
+    "No one two three four five six",
+])
+def test_other_sentences_go_to_the_model(sentence):
+    assert RuleEngine().apply(sentence) == (None, None)
+
+def test_hits_are_counted_per_rule():
+    engine = RuleEngine()
+    for sentence in ("No fracture.", "No effusion", "Mild cardiomegaly"):
+        engine.match(sentence)
+    counters = engine.stats()
+    assert (counters['sentences'], counters['hits'], counters['by_rule']['no']) == (3, 2, 2)
@@ -0,0 +1,85 @@
+import csv
+import shutil
+
+import pytest
+
+import final_results
+import ollama_client
+import sharding
+
+# Function to read the rows of a CSV file
+def read_rows(path):
+    with open(path, 'r', encoding='utf-8') as infile:
+        return list(csv.DictReader(infile))
+
+# Function to write rows to a CSV file
+def write_rows(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+# Fixture keeping the fake backend through the configure() call of the pipeline's command line, and the
+# pipeline settings it changes to the ones of this test
+@pytest.fixture
+def shard_pipeline(fake_ollama, monkeypatch):
+    configure = ollama_client.configure
+    monkeypatch.setattr(ollama_client, 'configure', lambda **kwargs: configure(backend=fake_ollama))
+    for name in final_results.SETTINGS:
+        monkeypatch.setattr(final_results, name, getattr(final_results, name))
+    return fake_ollama
+
+# Fixture splitting the committed reports into two shards and running both
+@pytest.fixture
+def shard_manifest(shard_pipeline, reports_csv, tmp_path):
+    manifest_path = sharding.split_csv(reports_csv, str(tmp_path / 'shards'), 2)
+    for shard in range(2):
+        sharding.run_shard(manifest_path, shard)
+    return manifest_path
+
+def test_merge_restores_input_order(shard_manifest, reports_csv, tmp_path, monkeypatch):
+    output_path = str(tmp_path / 'merged.csv')
+    summary = sharding.merge_shards(shard_manifest, output_path, str(tmp_path / 'merged_errors.csv'))
+
+    monkeypatch.setattr(final_results, 'error_csv_path', str(tmp_path / 'error.csv'))
+    direct_path = str(tmp_path / 'direct.csv')
+    final_results.process_csv_file(reports_csv, direct_path)
+    assert read_rows(output_path) == read_rows(direct_path)
+    assert summary['missing'] == 0
+
+def test_merge_fails_on_duplicated_rows(shard_manifest, tmp_path):
+    results_path = sharding.load_manifest(shard_manifest)['shards'][0]['results']
+    rows = read_rows(results_path)
+    write_rows(results_path, rows[:1] + rows)
+    with pytest.raises(ValueError, match='duplicated'):
+        sharding.merge_shards(shard_manifest, str(tmp_path / 'merged.csv'), str(tmp_path / 'merged_errors.csv'))
+
+def test_merge_fails_on_missing_rows_unless_allowed(shard_manifest, tmp_path):
+    results_path = sharding.load_manifest(shard_manifest)['shards'][1]['results']
+    write_rows(results_path, read_rows(results_path)[1:])
+    output_path = str(tmp_path / 'merged.csv')
+    error_path = str(tmp_path / 'merged_errors.csv')
+    with pytest.raises(ValueError, match='missing'):
+        sharding.merge_shards(shard_manifest, output_path, error_path)
+    assert sharding.merge_shards(shard_manifest, output_path, error_path, allow_missing=True)['missing'] == 1
+
+def test_merge_refuses_results_of_another_input(shard_manifest, shard_pipeline, reports_csv, tmp_path):
+    other_csv = str(tmp_path / 'other.csv')
+    write_rows(other_csv, read_rows(reports_csv)[:-1])
+    other_manifest = sharding.split_csv(other_csv, str(tmp_path / 'other_shards'), 2)
+    sharding.run_shard(other_manifest, 1)
+    other_results = sharding.load_manifest(other_manifest)['shards'][1]['results']
+    results = sharding.load_manifest(shard_manifest)['shards'][1]['results']
+    for suffix in ('', sharding.SOURCE_SUFFIX):
+        shutil.copy(other_results + suffix, results + suffix)
+
+    with pytest.raises(ValueError, match='different input'):
+        sharding.merge_shards(shard_manifest, str(tmp_path / 'merged.csv'), str(tmp_path / 'merged_errors.csv'))
+    with pytest.raises(ValueError, match='different input'):
+        sharding.run_shard(shard_manifest, 1, extra_args=['--resume'])
+
+@pytest.mark.parametrize('extra_args', [['--output-mode', 'split'], ['--output-mode=keys']])
+def test_run_refuses_output_modes_the_merge_cannot_read(shard_pipeline, reports_csv, tmp_path, extra_args):
+    manifest_path = sharding.split_csv(reports_csv, str(tmp_path / 'shards'), 2)
+    with pytest.raises(ValueError, match='output-mode full'):
+        sharding.run_shard(manifest_path, 0, extra_args=extra_args)
@@ -0,0 +1,37 @@
+import pytest
+
+import text_processing
+
+@pytest.mark.parametrize('text, sentences', [
+    ("No fracture. Normal alignment.", ["No fracture", "Normal alignment"]),
+    ("A 2.5 cm nodule. No effusion.", ["A 2.5 cm nodule", "No effusion"]),
+    ("no fracture.the heart is normal", ["no fracture", "the heart is normal"]),
+    ("Small effusion, e.g. on the left. Heart normal.", ["Small effusion, e.g. on the left", "Heart normal"]),
+    ("Appearances i.e. typical of a cyst.", ["Appearances i.e. typical of a cyst"]),
+    ("Approx. 3 cm mass. Lungs clear.", ["Approx. 3 cm mass", "Lungs clear"]),
+    ("Rib no. 5 is fractured. No other injury.", ["Rib no. 5 is fractured", "No other injury"]),
+    ("There is no. Nothing else.", ["There is no", "Nothing else"]),
+    ("  Trailing space.  ", ["Trailing space"]),
+    ("", []),
+])
+def test_split_sentences(text, sentences):
+    assert text_processing.split_sentences(text) == sentences
+
+def test_split_sentences_matches_the_previous_split_without_decimals_or_abbreviations():
+    text = "The lungs are clear. No pleural effusion.\nHeart size normal."
+    assert text_processing.split_sentences(text) == [sentence.strip() for sentence in
+                                                     text_processing.legacy_split_sentences(text) if sentence.strip()]
+
+def test_dedup_findings_keeps_the_first_copy():
+    assert text_processing.dedup_findings(["There is A", "there is a", "There is B"]) == ["There is A", "There is B"]
+
+def test_dedup_findings_drops_near_duplicates_with_a_threshold():
+    findings = ["There is a small left pleural effusion", "There is a small left pleural effusions", "There is B"]
+    assert text_processing.dedup_findings(findings) == findings
+    assert text_processing.dedup_findings(findings, 0.7) == [findings[0], findings[2]]
+
+def test_near_duplicate_index_finds_similar_text():
+    index = text_processing.NearDuplicateIndex(threshold=0.5)
+    index.add('a', "There is a small left pleural effusion")
+    assert index.query("There is a small left pleural effusion noted") is not None
+    assert index.query("The heart size is normal") is None
@@ -0,0 +1,274 @@
+import csv
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from difflib import SequenceMatcher
+
+# Post-processing of report text and model findings with patterns compiled once at import.
+#
+# split_sentences    sentence splitting that keeps decimals ("2.5 cm") and abbreviations ("approx.",
+#                    "e.g.") inside their sentence
+# normalize_text     the deduplication key of a sentence or finding, also in batches
+# dedup_findings     order-preserving dedup of findings, exact or near-duplicate
+# NearDuplicateIndex MinHash/LSH index over character shingles, so near duplicates are found without
+#                    comparing every pair of statements
+#
+# Usage: python text_processing.py [repeat]   (microbenchmark against the previous implementations)
+
+UNWANTED_SYMBOLS = re.compile(r"[\[\]']")
+# Full stops that do not end a sentence, left behind by models in the middle of statements
+STRAY_FULL_STOP = re.compile(r'\.(?!\s|$)')
+STATEMENT_SEPARATOR = re.compile(r';\s*')
+THERE_ARE = re.compile(r'^There are')
+WHITESPACE = re.compile(r'\s+')
+# Sentence ends: a full stop and the whitespace after it, unless a digit follows straight away as in
+# decimals ("2.5 cm"); a letter straight after it still starts a new sentence ("no fracture.the heart")
+SENTENCE_END = re.compile(r'\.(?!\d)\s*')
+NUMBER_AHEAD = re.compile(r'\s*\d')
+WORD = re.compile(r'[a-z0-9]+')
+
+# Abbreviations whose full stop does not end a sentence
+ABBREVIATIONS = frozenset({'approx', 'e.g', 'i.e', 'vs', 'cf', 'incl', 'esp', 'fig', 'figs', 'ref', 'dr', 'mr', 'mrs', 'ms', 'prof'})
+# Endings of the text before a full stop that may be an abbreviation, including "no" as in "no. 3"
+ABBREVIATION_WORDS = frozenset(word for abbreviation in ABBREVIATIONS | {'no'}
+                               for word in (abbreviation, abbreviation.capitalize(), abbreviation.upper()))
+# First letters of dotted abbreviations ("e" of "e.g"), which the split separates from the rest
+DOTTED_PREFIXES = frozenset(word.partition('.')[0] for word in ABBREVIATION_WORDS if '.' in word)
+
+# Function to return the last word of a text (the whole text when it has no spaces or line breaks)
+def last_word(text):
+    return text.rpartition(' ')[2].rpartition('\n')[2]
+
+# Function to tell whether the full stop after text joins the two halves of a dotted abbreviation ("e" and "g")
+def splits_abbreviation(text, following_text):
+    return f"{last_word(text)}.{following_text.partition(' ')[0]}" in ABBREVIATION_WORDS
+
+# Function to tell whether the full stop after text abbreviates rather than ends the sentence
+def ends_with_abbreviation(text, following_text):
+    if last_word(text) not in ABBREVIATION_WORDS:
+        return False
+    # "no." abbreviates "number" only when a digit follows ("no. 3"), otherwise it ends a sentence
+    return text[-2:].lower() != 'no' or NUMBER_AHEAD.match(following_text) is not None
+
+# Function to split text into sentences without their final full stop, like the previous
+# re.split(r'\.\s*', ...) but keeping decimals and abbreviations inside their sentence
+def split_sentences(text):
+    pieces = SENTENCE_END.split(text.strip())
+    if any(last_word(piece) in ABBREVIATION_WORDS or last_word(piece) in DOTTED_PREFIXES for piece in pieces):
+        # Join each piece ending in an abbreviation back onto the piece after it
+        merged = [pieces[0]]
+        for piece in pieces[1:]:
+            if splits_abbreviation(merged[-1], piece):
+                merged[-1] += '.' + piece
+            elif ends_with_abbreviation(merged[-1], piece):
+                merged[-1] += '. ' + piece
+            else:
+                merged.append(piece)
+        pieces = merged
+    return [sentence for sentence in map(str.strip, pieces) if sentence]
+
+# Function to normalise a sentence or finding so that trivially different copies share one key
+def normalize_text(text):
+    return WHITESPACE.sub(' ', text).strip().strip('.,;: ').lower()
+
+# Function to normalise a batch of texts
+def normalize_batch(texts):
+    sub = WHITESPACE.sub
+    return [sub(' ', text).strip().strip('.,;: ').lower() for text in texts]
+
+# Function to split a findings string into its statements
+def split_statements(findings):
+    return [statement for statement in STATEMENT_SEPARATOR.split(findings) if statement.strip()]
+
+# Function to build the set of character shingles of a text, hashed to integers
+def shingles(text, size=4):
+    text = ' '.join(WORD.findall(text.lower()))
+    if len(text) <= size:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[index:index + size].encode('utf-8')) for index in range(len(text) - size + 1)}
+
+# Function to compute the Jaccard similarity of two shingle sets
+def jaccard(shingles1, shingles2):
+    if not shingles1 and not shingles2:
+        return 1.0
+    return len(shingles1 & shingles2) / len(shingles1 | shingles2)
+
+# MinHash signatures bucketed by locality sensitive hashing: texts sharing any band of their signature
+# become candidates, and only the candidates are compared exactly
+class NearDuplicateIndex:
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, shingle_size=4):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # The hash permutations are seeded, so signatures are the same in every process
+        permutation_random = random.Random(0)
+        self._permutations = [(permutation_random.randrange(1, self._PRIME), permutation_random.randrange(self._PRIME))
+                              for _ in range(num_perm)]
+        self._buckets = {}
+        self._entries = []
+
+    def signature(self, shingle_set):
+        prime = self._PRIME
+        return [min((a * shingle + b) % prime for shingle in shingle_set) for a, b in self._permutations]
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    # Function to add a text under a key (any object, e.g. the text itself or a row index)
+    def add(self, key, text):
+        shingle_set = shingles(text, self.shingle_size)
+        entry_index = len(self._entries)
+        self._entries.append((key, shingle_set))
+        for band_key in self._band_keys(self.signature(shingle_set)):
+            self._buckets.setdefault(band_key, []).append(entry_index)
+
+    def _candidate_entries(self, shingle_set):
+        collisions = {}
+        for band_key in self._band_keys(self.signature(shingle_set)):
+            for entry_index in self._buckets.get(band_key, ()):
+                collisions[entry_index] = collisions.get(entry_index, 0) + 1
+        return collisions
+
+    # Function to list the keys of the indexed texts sharing a band with a text, those sharing most bands
+    # (the most similar, in expectation) first
+    def candidates(self, text, limit=None):
+        collisions = self._candidate_entries(shingles(text, self.shingle_size))
+        ranked = sorted(collisions, key=lambda entry_index: (-collisions[entry_index], entry_index))
+        return [self._entries[entry_index][0] for entry_index in ranked[:limit]]
+
+    # Function to find the most similar indexed text, returning (key, similarity) or None below the threshold
+    def query(self, text):
+        shingle_set = shingles(text, self.shingle_size)
+        best = None
+        for entry_index in self._candidate_entries(shingle_set):
+            key, candidate_shingles = self._entries[entry_index]
+            similarity = jaccard(shingle_set, candidate_shingles)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def __len__(self):
+        return len(self._entries)
+
+# Function to remove duplicate findings while keeping their order; with a threshold, findings whose
+# shingles overlap an earlier finding by at least that Jaccard similarity are dropped as well
+def dedup_findings(findings, threshold=None):
+    seen = set()
+    index = NearDuplicateIndex(threshold) if threshold is not None else None
+    unique_findings = []
+    for finding in findings:
+        key = finding.lower()
+        if key in seen:
+            continue
+        if index is not None:
+            if index.query(finding) is not None:
+                continue
+            index.add(key, finding)
+        seen.add(key)
+        unique_findings.append(finding)
+    return unique_findings
+
+# Function to clean a batch of findings strings the way current_results.clean_findings does
+def clean_findings_batch(findings_list):
+    cleaned = []
+    for findings in findings_list:
+        findings = STRAY_FULL_STOP.sub('', UNWANTED_SYMBOLS.sub('', findings))
+        statements = [THERE_ARE.sub('There is', statement.strip()) for statement in STATEMENT_SEPARATOR.split(findings)]
+        cleaned.append('; '.join(dedup_findings(statements)))
+    return cleaned
+
+# Previous implementations from current_results.py, kept as the baseline of the microbenchmark
+def legacy_split_sentences(report_content):
+    return [s.strip() for s in re.split(r'\.\s*', report_content.strip()) if s.strip()]
+
+def legacy_normalize_sentence(sentence):
+    return re.sub(r'\s+', ' ', sentence).strip().strip('.,;: ').lower()
+
+def legacy_clean_findings(findings):
+    cleaned_findings = re.sub(r"[\[\]']", "", findings)
+    cleaned_findings = re.sub(r'\.(?!\s|$)', '', cleaned_findings)
+    statements = re.split(r';\s*', cleaned_findings)
+    updated_statements = []
+    seen_statements = set()
+    for statement in statements:
+        updated_statement = re.sub(r'^There are', 'There is', statement.strip())
+        if updated_statement.lower() not in seen_statements:
+            seen_statements.add(updated_statement.lower())
+            updated_statements.append(updated_statement)
+    return '; '.join(updated_statements)
+
+def legacy_near_duplicates(statements, threshold):
+    return [index for index, statement in enumerate(statements)
+            if any(SequenceMatcher(None, statement, earlier).ratio() > threshold for earlier in statements[:index])]
+
+# Function to find the statements that nearly duplicate an earlier one with the index
+def near_duplicates(statements, threshold):
+    index = NearDuplicateIndex(threshold)
+    duplicates = []
+    for position, statement in enumerate(statements):
+        if index.query(statement) is not None:
+            duplicates.append(position)
+        index.add(position, statement)
+    return duplicates
+
+# Function to time a function over repeated calls, returning seconds per call and its last result
+def time_calls(function, argument, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function(argument)
+    return (time.perf_counter() - started) / repeat, result
+
+# Function to compare the engine with the previous implementations on the committed result CSVs
+def microbenchmark(repeat=20):
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    reports, findings = [], []
+    for file_name, column in (('current_results.csv', 'Findings'), ('final_results.csv', 'Key Findings')):
+        with open(os.path.join(package_dir, file_name), 'r', encoding='utf-8') as infile:
+            for row in csv.DictReader(infile):
+                reports.append(row['report_content'])
+                findings.append(row[column])
+    sentences = [sentence for report in reports for sentence in legacy_split_sentences(report)]
+    statements = [statement.strip() for finding in findings for statement in split_statements(finding)]
+
+    comparisons = [
+        ('split_sentences', reports, lambda texts: [legacy_split_sentences(text) for text in texts],
+         lambda texts: [split_sentences(text) for text in texts]),
+        ('normalize', sentences, lambda texts: [legacy_normalize_sentence(text) for text in texts], normalize_batch),
+        ('clean_findings', findings, lambda texts: [legacy_clean_findings(text) for text in texts], clean_findings_batch),
+        # Near-duplicate search is quadratic in the old form, so it runs fewer times
+        ('near_duplicates', statements, lambda texts: legacy_near_duplicates(texts, 0.9),
+         lambda texts: near_duplicates(texts, 0.9)),
+    ]
+    results = []
+    for name, inputs, legacy_function, function in comparisons:
+        runs = max(1, repeat // 10) if name == 'near_duplicates' else repeat
+        legacy_seconds, legacy_result = time_calls(legacy_function, inputs, runs)
+        seconds, result = time_calls(function, inputs, runs)
+        if name == 'near_duplicates':
+            differences = len(set(legacy_result) ^ set(result))
+        else:
+            differences = sum(old != new for old, new in zip(legacy_result, result))
+        results.append({
+            'function': name,
+            'inputs': len(inputs),
+            'legacy_ms': round(legacy_seconds * 1000, 3),
+            'new_ms': round(seconds * 1000, 3),
+            'speedup': round(legacy_seconds / seconds, 2) if seconds else None,
+            'different_outputs': differences,
+        })
+    return results
+
+if __name__ == '__main__':
+    columns = ['function', 'inputs', 'legacy_ms', 'new_ms', 'speedup', 'different_outputs']
+    print(' '.join(f"{column:>18}" for column in columns))
+    for result in microbenchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20):
+        print(' '.join(f"{str(result[column]):>18}" for column in columns))